@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, time, json, argparse, itertools, platform, tempfile, shutil                             # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+import numpy as np, cv2
+from utils import variance_selection
+from frame_statistics import FrameStatistics
+from simulated_camera import SimulatedCamera
+from acquisition_pipeline import AcquisitionPipeline
+from frame_storage import open_storage
+from frame_scheduler import FrameScheduler
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Slow disk writer class:
+# wraps cv2.imwrite and waits for the time a storage device with the given bandwidth [MB/s] and per-file latency [ms] would take (eg: a cheap USB stick)
+#
+# Input:    - bandwidth: write bandwidth [MB/s] (None = no limit)
+#           - latency: per-file latency [ms]
+
+class SlowDiskWriter(object):
+
+    def __init__(self, bandwidth=None, latency=0.0):
+
+        self.bandwidth = bandwidth
+        self.latency = latency
+
+
+    def __call__(self, path, frame, metadata=None):
+
+        t_start = time.perf_counter()
+        save_status = cv2.imwrite(path, frame)
+        delay = self.latency/1000 + (os.path.getsize(path)/1e6/self.bandwidth if self.bandwidth and save_status else 0.0)
+        remaining = delay - (time.perf_counter() - t_start)
+        if remaining > 0: time.sleep(remaining)
+
+        return save_status
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Synchronous writer class:
+# same 'submit' interface of AcquisitionPipeline, but the frame is written in the capture loop (original behaviour of variance_selection)
+
+class SynchronousWriter(object):
+
+    def __init__(self, writer):
+
+        self.writer = writer
+
+
+    def submit(self, path, frame, metadata=None):
+
+        return bool(self.writer(path, frame, metadata))
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Single benchmark run method:
+# drives the acquisition path of start_offline_acquisition (grab -> variance_selection -> save) against a simulated camera for a fixed number of frames
+#
+# Input:    - config: dictionary of benchmark settings (see DEFAULT_CONFIG)
+#           - target: directory where the frames are written
+#
+# Return:   - result: dictionary with sustained fps, p50/p99 per-frame latency [ms], CPU% and dropped frames
+
+DEFAULT_CONFIG = {'width': 1280, 'height': 1024, 'image_extension': 'tif', 'fps': None, 'n_frames': 200,
+                  'sleep_option': False, 'time_sleep': 0.0, 'label': True, 'var_treshold': 5, 'stats_stride': 1,
+                  'object_probability': 0.25, 'pipeline': True, 'queue_depth': 64, 'n_writers': 2, 'drop_policy': 'block',
+                  'disk_bandwidth': None, 'disk_latency': 0.0, 'storage_format': 'tiff', 'chunk_size': 64, 'compression': None}
+
+def run_benchmark(config, target):
+
+    config = dict(DEFAULT_CONFIG, **config)
+    save_path = tempfile.mkdtemp(prefix='holo_bench_', dir=target)+'/'
+
+    camera = SimulatedCamera(None, 0.01, 220, False, fps=config['fps'], size=(config['width'], config['height']),
+                             object_probability=config['object_probability'], frame_stats=FrameStatistics(stride=config['stats_stride']), seed=0)
+    camera.connect()
+    bkg_var = float(np.mean([camera.grab_image()[1] for i in range(10)]))                               # Background variance over the first frames
+    camera.missed_frames = 0
+
+    if config['storage_format'] == 'tiff': writer = SlowDiskWriter(config['disk_bandwidth'], config['disk_latency'])
+    else: writer = open_storage(config['storage_format'], save_path, chunk_size=config['chunk_size'], compression=config['compression'])
+    if config['pipeline']:
+        pipeline = AcquisitionPipeline(config['queue_depth'], config['n_writers'], config['drop_policy'], writer=writer)
+        pipeline.start()
+    else: pipeline = SynchronousWriter(writer)
+
+    latencies, saved = [], 0
+    scheduler = FrameScheduler(config['time_sleep'] if config['sleep_option'] else 0.0)
+    cpu_start, t_start = time.process_time(), time.perf_counter()
+    for image_index in range(config['n_frames']):
+
+        frame, frame_var, frame_dev = camera.grab_image()
+        t_grabbed = time.perf_counter()
+        frame_name = 'image_'+str(image_index).zfill(7)+'.'+config['image_extension']
+        saved += variance_selection(bkg_var, frame_var, config['var_treshold'], save_path, frame_name, frame, config['label'], pipeline=pipeline)
+        latencies.append(time.perf_counter() - t_grabbed)                                               # Per-frame processing latency (from frame available to frame handed off)
+
+        scheduler.wait()
+
+    t_loop = time.perf_counter() - t_start
+    if config['pipeline']: pipeline.close()
+    elif hasattr(writer, 'close'): writer.close()
+    t_total = time.perf_counter() - t_start
+    cpu_total = time.process_time() - cpu_start
+    camera.disconnect()
+
+    stats = pipeline.stats() if config['pipeline'] else {'dropped': 0, 'failed': 0, 'written': saved}
+    latencies = np.array(latencies)*1000
+    result = {'config': config,
+              'frames': config['n_frames'],
+              'frames_kept': int(saved),
+              'frames_written': int(stats['written']),
+              'sustained_fps': config['n_frames']/t_total,
+              'capture_fps': config['n_frames']/t_loop,
+              'latency_p50_ms': float(np.percentile(latencies, 50)),
+              'latency_p99_ms': float(np.percentile(latencies, 99)),
+              'cpu_percent': 100*cpu_total/t_total,
+              'dropped_frames': int(stats['dropped']) + int(camera.missed_frames),
+              'dropped_by_pipeline': int(stats['dropped']),
+              'missed_by_sensor': int(camera.missed_frames),
+              'failed_writes': int(stats['failed']),
+              'scheduler_overruns': int(scheduler.overruns),                                            # Frames ready after their deadline (time sleep too short)
+              'max_lateness_ms': scheduler.max_lateness*1000,
+              'files_written': len(os.listdir(save_path)),                                              # Post-run transfer cost: number of files and bytes
+              'bytes_written': sum(os.path.getsize(os.path.join(save_path, name)) for name in os.listdir(save_path))}
+
+    shutil.rmtree(save_path, ignore_errors=True)
+
+    return result
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Benchmark sweep method:
+# runs the benchmark over the cartesian product of the swept settings and collects the results; a null time sleep disables the sleep option and a negative
+# variance treshold disables the variance filter (every frame is saved)
+#
+# Input:    - sweep: dictionary {setting: list of values}
+#           - base_config: settings common to all the runs
+#           - target: directory where the frames are written
+#
+# Return:   - report: dictionary with platform information and the list of results
+
+def run_sweep(sweep, base_config, target):
+
+    results = []
+    names = list(sweep.keys())
+    for values in itertools.product(*[sweep[name] for name in names]):
+        config = dict(base_config, **dict(zip(names, values)))
+        if 'size' in config: config['width'], config['height'] = config.pop('size')
+        config['sleep_option'] = config.get('time_sleep', 0) > 0
+        config['label'] = config.get('var_treshold', 0) >= 0
+        result = run_benchmark(config, target)
+        print('{:<90s} {:>8.2f} fps  p50 {:>7.2f} ms  p99 {:>7.2f} ms  CPU {:>6.1f}%  dropped {:>5d}'.format(
+              ', '.join(name+'='+str(value) for name, value in zip(names, values)), result['sustained_fps'],
+              result['latency_p50_ms'], result['latency_p99_ms'], result['cpu_percent'], result['dropped_frames']), file=sys.stderr)
+        results.append(result)
+
+    return {'platform': {'machine': platform.machine(), 'processor': platform.processor(), 'system': platform.platform(),
+                         'cpu_count': os.cpu_count(), 'python': platform.python_version()},
+            'target': target, 'results': results}
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='End-to-end acquisition benchmark (grab -> variance_selection -> save) on a simulated camera.')
+    parser.add_argument('--target', default='/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), help='directory where the frames are written (tmpfs, USB stick, ...)')
+    parser.add_argument('--n-frames', type=int, default=200, help='number of frames per run')
+    parser.add_argument('--sizes', default='1280x1024,640x512', help='comma separated list of frame sizes WIDTHxHEIGHT')
+    parser.add_argument('--formats', default='tif,png', help='comma separated list of image formats')
+    parser.add_argument('--time-sleep', default='0', help='comma separated list of time sleeps [s] (0 = sleep_option False)')
+    parser.add_argument('--var-treshold', default='5', help='comma separated list of variance filter tresholds (-1 = no filter)')
+    parser.add_argument('--stride', default='1', help='comma separated list of frame statistics strides')
+    parser.add_argument('--storage', default='tiff', help='comma separated list of storage formats (tiff, hdf5, npz)')
+    parser.add_argument('--pipeline', default='0,1', help='comma separated list of 0 (synchronous writes) / 1 (writer pool)')
+    parser.add_argument('--fps', type=float, default=0, help='simulated sensor frame rate (0 = as fast as possible)')
+    parser.add_argument('--disk-bandwidth', type=float, default=0, help='emulated disk bandwidth [MB/s] (0 = no limit)')
+    parser.add_argument('--disk-latency', type=float, default=0, help='emulated per-file write latency [ms]')
+    parser.add_argument('--output', default=None, help='JSON report file (default: standard output)')
+    args = parser.parse_args()
+
+    sweep = {'size': [tuple(int(v) for v in size.split('x')) for size in args.sizes.split(',')],
+             'image_extension': args.formats.split(','),
+             'time_sleep': [float(v) for v in args.time_sleep.split(',')],
+             'var_treshold': [float(v) for v in args.var_treshold.split(',')],
+             'stats_stride': [int(v) for v in args.stride.split(',')],
+             'storage_format': args.storage.split(','),
+             'pipeline': [bool(int(v)) for v in args.pipeline.split(',')]}
+    base_config = {'n_frames': args.n_frames, 'fps': args.fps or None, 'disk_bandwidth': args.disk_bandwidth or None, 'disk_latency': args.disk_latency}
+
+    report = run_sweep(sweep, base_config, args.target)
+
+    if args.output is None: print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as output: json.dump(report, output, indent=2)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, time, argparse, tempfile                                                                # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+import numpy as np
+from simulated_camera import SimulatedCamera
+from frame_storage import FrameFileStorage, FRAME_CODECS, lz4, zstandard
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Frame codecs benchmark:
+# writes the same synthetic holograms of the simulated camera (mono8, with sensor noise) with each lossless frame codec and reports the compression ratio
+# against the encode time, the write time and the resulting write throughput in frames per second (encode + write, single writer thread). Run it with
+# '--target' on the USB stick to include its bandwidth: the best codec is the one with the highest fps, not the highest ratio.
+#
+# Input:    - target: folder where the frames are written (default: a temporary folder)
+#           - n_frames: number of frames written with each codec
+#           - codecs: list of codecs (default: all the available ones), eg: ['tiff', 'png:3'] (codec:level)
+#           - size: frame size (width, height)
+#
+# Return:   - results: dictionary {codec: FrameFileStorage.stats() + fps}
+
+def bench_codecs(target=None, n_frames=50, codecs=None, size=(1280, 1024)):
+
+    camera = SimulatedCamera(None, 0.01, 220, False, fps=None, size=size, seed=0)
+    frames = [camera.generate_hologram() for i in range(min(n_frames, 16))]
+    if codecs is None: codecs = [codec for codec in FRAME_CODECS if (codec != 'lz4' or lz4 is not None) and (codec != 'zstd' or zstandard is not None)]
+
+    results = {}
+    with tempfile.TemporaryDirectory(dir=target) as folder:
+        for codec in codecs:
+            name, level = (codec.split(':') + [None])[:2]
+            storage = FrameFileStorage(name, None if level is None else int(level))
+            t_start = time.perf_counter()
+            for i in range(n_frames): storage(os.path.join(folder, codec.replace(':', '_')+'_'+str(i).zfill(7)+'.tif'), frames[i % len(frames)])
+            elapsed = time.perf_counter() - t_start
+            stats = storage.stats()
+            stats['fps'] = n_frames/elapsed if elapsed > 0 else 0.0
+            results[codec] = stats
+            print('{:<16s} ratio {:6.2f}    encode {:8.2f} ms/frame    write {:8.2f} ms/frame    {:8.1f} fps'.format(codec, stats['ratio'], stats['encode_ms'],
+                                                                                                                   stats['write_ms'], stats['fps']))
+
+    return results
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Lossless frame codecs benchmark on synthetic holograms')
+    parser.add_argument('--target', default=None, help='folder where the frames are written (eg: the USB stick mount point)')
+    parser.add_argument('--frames', type=int, default=50, help='number of frames written with each codec')
+    parser.add_argument('--codecs', nargs='*', default=None, help="codecs, eg: tiff tiff_deflate png:1 zstd:3 (default: all the available ones)")
+    args = parser.parse_args()
+
+    bench_codecs(args.target, args.frames, args.codecs)
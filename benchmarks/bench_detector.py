@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, time, argparse                                                                          # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+import numpy as np
+from simulated_camera import SimulatedCamera
+from background_model import BackgroundModel
+from object_detector import VarianceDetector, TileDetector
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Object detector benchmark:
+# compares the global variance criterion of 'variance_selection' with the tile detector on synthetic holograms of the simulated camera, whose ground truth
+# (empty frame or frame with particles) is known: per-frame cost, recall (hits among the frames with particles) and false positive rate (hits among the
+# empty frames). The particle fringes are made fainter with 'contrast' to emulate small or weakly scattering objects.
+#
+# Input:    - n_frames: number of test frames
+#           - contrast: amplitude of the particle fringes with respect to the default synthetic holograms
+#           - var_treshold: treshold of the variance detector [%]
+#           - repeat: number of timed iterations for the per-frame cost
+#
+# Return:   - results: dictionary {detector: (ms/frame, recall, false positive rate)}
+
+def bench_detector(n_frames=200, contrast=0.3, var_treshold=5, repeat=100):
+
+    camera = SimulatedCamera(None, 0.01, 220, False, fps=None, seed=0)
+    model = BackgroundModel(skip=0)
+    camera.object_probability = 0.0
+    for i in range(32):                                                                                 # Background statistics from empty frames
+        frame = camera.generate_hologram()
+        model.update(frame, np.var(frame))
+    bkg_var = model.variance()[0]
+
+    noise_level = camera.noise_level
+    camera.noise_level, camera.object_probability = 0.0, 0.0
+    beam = camera.generate_hologram().astype(np.float32)                                                # Noiseless beam, to isolate the particle fringes
+    frames, truth = [], []
+    for i in range(n_frames):                                                                           # Every other frame contains particles
+        camera.noise_level, camera.object_probability = noise_level, 0.0
+        frame = camera.generate_hologram()
+        if i % 2 == 1:
+            camera.noise_level, camera.object_probability = 0.0, 1.0
+            fringes = camera.generate_hologram().astype(np.float32) - beam
+            frame = np.clip(frame + contrast*fringes, 0, 255).astype(np.uint8)
+        frames.append(frame)
+        truth.append(i % 2 == 1)
+    truth = np.array(truth)
+
+    tiles = TileDetector()
+    tiles.set_background(model.mean, model.pixel_variance())
+    detectors = {'global variance': VarianceDetector(bkg_var, var_treshold), 'tiles 16x16, stride 2': tiles}
+
+    results = {}
+    for name, detector in detectors.items():
+        hits = np.array([detector(frame, float(np.var(frame)))[0] for frame in frames])
+        t_start = time.perf_counter()
+        for i in range(repeat):                                                                         # The variance detector cost includes np.var
+            frame = frames[i % n_frames]
+            detector(frame, float(np.var(frame)) if name == 'global variance' else None)
+        cost = (time.perf_counter() - t_start)/repeat*1000
+        recall, false_positives = hits[truth].mean(), hits[~truth].mean()
+        results[name] = (cost, recall, false_positives)
+        print('{:<28s}{:>10.3f} ms/frame    recall {:6.1%}    false positives {:6.1%}'.format(name, cost, recall, false_positives))
+
+    return results
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Object detector benchmark on synthetic holograms')
+    parser.add_argument('--frames', type=int, default=200, help='number of test frames')
+    parser.add_argument('--contrast', type=float, default=0.3, help='amplitude of the particle fringes (1 = default synthetic holograms)')
+    parser.add_argument('--var-treshold', type=float, default=5, help='treshold of the variance detector [%%]')
+    args = parser.parse_args()
+
+    bench_detector(args.frames, args.contrast, args.var_treshold)
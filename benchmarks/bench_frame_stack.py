@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, time, argparse, tempfile                                                                # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+import numpy as np, cv2
+from PIL import Image
+from frame_stack import stack_statistics
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Background analysis benchmark:
+# compares the original 'background' loop (PIL open, conversion to array and float64 np.var, one image at a time) with the frame stack statistics (chunked
+# loading and vectorized per-frame and per-pixel statistics) on a folder of synthetic background images, and checks that the mean variances agree.
+#
+# Input:    - n_frames: number of background images
+#           - size: frame size (width, height)
+#           - chunk_size: number of images loaded at a time by the frame stack
+#           - target: folder where the images are written (default: a temporary folder)
+#
+# Return:   - results: dictionary {method: (time [s], mean variance)}
+
+def legacy_background(paths):
+
+    var_list = []
+    for path in paths: var_list.append(np.var(np.array(Image.open(path))))
+
+    return float(np.mean(var_list))
+
+
+def bench_frame_stack(n_frames=500, size=(1280, 1024), chunk_size=256, target=None):
+
+    rng = np.random.default_rng(0)
+    base = rng.integers(60, 120, (size[1], size[0]), dtype=np.uint8)
+
+    results = {}
+    with tempfile.TemporaryDirectory(dir=target) as folder:
+        paths = [os.path.join(folder, 'image_'+str(i).zfill(6)+'.tif') for i in range(n_frames)]
+        for path in paths: cv2.imwrite(path, cv2.add(base, rng.integers(0, 8, base.shape, dtype=np.uint8)))
+
+        t_start = time.perf_counter()
+        var = legacy_background(paths)
+        results['legacy (PIL + np.var)'] = (time.perf_counter() - t_start, var)
+
+        t_start = time.perf_counter()
+        stats = stack_statistics(paths, chunk_size)
+        results['frame stack'] = (time.perf_counter() - t_start, float(np.mean(stats['frame_var'])))
+
+    for name, (elapsed, var) in results.items():
+        print('{:<30s}{:>10.2f} s{:>10.1f} frames/s   mean variance {:.6f}'.format(name, elapsed, n_frames/elapsed, var))
+
+    return results
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Background analysis: per-image loop against frame stack statistics.')
+    parser.add_argument('--frames', type=int, default=500, help='number of background images')
+    parser.add_argument('--size', type=int, nargs=2, default=(1280, 1024), metavar=('WIDTH', 'HEIGHT'), help='frame size')
+    parser.add_argument('--chunk-size', type=int, default=256, help='images loaded at a time by the frame stack')
+    parser.add_argument('--target', default=None, help='folder where the images are written (default: temporary folder)')
+    args = parser.parse_args()
+
+    bench_frame_stack(args.frames, tuple(args.size), args.chunk_size, args.target)
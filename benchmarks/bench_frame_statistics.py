@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, time                                                                                    # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+import numpy as np, cv2
+from frame_statistics import FrameStatistics
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Frame statistics micro-benchmark:
+# compares the per-frame cost of the original grab_image processing (no-op cv2.resize copy + float64 np.var over the full frame) with the FrameStatistics stage
+# in several configurations, on a synthetic Mono8 frame of the size of the IDS sensor.
+#
+# Input:    - height, width: frame size
+#           - repeat: number of timed iterations
+#
+# Return:   - results: dictionary {configuration: mean time per frame [ms]}
+
+def legacy_statistics(frame):
+
+    frame = cv2.resize(frame, (0, 0), fx=1.0, fy=1.0)
+    frame_var = np.var(frame)
+
+    return frame, frame_var, np.sqrt(frame_var)
+
+
+def bench_frame_statistics(height=1024, width=1280, repeat=200):
+
+    frame = np.random.randint(0, 256, (height, width, 1), dtype=np.uint8)
+    configurations = {
+        'legacy (resize + np.var)': legacy_statistics,
+        'no resize, float np.var': FrameStatistics(integer=False),
+        'no resize, integer': FrameStatistics(),
+        'no resize, integer, stride 2': FrameStatistics(stride=2),
+        'no resize, integer, stride 4': FrameStatistics(stride=4),
+        'no resize, integer, ROI 750x750': FrameStatistics(roi=(100, 850, 300, 1050)),
+    }
+
+    results = {}
+    for name, stage in configurations.items():
+        stage(frame)                                                                                    # Warm-up (scratch buffers allocation)
+        t_start = time.perf_counter()
+        for i in range(repeat): stage(frame)
+        results[name] = (time.perf_counter() - t_start)/repeat*1000
+        print('{:<40s}{:>10.3f} ms/frame{:>10.1f}x'.format(name, results[name], results['legacy (resize + np.var)']/results[name]))
+
+    return results
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    bench_frame_statistics()
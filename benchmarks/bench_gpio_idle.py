@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, time, json, argparse                                                                    # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+from camera_backends import GPIO
+from simulated_gpio import SimulatedGPIO
+from gpio_control import GpioController
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# GPIO idle CPU benchmark:
+# measures the CPU time spent while waiting for the ACQUIRE pin (set HIGH by the simulated RaspController after 'duration' seconds) with the original
+# busy-wait loop on GPIO.input and with the GpioController ('poll' mode). Run it on the Raspberry Pi with '--rpi' to use the real RPi.GPIO
+# (the ACQUIRE pin must then be toggled by hand).
+#
+# Input:    - duration: waiting time [s]
+#
+# Return:   - results: dictionary {method: {'cpu_percent', 'reaction_ms', 'gpio_reads'}}
+
+PIN_RUN, PIN_ACQUIRE, PIN_STOP, PIN_EXIT = 14, 15, 17, 23
+
+def wait_busy():
+
+    while GPIO.input(PIN_ACQUIRE)==0:
+        if GPIO.input(PIN_ACQUIRE)==1: break
+
+
+def wait_controller(mode):
+
+    control = GpioController(PIN_RUN, PIN_ACQUIRE, PIN_STOP, PIN_EXIT, mode)
+    control.start()
+    control.wait_for(PIN_ACQUIRE, 1)
+    control.stop()
+
+
+def bench_gpio_idle(duration=5.0, rpi=False):
+
+    results = {}
+    for name, wait in (('busy-wait GPIO.input', wait_busy), ('GpioController poll', lambda: wait_controller('poll'))):
+        gpio = None if rpi else SimulatedGPIO(script=[(duration, PIN_ACQUIRE, 1)])
+        GPIO.select(gpio)
+        GPIO.setmode(GPIO.BCM)
+        for pin in (PIN_RUN, PIN_ACQUIRE, PIN_STOP, PIN_EXIT): GPIO.setup(pin, GPIO.OUT)
+        GPIO.output(PIN_ACQUIRE, 0)
+
+        cpu_start, t_start = time.process_time(), time.perf_counter()
+        wait()
+        t_total, cpu_total = time.perf_counter() - t_start, time.process_time() - cpu_start
+        results[name] = {'cpu_percent': 100*cpu_total/t_total, 'reaction_ms': 1000*(t_total - duration) if not rpi else None,
+                         'gpio_reads': gpio.n_reads if gpio is not None else None}
+        print('{:<25s} CPU {:>6.1f}%   GPIO reads {}'.format(name, results[name]['cpu_percent'], results[name]['gpio_reads']), file=sys.stderr)
+
+    return results
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Idle CPU usage of the GPIO wait loops.')
+    parser.add_argument('--duration', type=float, default=5.0, help='waiting time [s]')
+    parser.add_argument('--rpi', action='store_true', help='use RPi.GPIO instead of the simulated pins')
+    args = parser.parse_args()
+
+    print(json.dumps(bench_gpio_idle(args.duration, args.rpi), indent=2))
@@ -39,13 +39,15 @@ sys.path.insert(0, '/home/pi/PyCamera_control/methods')
 from utils import *                                                                                     # Import required libraries
 from online_acquisition import *
 from offline_acquisition import *
+from frame_statistics import FrameStatistics
+from multi_camera import start_multi_camera_acquisition
 
 
 ######################################################################################################################################################################
 ######################################################################################################################################################################
 
 
-time_sleep = 0.3                                                                                        # Time sleep
+time_sleep = 0.3                                                                                        # Time sleep (frame period, deadline-based pacing)
 exposure_time = 0.01                                                                                    # CCD exposure time [ms]
 black_level = 220                                                                                       # Black level offset for image acquisition
 image_index = 1                                                                                         # Incremental image number
@@ -59,9 +61,50 @@ wavelength = 0.6335
 A, B, C, D, E = 8060.51, 2480990, 132.274, 17455.7, 39.32957                                            # Parameters to compute air refractive index at the specified wavelength
 medium_index = (A + B/(C - wavelength**(-2)) + D/(E - wavelength**(-2)))*10**(-8) + 1                   # Air refractive index --- see: https://www.scirp.org/reference/referencespapers.aspx?referenceid=2136018&msclkid=51882231a8f311eca529a84e37286153
 var_treshold = 5
+queue_depth = 64                                                                                        # Number of frames buffered before the writer threads
+n_writers = 2                                                                                           # Number of threads writing the frames on the USB storage device
+drop_policy = 'block'                                                                                   # Full buffer behaviour: 'block', 'drop_newest' or 'drop_oldest'
+n_buffers = 4                                                                                           # Number of Ueye image memories in the driver ring (1 = single buffer)
+frame_stats = FrameStatistics(scale=1.0, roi=None, stride=2)                                            # Image variance on every other pixel along both axes, no resize
+reconstruction_planes = []                                                                              # z-planes [um] for the real-time hologram reconstruction (empty = disabled)
+reconstruction_options = {'dtype': 'float32', 'crop': None}                                             # Reconstructed stacks data type ('float32', 'float16') and crop (y0, y1, x0, x1)
+storage_format = 'tiff'                                                                                 # 'tiff' (one file per image), 'hdf5', 'npz' (chunked containers) or 'raw' (memory-mapped log)
+storage_options = {'chunk_size': 64, 'compression': 'gzip', 'flush_interval': 5.0,                      # Chunked containers options
+                   'codec': 'tiff', 'codec_level': None}                                                # Single files lossless codec: 'tiff', 'tiff_lzw', 'tiff_deflate', 'png', 'lz4', 'zstd'
+frame_rate = None                                                                                       # Camera sensor frame rate [fps] (None = camera default)
+pixel_clock = None                                                                                      # Camera sensor pixel clock [MHz] (None = camera default)
+trigger_mode = 'freerun'                                                                                # 'freerun', 'software' (one exposure per image) or 'hardware' trigger
+sensor_aoi = None                                                                                       # Sensor AOI (x, y, width, height) read out by the camera (None = full sensor)
+binning = 1                                                                                             # Sensor binning factor (1 = disabled)
+subsampling = 1                                                                                         # Sensor subsampling factor (1 = disabled)
+detector = 'variance'                                                                                   # Frame selection: 'variance' (global variance) or 'tiles' (local statistics)
+detector_options = {'tile': 16, 'threshold': 4.0, 'min_tiles': 1, 'stride': 2}                          # Tile detector options
+camera_selectors = ['']                                                                                 # Camera IDs or serial numbers ('' = first available camera); 2+ cameras: parallel acquisition
+metrics_port = None                                                                                     # TCP port of the live metrics endpoint, eg: 9100 (None = disabled)
+check_interval = 50                                                                                     # Number of images between two image checks (1 = every image)
+check_roi = None                                                                                        # Image checks region of interest (y0, y1, x0, x1) (None = variance ROI)
+auto_exposure = False                                                                                   # Closed-loop exposure and black level correction during the measurement
+auto_exposure_options = {'exposure_range': (0.005, 1.0), 'black_level_range': (0, 255), 'interval': 2}  # Auto-exposure bounds [ms] and minimum time between corrections [s]
+pretrigger_frames = 0                                                                                   # Images saved before each selected image (0 = disabled)
+posttrigger_frames = 0                                                                                  # Images saved after each selected image (0 = disabled)
+pretrigger_budget = 64                                                                                  # Pre-trigger ring memory budget [MB]
+background_alpha = 0                                                                                    # Rolling background update weight of each empty image (0 = frozen)
+background_checkpoint = 600                                                                             # Time between two rolling background checkpoints [s]
+storage_targets = ['/home/pi/PyCamera_data/']                                                           # Spillover folders when the USB storage device is full (eg: SD card; single camera)
+min_free_space = 500                                                                                    # Minimum free space of the storage device [MB]
+min_bandwidth = 0                                                                                       # Minimum write bandwidth of the storage device [MB/s] (0 = not checked)
+control_port = None                                                                                     # Remote control and live preview TCP port, eg: 8080 (None = disabled)
+preview_fps = 5                                                                                         # Live preview maximum frame rate [fps]
+preview_width = 640                                                                                     # Live preview frame width [pixels]
 
 pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT = 14, 15, 17, 23
-start_offline_acquisition(time_sleep, exposure_time, black_level, image_index, sleep_option, bkg_index_limit, bkg_var, image_extension, _extension_length, pixel_size, wavelength, medium_index, var_treshold, pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT, remote_control)
+single_camera_options = {'detector': detector != 'variance', 'reconstruction_planes': len(reconstruction_planes) > 0, 'auto_exposure': auto_exposure,
+                         'pretrigger_frames': pretrigger_frames > 0, 'posttrigger_frames': posttrigger_frames > 0, 'background_alpha': background_alpha > 0,
+                         'storage_targets': len(storage_targets) > 0, 'control_port': control_port is not None}
+if len(camera_selectors) > 1 and any(single_camera_options.values()):                                   # Not available in the multi-camera acquisition
+    raise ValueError('Not supported with more than one camera: '+', '.join(key for key, value in single_camera_options.items() if value))
+if len(camera_selectors) > 1: start_multi_camera_acquisition(camera_selectors, time_sleep, exposure_time, black_level, sleep_option, bkg_index_limit, var_treshold, pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT, remote_control, queue_depth, n_writers, drop_policy, n_buffers, frame_stats, storage_format=storage_format, storage_options=storage_options, frame_rate=frame_rate, pixel_clock=pixel_clock, trigger_mode=trigger_mode, aoi=sensor_aoi, binning=binning, subsampling=subsampling, metrics_port=metrics_port)
+else: start_offline_acquisition(time_sleep, exposure_time, black_level, image_index, sleep_option, bkg_index_limit, bkg_var, image_extension, _extension_length, pixel_size, wavelength, medium_index, var_treshold, pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT, remote_control, queue_depth, n_writers, drop_policy, n_buffers, frame_stats, reconstruction_planes=reconstruction_planes, storage_format=storage_format, storage_options=storage_options, frame_rate=frame_rate, pixel_clock=pixel_clock, trigger_mode=trigger_mode, aoi=sensor_aoi, binning=binning, subsampling=subsampling, detector=detector, detector_options=detector_options, camera_options={'selector': camera_selectors[0]}, metrics_port=metrics_port, check_interval=check_interval, check_roi=check_roi, auto_exposure=auto_exposure, auto_exposure_options=auto_exposure_options, pretrigger_frames=pretrigger_frames, posttrigger_frames=posttrigger_frames, pretrigger_budget=pretrigger_budget, background_alpha=background_alpha, background_checkpoint=background_checkpoint, storage_targets=storage_targets, min_free_space=min_free_space, min_bandwidth=min_bandwidth, control_port=control_port, preview_fps=preview_fps, preview_width=preview_width, reconstruction_options=reconstruction_options)
 
 os.system('sudo umount /media/usb')
 
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, argparse                                                                                # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+from frame_storage import convert_raw_log
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Offline converter of the raw frame logs ('frames.raw' + 'frames.idx' + 'frames.json') written with storage_format = 'raw', eg:
+#
+#       python3 convert_raw_log.py /media/usb/20230101_120000/data/ tiff /media/usb/20230101_120000/data_tiff/
+
+
+parser = argparse.ArgumentParser(description='Convert a raw frame log to image files or to a chunked container.')
+parser.add_argument('log_path', help='folder of the raw frame log')
+parser.add_argument('output_format', help="'tiff', 'png', 'hdf5' or 'npz'")
+parser.add_argument('output_path', help='output folder')
+parser.add_argument('--chunk-size', type=int, default=64, help='frames per chunk (hdf5, npz)')
+parser.add_argument('--compression', default='gzip', help="chunk compression (hdf5: 'gzip', 'lzf'; 'none' to disable)")
+args = parser.parse_args()
+
+options = {}
+if args.output_format in ('hdf5', 'npz'): options = {'chunk_size': args.chunk_size, 'compression': None if args.compression == 'none' else args.compression}
+n_frames = convert_raw_log(args.log_path, args.output_format, args.output_path, **options)
+print(str(n_frames)+' frames converted to '+args.output_path)
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
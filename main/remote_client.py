@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, argparse, json                                                                          # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+from remote_control import REMOTE_COMMANDS, remote_command, remote_snapshot
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Client of the remote control service (control_port in PyCamera.py), eg: from the Raspberry itself or from a device connected to the RaspAP network:
+#
+#       python3 remote_client.py start --host 10.3.141.1 --port 8080
+#       python3 remote_client.py snapshot --output preview.jpg
+
+
+parser = argparse.ArgumentParser(description='Send a command to (or read a preview frame from) the remote control service.')
+parser.add_argument('command', choices=('status', 'snapshot')+tuple(REMOTE_COMMANDS), help='command')
+parser.add_argument('--host', default='127.0.0.1', help='address of the Raspberry')
+parser.add_argument('--port', type=int, default=8080, help='TCP port of the service')
+parser.add_argument('--output', default='preview.jpg', help='output file of the preview frame (snapshot)')
+parser.add_argument('--timeout', type=float, default=5.0, help='maximum time to wait for the reply [s]')
+args = parser.parse_args()
+
+if args.command == 'snapshot':
+    with open(args.output, 'wb') as output: output.write(remote_snapshot(args.host, args.port, args.timeout))
+    print('Preview frame saved in '+args.output)
+else: print(json.dumps(remote_command(args.command, args.host, args.port, args.timeout), indent=4))
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, argparse, json                                                                          # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+from reprocessing import reprocess_run
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Offline reprocessing of recorded runs (frame selection with a new treshold/detector and, optionally, hologram reconstruction), eg:
+#
+#       python3 reprocess_run.py /media/usb/20230101_120000/ --detector tiles --workers 4 --planes 1000 2000
+#
+# An interrupted reprocessing is resumed by running the same command again (the frames already in 'manifest.csv' are skipped).
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Re-filter and reprocess the frames of one or more recorded runs in parallel.')
+    parser.add_argument('run_paths', nargs='+', help="run folders (with the 'data' and 'background' folders)")
+    parser.add_argument('--output', default=None, help="output folder (default: 'reprocessed' in each run folder)")
+    parser.add_argument('--detector', default='variance', help="'variance' or 'tiles'")
+    parser.add_argument('--detector-options', default='{}', help='tile detector options as JSON, eg: \'{"tile": 16, "threshold": 4.0}\'')
+    parser.add_argument('--var-treshold', type=float, default=5, help='treshold of the variance detector [%%]')
+    parser.add_argument('--stride', type=int, default=1, help='subsampling step of the frame variance computation')
+    parser.add_argument('--planes', type=float, nargs='*', default=[], help='z-planes [um] for the reconstruction of the kept frames')
+    parser.add_argument('--pixel-size', type=float, default=5.3, help='camera pixel size [um]')
+    parser.add_argument('--wavelength', type=float, default=0.6335, help='laser wavelength [um]')
+    parser.add_argument('--medium-index', type=float, default=1.0, help='medium refractive index')
+    parser.add_argument('--copy-kept', action='store_true', help="write the kept frames (TIFF) in the output 'data' folder")
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: number of cores)')
+    parser.add_argument('--batch-size', type=int, default=64, help='frames of each work unit')
+    parser.add_argument('--extension', default='tif', help='image format of the single image files')
+    args = parser.parse_args()
+
+    for run_path in args.run_paths:
+        output_path = os.path.join(args.output, os.path.basename(os.path.normpath(run_path))) if args.output is not None and len(args.run_paths) > 1 else args.output
+        reprocess_run(run_path, output_path, args.detector, json.loads(args.detector_options), args.var_treshold, args.stride, args.planes, args.pixel_size,
+                      args.wavelength, args.medium_index, args.copy_kept, args.workers, args.batch_size, args.extension)
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
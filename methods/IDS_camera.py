@@ -42,7 +42,8 @@ Created on Thu Sep 22, 2022
 
 from pyueye import ueye                                                                                 # Import required libraries
 from termcolor import colored
-import numpy as np, cv2
+from frame_statistics import FrameStatistics
+import numpy as np, cv2, time
 
 
 ######################################################################################################################################################################
@@ -55,6 +56,11 @@ class IdsCamera(object):
                                      [ueye.ctypes.c_uint, ueye.ctypes.c_double,
                                       ueye.ctypes.POINTER(ueye.ctypes.c_double)], ueye.ctypes.c_int)
     IS_GET_EXPOSURE_TIME = 0x8000
+    _is_GetCameraList = ueye._bind("is_GetCameraList",
+                                   [ueye.ctypes.c_void_p], ueye.ctypes.c_int)                           # Void pointer: the camera list length is known only at runtime
+    TRIGGER_MODES = {'freerun': ueye.IS_SET_TRIGGER_OFF,                                                # Free run: the sensor is paced by the frame rate
+                     'software': ueye.IS_SET_TRIGGER_SOFTWARE,                                          # One exposure for each grab (is_FreezeVideo)
+                     'hardware': ueye.IS_SET_TRIGGER_LO_HI}                                             # One exposure for each rising edge on the trigger input
 
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -107,8 +113,10 @@ class IdsCamera(object):
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
 
 
-    def __init__(self, log_file, exposure_time, black_level, remote_control, selector=''):
+    def __init__(self, log_file, exposure_time, black_level, remote_control, selector='', n_buffers=1, frame_stats=None,
+                 frame_rate=None, pixel_clock=None, trigger_mode='freerun', aoi=None, binning=1, subsampling=1):
         self.hCam = ueye.HIDS(0)                                                                        # 0: first available camera;  1-254: The camera with the specified camera ID
+        self.selector = selector                                                                        # '': first available camera; camera ID (1-254) or serial number
         self.sInfo = ueye.SENSORINFO()
         self.cInfo = ueye.CAMINFO()
         self.pcImageMemory = ueye.c_mem_p()
@@ -123,10 +131,24 @@ class IdsCamera(object):
         self.size = (-1, -1)
         self.ok = False
         self.last_frame = None
+        self.last_timestamp = None                                                                      # Host time of the last grabbed frame (multi-camera frame pairing)
+        self.frame_count = 0
         self.log_file = log_file
         self.exp_time = exposure_time
         self.black_level = black_level
         self.remote_control = remote_control
+        self.n_buffers = max(int(n_buffers), 1)                                                         # 1: single image memory; N > 1: ring of N image memories in queue mode
+        self.sequence = {}                                                                              # Image memories of the ring, indexed by their memory ID
+        self.held_buffer = None                                                                         # Buffer locked by the last grab_image call (queue mode only)
+        self.frame_stats = frame_stats if frame_stats is not None else FrameStatistics()                # Per-frame resize and variance stage
+        self.frame_rate = frame_rate                                                                    # Sensor frame rate [fps] (None: camera default)
+        self.pixel_clock = pixel_clock                                                                  # Sensor pixel clock [MHz] (None: camera default)
+        if trigger_mode not in IdsCamera.TRIGGER_MODES:
+            raise ValueError('Unknown trigger mode: '+str(trigger_mode)+', expected one of '+str(tuple(IdsCamera.TRIGGER_MODES)))
+        self.trigger_mode = trigger_mode
+        self.aoi = tuple(aoi) if aoi is not None else None                                              # Sensor AOI (x, y, width, height) read out by the camera (None: full sensor)
+        self.binning = int(binning)                                                                     # Sensor binning factor (1: disabled)
+        self.subsampling = int(subsampling)                                                             # Sensor subsampling factor (1: disabled)
 
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -134,6 +156,8 @@ class IdsCamera(object):
 
     def connect(self):
 
+        if not self.select_camera(): return
+
         rc = ueye.is_InitCamera(self.hCam, None)                                                        # Starts the driver and establishes the connection to the camera
         if rc != ueye.IS_SUCCESS: 
             print(colored('is_InitCamera\t\t', 'white'), colored('---> ERROR', 'red'))
@@ -201,15 +225,7 @@ class IdsCamera(object):
             self.log_file.write('\nbytes_per_pixel: \t\t\t\t\t\t\t'+str(self.bytes_per_pixel)+'\n')
         except: pass
 
-        rc = ueye.is_AOI(self.hCam, ueye.IS_AOI_IMAGE_GET_AOI, self.rectAOI, ueye.sizeof(self.rectAOI)) # Can be used to set the size and position of an 
-        if rc != ueye.IS_SUCCESS:                                                                       # "area of interest"(AOI) within an image
-                print(colored('is_AOI\t\t\t', 'white'), colored('---> ERROR', 'red')) 
-                try: self.log_file.write('\nis_AOI\t\t\t---> ERROR')
-                except: pass
-
-        self.width = self.rectAOI.s32Width
-        self.height = self.rectAOI.s32Height
-        self.size = (self.width.value, self.height.value)
+        self.apply_readout()                                                                            # Sensor binning, subsampling and AOI (image size read back)
 
         if self.sInfo.strSensorName.decode('utf-8')!='':                                                # Prints out some information about the camera and the sensor
             print(colored('Camera model:\t\t\t\t\t', 'green'), self.sInfo.strSensorName.decode('utf-8'))
@@ -231,6 +247,11 @@ class IdsCamera(object):
         try: self.log_file.write('\nCamera image size:\t\t\t\t\t\t\t'+str(self.size)+'\n')
         except: pass
         
+        if self.pixel_clock is not None: self.set_pixel_clock(self.pixel_clock)                         # Timing settings: pixel clock, then frame rate, then exposure time
+        if self.frame_rate is not None: self.set_frame_rate(self.frame_rate)
+        self.get_pixel_clock()
+        self.get_frame_rate_range()
+
         self.get_camera_exposure_settings()
         self.set_camera_exposure(self.exp_time)
         self.exposure_default = self.get_camera_exposure()
@@ -242,26 +263,40 @@ class IdsCamera(object):
         self.get_camera_default_gamma()
         self.get_camera_gamma()
 
-        rc = ueye.is_AllocImageMem(self.hCam, self.width, self.height,
-                                   self.nBitsPerPixel, self.pcImageMemory, self.MemID)                  # Allocates an image memory for an image having its dimensions defined by width and height
-        if rc != ueye.IS_SUCCESS:                                                                       # and its color depth defined by nBitsPerPixel
-            print(colored('is_AllocImageMem\t', 'white'), colored('---> ERROR', 'red'))
-            try: self.log_file.write('\nis_AllocImageMem\t---> ERROR')
-            except: pass
-        else:                                                                                           # Makes the specified image memory the active memory
-            rc = ueye.is_SetImageMem(self.hCam, self.pcImageMemory, self.MemID)
-            if rc != ueye.IS_SUCCESS: 
-                    print(colored('is_SetImageMem\t\t', 'white'), colored('---> ERROR', 'red'))
-                    try: self.log_file.write('\nis_SetImageMem\t\t---> ERROR')
-                    except: pass
-            else:                                                                                       # Set the desired color mode
-                rc = ueye.is_SetColorMode(self.hCam, self.m_nColorMode)
-
-        rc = ueye.is_CaptureVideo(self.hCam, ueye.IS_DONT_WAIT)                                         # Activates the camera's live video mode (free run mode)
-        if rc != ueye.IS_SUCCESS: 
-                print(colored('is_CaptureVideo\t\t', 'white'), colored('---> ERROR', 'red'))
-                try: self.log_file.write('\nis_CaptureVideo\t\t---> ERROR')
+        memory_ok = self.allocate_memory()                                                              # Image memory (or ring of image memories) for the current image size
+
+        self.set_trigger_mode(self.trigger_mode)                                                        # Free run, software or hardware trigger
+        self.start_capture()
+
+        if memory_ok:
+            if self.remote_control==False: print(colored('Press x to leave the program', 'red'))
+            else: print(colored('Set GPIO 17 to HIGH/LOW to stop/restart the acquisition respectively', 'red'))
+            self.ok = True
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def allocate_memory(self):                                                                          # Allocates the image memory (single or ring) for the current image size;
+                                                                                                        # returns True if the memory is ready (line pitch inquired)
+        if self.n_buffers == 1:
+            rc = ueye.is_AllocImageMem(self.hCam, self.width, self.height,
+                                       self.nBitsPerPixel, self.pcImageMemory, self.MemID)              # Allocates an image memory for an image having its dimensions defined by width and height
+            if rc != ueye.IS_SUCCESS:                                                                   # and its color depth defined by nBitsPerPixel
+                print(colored('is_AllocImageMem\t', 'white'), colored('---> ERROR', 'red'))
+                try: self.log_file.write('\nis_AllocImageMem\t---> ERROR')
                 except: pass
+            else:                                                                                       # Makes the specified image memory the active memory
+                rc = ueye.is_SetImageMem(self.hCam, self.pcImageMemory, self.MemID)
+                if rc != ueye.IS_SUCCESS: 
+                        print(colored('is_SetImageMem\t\t', 'white'), colored('---> ERROR', 'red'))
+                        try: self.log_file.write('\nis_SetImageMem\t\t---> ERROR')
+                        except: pass
+                else:                                                                                   # Set the desired color mode
+                    rc = ueye.is_SetColorMode(self.hCam, self.m_nColorMode)
+        else:
+            self.allocate_sequence()                                                                    # Ring of image memories in queue mode
+            rc = ueye.is_SetColorMode(self.hCam, self.m_nColorMode)
 
         rc = ueye.is_InquireImageMem(self.hCam, self.pcImageMemory, self.MemID,
                                      self.width, self.height, self.nBitsPerPixel, self.pitch)           # Enables the queue mode for existing image memory sequences
@@ -269,28 +304,134 @@ class IdsCamera(object):
                 print(colored('is_InquireImageMem\t', 'white'), colored('---> ERROR', 'red'))
                 try: self.log_file.write('\nis_InquireImageMem\t---> ERROR')
                 except: pass
+                return False
+
+        return True
+
+
+    def free_memory(self):                                                                              # Releases the image memory (single or ring)
+
+        if self.n_buffers == 1:
+            ueye.is_FreeImageMem(self.hCam, self.pcImageMemory, self.MemID)                             # Releases an image memory that was allocated using is_AllocImageMem() 
+                                                                                                        # and removes it from the driver management
         else:
-            if self.remote_control==False: print(colored('Press x to leave the program', 'red'))
-            else: print(colored('Set GPIO 17 to HIGH/LOW to stop/restart the acquisition respectively', 'red'))
+            ueye.is_ExitImageQueue(self.hCam)                                                           # Disables the queue mode and clears the sequence
+            ueye.is_ClearSequence(self.hCam)
+            for mem_id, pcMem in self.sequence.items(): ueye.is_FreeImageMem(self.hCam, pcMem, mem_id)
+            self.sequence = {}
+            self.held_buffer = None
+
+
+    def start_capture(self):                                                                            # Starts the live video (free run or triggered); not needed with the software
+                                                                                                        # trigger, where each grab starts one exposure
+        if self.trigger_mode == 'software': return
+
+        if self.trigger_mode == 'hardware' and self.n_buffers == 1:                                     # Single image memory: grab_buffer waits for the frame event
+            ueye.is_EnableEvent(self.hCam, ueye.IS_SET_EVENT_FRAME)
+        rc = ueye.is_CaptureVideo(self.hCam, ueye.IS_DONT_WAIT)                                         # Activates the camera's live video mode (free run or triggered)
+        if rc != ueye.IS_SUCCESS: 
+                print(colored('is_CaptureVideo\t\t', 'white'), colored('---> ERROR', 'red'))
+                try: self.log_file.write('\nis_CaptureVideo\t\t---> ERROR')
+                except: pass
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def apply_readout(self):                                                                            # Applies binning, subsampling and AOI (in this order, the AOI is given in
+                                                                                                        # binned/subsampled pixels) and reads back the image size
+        for factor, mode, label in ((self.binning, 'BINNING', 'is_SetBinning'), (self.subsampling, 'SUBSAMPLING', 'is_SetSubSampling')):
+            if factor > 1: nMode = getattr(ueye, 'IS_'+mode+'_'+str(factor)+'X_VERTICAL') | getattr(ueye, 'IS_'+mode+'_'+str(factor)+'X_HORIZONTAL')
+            else: nMode = getattr(ueye, 'IS_'+mode+'_DISABLE')
+            rc = ueye.is_SetBinning(self.hCam, nMode) if mode == 'BINNING' else ueye.is_SetSubSampling(self.hCam, nMode)
+            if rc != ueye.IS_SUCCESS:
+                print(colored(label+'\t\t', 'white'), colored('---> ERROR', 'red'))
+                try: self.log_file.write('\n'+label+'\t\t---> ERROR')
+                except: pass
+
+        if self.aoi is not None:
+            sizeInc, posInc = ueye.IS_SIZE_2D(), ueye.IS_POINT_2D()                                     # The AOI position and size are rounded to the sensor increments
+            ueye.is_AOI(self.hCam, ueye.IS_AOI_IMAGE_GET_SIZE_INC, sizeInc, ueye.sizeof(sizeInc))
+            ueye.is_AOI(self.hCam, ueye.IS_AOI_IMAGE_GET_POS_INC, posInc, ueye.sizeof(posInc))
+            x, y, width, height = self.aoi
+            rectAOI = ueye.IS_RECT()
+            rectAOI.s32X = ueye.INT(x - x % max(posInc.s32X.value, 1))
+            rectAOI.s32Y = ueye.INT(y - y % max(posInc.s32Y.value, 1))
+            rectAOI.s32Width = ueye.INT(width - width % max(sizeInc.s32Width.value, 1))
+            rectAOI.s32Height = ueye.INT(height - height % max(sizeInc.s32Height.value, 1))
+            rc = ueye.is_AOI(self.hCam, ueye.IS_AOI_IMAGE_SET_AOI, rectAOI, ueye.sizeof(rectAOI))
+            if rc != ueye.IS_SUCCESS:
+                print(colored('is_AOI (set)\t\t', 'white'), colored('---> ERROR', 'red'))
+                try: self.log_file.write('\nis_AOI (set)\t\t---> ERROR')
+                except: pass
+
+        rc = ueye.is_AOI(self.hCam, ueye.IS_AOI_IMAGE_GET_AOI, self.rectAOI, ueye.sizeof(self.rectAOI)) # Can be used to set the size and position of an 
+        if rc != ueye.IS_SUCCESS:                                                                       # "area of interest"(AOI) within an image
+                print(colored('is_AOI\t\t\t', 'white'), colored('---> ERROR', 'red')) 
+                try: self.log_file.write('\nis_AOI\t\t\t---> ERROR')
+                except: pass
+
+        self.width = self.rectAOI.s32Width
+        self.height = self.rectAOI.s32Height
+        self.size = (self.width.value, self.height.value)
+
+        print(colored('Sensor readout:\t\t\t\t\t', 'green'), 'AOI '+str((self.rectAOI.s32X.value, self.rectAOI.s32Y.value)+self.size)+
+              ', binning '+str(self.binning)+'x, subsampling '+str(self.subsampling)+'x')
+        try: self.log_file.write('\nSensor readout:\t\t\t\t\t\t\tAOI '+str((self.rectAOI.s32X.value, self.rectAOI.s32Y.value)+self.size)+
+                                 ', binning '+str(self.binning)+'x, subsampling '+str(self.subsampling)+'x')
+        except: pass
+
+
+    def set_readout(self, aoi=None, binning=1, subsampling=1):                                          # Changes AOI (x, y, width, height; None: full sensor), binning and subsampling
+                                                                                                        # at runtime: image memory reallocated, frame rate and exposure set again
+        self.aoi = tuple(aoi) if aoi is not None else None
+        self.binning = int(binning)
+        self.subsampling = int(subsampling)
+        if not self.ok: return                                                                          # Not connected yet: applied by 'connect'
+
+        self.ok = False
+        ueye.is_StopLiveVideo(self.hCam, ueye.IS_FORCE_VIDEO_STOP)
+        self.free_memory()
+        self.last_frame = None
+
+        if self.aoi is None:                                                                            # Full sensor: the AOI is reset to the maximum image size
+            rectAOI = ueye.IS_RECT()
+            rectAOI.s32Width = ueye.INT(self.sInfo.nMaxWidth.value//(self.binning*self.subsampling))
+            rectAOI.s32Height = ueye.INT(self.sInfo.nMaxHeight.value//(self.binning*self.subsampling))
+            ueye.is_AOI(self.hCam, ueye.IS_AOI_IMAGE_SET_AOI, rectAOI, ueye.sizeof(rectAOI))
+        self.apply_readout()
+
+        if self.frame_rate is not None: self.set_frame_rate(self.frame_rate)                            # The frame time range depends on the image size
+        self.get_frame_rate_range()
+        self.set_camera_exposure(self.exp_time)                                                         # The exposure time must be set again after an AOI change
+
+        if self.allocate_memory():
+            self.start_capture()
             self.ok = True
 
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
 
 
-    def grab_image(self):
+    def grab_image(self):                                                                               # Returns (frame, variance, standard deviation), None on timeout. In queue mode (n_buffers > 1)
+                                                                                                        # the frame is a view on the driver image memory, valid only until the next call: the
+                                                                                                        # previous buffer is unlocked here and the driver may overwrite it (the same for last_frame).
+                                                                                                        # Copy the frame if it has to be kept longer
 
         if not self.ok: return None
 
-        array = ueye.get_data(self.pcImageMemory, self.width, 
-                              self.height, self.nBitsPerPixel, self.pitch, copy=False)                  # Extract the data of our image memory
-
-        frame = np.reshape(array, (self.height.value, self.width.value, self.bytes_per_pixel))          # Reshape it in an numpy array
+        if self.held_buffer is not None:                                                                # Queue mode: the frame returned by the previous call is released
+            self.release_buffer(self.held_buffer)
+            self.held_buffer = None
 
-        frame = cv2.resize(frame, (0, 0), fx=1.0, fy=1.0)                                               # Eventually resize the image by a given factor
+        buffer = self.grab_buffer()                                                                     # Extract the data of our image memory and reshape it in an numpy array
+        if buffer is None: return None
+        frame, mem_id = buffer
+        if self.n_buffers > 1: self.held_buffer = mem_id
+        self.last_timestamp = time.time()
+        self.frame_count += 1
 
-        frame_var = np.var(frame)                                                                       # Image variance
-        frame_dev = np.sqrt(frame_var)                                                                  # Image standard deviation
+        frame, frame_var, frame_dev = self.frame_stats(frame)                                           # Eventually resize the image and compute its variance and standard deviation
 
         self.last_frame = frame
 
@@ -300,10 +441,135 @@ class IdsCamera(object):
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
 
 
+    @staticmethod
+    def list_cameras():                                                                                 # Returns the UEYE_CAMERA_INFO structures (camera ID, device ID, serial number,
+                                                                                                        # model, in use flag) of the cameras connected to the system
+        nCameras = ueye.INT()
+
+        rc = ueye.is_GetNumberOfCameras(nCameras)
+        if rc != ueye.IS_SUCCESS or nCameras.value < 1: return []
+
+        class CameraList(ueye.ctypes.Structure):
+            _fields_ = [('dwCount', ueye.ULONG), ('uci', ueye.UEYE_CAMERA_INFO*nCameras.value)]
+
+        camera_list = CameraList()
+        camera_list.dwCount = nCameras.value
+        rc = IdsCamera._is_GetCameraList(ueye.ctypes.byref(camera_list))
+        if rc != ueye.IS_SUCCESS: return []
+
+        return [camera_list.uci[i] for i in range(min(camera_list.dwCount, nCameras.value))]
+
+
+    def select_camera(self):                                                                            # Sets the camera handle from 'selector': '' (or 0) selects the first available
+                                                                                                        # camera, a number the camera ID (1-254), any other string the serial number
+        selector = str(self.selector).strip()
+
+        if selector == '' or selector.isdigit():
+            self.hCam = ueye.HIDS(int(selector) if selector != '' else 0)
+            return True
+
+        for info in IdsCamera.list_cameras():
+            if info.SerNo.decode('utf-8').strip() == selector:                                          # The device ID is unique, while several cameras may share the same camera ID
+                self.hCam = ueye.HIDS(info.dwDeviceID | ueye.IS_USE_DEVICE_ID)
+                print(colored('Camera selection:\t\t\t\t', 'green'), 'serial no. '+selector+', device ID '+str(info.dwDeviceID))
+                try: self.log_file.write('\nCamera selection:\t\t\t\t\t\t\tserial no. '+selector+', device ID '+str(info.dwDeviceID))
+                except: pass
+                return True
+
+        print(colored('Camera serial no. '+selector+'\t', 'white'), colored('---> ERROR (camera not found)', 'red'))
+        try: self.log_file.write('\nCamera serial no. '+selector+'\t---> ERROR (camera not found)')
+        except: pass
+
+        return False
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def allocate_sequence(self):
+
+        for i in range(self.n_buffers):
+            pcMem, memID = ueye.c_mem_p(), ueye.INT()
+            rc = ueye.is_AllocImageMem(self.hCam, self.width, self.height,
+                                       self.nBitsPerPixel, pcMem, memID)                                # Allocates one image memory of the ring
+            if rc != ueye.IS_SUCCESS:
+                print(colored('is_AllocImageMem\t', 'white'), colored('---> ERROR', 'red'))
+                try: self.log_file.write('\nis_AllocImageMem\t---> ERROR')
+                except: pass
+                break
+            rc = ueye.is_AddToSequence(self.hCam, pcMem, memID)                                         # Inserts the image memory in the driver sequence
+            if rc != ueye.IS_SUCCESS:
+                print(colored('is_AddToSequence\t', 'white'), colored('---> ERROR', 'red'))
+                try: self.log_file.write('\nis_AddToSequence\t---> ERROR')
+                except: pass
+                ueye.is_FreeImageMem(self.hCam, pcMem, memID)
+                break
+            self.sequence[memID.value] = pcMem
+
+        if len(self.sequence) > 0:                                                                      # The first image memory is used to inquire the line pitch
+            self.MemID = ueye.INT(list(self.sequence.keys())[0])
+            self.pcImageMemory = self.sequence[self.MemID.value]
+
+        rc = ueye.is_InitImageQueue(self.hCam, 0)                                                       # Enables the queue mode: filled memories stay locked until is_UnlockSeqBuf
+        if rc != ueye.IS_SUCCESS:
+            print(colored('is_InitImageQueue\t', 'white'), colored('---> ERROR', 'red'))
+            try: self.log_file.write('\nis_InitImageQueue\t---> ERROR')
+            except: pass
+
+        print(colored('Image memory sequence:\t\t\t\t', 'green'), str(len(self.sequence)), ' buffers (queue mode)')
+        try: self.log_file.write('\nImage memory sequence:\t\t\t\t\t\t'+str(len(self.sequence))+' buffers (queue mode)')
+        except: pass
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def grab_buffer(self, timeout_ms=1000):                                                             # Queue mode: returns a NumPy view on the oldest filled image memory (locked)
+                                                                                                        # and its memory ID, to be given back with release_buffer
+        if not self.ok: return None
+
+        if self.trigger_mode == 'software':                                                             # Software trigger: one exposure for each grab
+            rc = ueye.is_FreezeVideo(self.hCam, ueye.IS_WAIT if self.n_buffers == 1 else ueye.IS_DONT_WAIT)
+            if rc != ueye.IS_SUCCESS: return None
+
+        if self.n_buffers == 1:
+            if self.trigger_mode == 'hardware':                                                         # Hardware trigger: waits for the exposure of the next rising edge
+                rc = ueye.is_WaitEvent(self.hCam, ueye.IS_SET_EVENT_FRAME, timeout_ms)
+                if rc != ueye.IS_SUCCESS: return None                                                   # IS_TIMED_OUT: no trigger, the same frame is not returned again
+            array = ueye.get_data(self.pcImageMemory, self.width, 
+                                  self.height, self.nBitsPerPixel, self.pitch, copy=False)
+            return np.reshape(array, (self.height.value, self.width.value, self.bytes_per_pixel)), self.MemID.value
+
+        pcMem, memID = ueye.c_mem_p(), ueye.INT()
+        rc = ueye.is_WaitForNextImage(self.hCam, timeout_ms, pcMem, memID)                              # Waits for the next image memory of the sequence and locks it
+        if rc != ueye.IS_SUCCESS: return None                                                           # IS_TIMED_OUT or IS_CAPTURE_STATUS: no new frame available
+
+        array = ueye.get_data(self.sequence[memID.value], self.width, 
+                              self.height, self.nBitsPerPixel, self.pitch, copy=False)                  # Zero-copy view on the locked image memory
+
+        return np.reshape(array, (self.height.value, self.width.value, self.bytes_per_pixel)), memID.value
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def release_buffer(self, mem_id):                                                                   # Queue mode: unlocks the image memory so that the driver can fill it again
+
+        if self.n_buffers == 1 or mem_id not in self.sequence: return
+
+        ueye.is_UnlockSeqBuf(self.hCam, mem_id, self.sequence[mem_id])
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
     def disconnect(self):
 
-        ueye.is_FreeImageMem(self.hCam, self.pcImageMemory, self.MemID)                                 # Releases an image memory that was allocated using is_AllocImageMem() 
-                                                                                                        # and removes it from the driver management
+        self.ok = False
+        if self.n_buffers > 1: ueye.is_StopLiveVideo(self.hCam, ueye.IS_FORCE_VIDEO_STOP)
+        elif self.trigger_mode == 'hardware': ueye.is_DisableEvent(self.hCam, ueye.IS_SET_EVENT_FRAME)
+        self.free_memory()
+
         ueye.is_ExitCamera(self.hCam)                                                                   # Disables the hCam camera handle and releases the data structures 
                                                                                                         # and memory areas taken up by the uEye camera
 
@@ -450,5 +716,105 @@ class IdsCamera(object):
         return p1.value
 
 
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def set_pixel_clock(self, clock_mhz):                                                               # Sets the sensor pixel clock in MHz: the maximum frame rate and the
+                                                                                                        # exposure range depend on it, so set it before frame rate and exposure
+        nClock = ueye.UINT(int(clock_mhz))
+
+        rc = ueye.is_PixelClock(self.hCam, ueye.IS_PIXELCLOCK_CMD_SET, nClock, ueye.sizeof(nClock))
+        if rc != ueye.IS_SUCCESS:
+            print(colored('is_PixelClock\t\t', 'white'), colored('---> ERROR', 'red'))
+            try: self.log_file.write('\nis_PixelClock\t\t---> ERROR')
+            except: pass
+        else: self.pixel_clock = nClock.value
+
+
+    def get_pixel_clock(self):                                                                          # Returns the current pixel clock in MHz
+
+        nClock = ueye.UINT()
+
+        rc = ueye.is_PixelClock(self.hCam, ueye.IS_PIXELCLOCK_CMD_GET, nClock, ueye.sizeof(nClock))
+
+        print(colored('IDS camera pixel clock:\t\t\t\t', 'green'), str(nClock.value), ' MHz')
+        try: self.log_file.write('\nIDS camera pixel clock:\t\t\t\t\t\t'+str(nClock.value)+' MHz')
+        except: pass
+
+        return nClock.value
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def set_frame_rate(self, fps):                                                                      # Sets the sensor frame rate (free run and hardware trigger pacing)
+                                                                                                        # Returns the frame rate actually set by the driver
+        newFPS = ueye.DOUBLE()
+
+        rc = ueye.is_SetFrameRate(self.hCam, ueye.DOUBLE(fps), newFPS)
+        if rc != ueye.IS_SUCCESS:
+            print(colored('is_SetFrameRate\t\t', 'white'), colored('---> ERROR', 'red'))
+            try: self.log_file.write('\nis_SetFrameRate\t\t---> ERROR')
+            except: pass
+            return None
+
+        self.frame_rate = newFPS.value
+        print(colored('Camera frame rate setting: requested \t\t', 'green'), '{:.02f}'.format(fps), colored(' fps, got ', 'green'), '{:.02f}'.format(newFPS.value), colored(' fps', 'green'))
+        try: self.log_file.write('\nCamera frame rate setting: requested \t\t'+'{:.02f}'.format(fps)+' fps, got '+'{:.02f}'.format(newFPS.value)+' fps')
+        except: pass
+
+        if self.ok: self.set_camera_exposure(self.exp_time)                                             # A shorter frame time may have clipped the exposure time
+
+        return newFPS.value
+
+
+    def get_frame_rate_range(self):                                                                     # Returns the (minimum, maximum) frame rate allowed by the current pixel clock
+
+        tMin, tMax, tStep = ueye.DOUBLE(), ueye.DOUBLE(), ueye.DOUBLE()
+
+        rc = ueye.is_GetFrameTimeRange(self.hCam, tMin, tMax, tStep)
+        if rc != ueye.IS_SUCCESS or tMin.value <= 0 or tMax.value <= 0: return None
+
+        fps_range = (1.0/tMax.value, 1.0/tMin.value)
+        print(colored('IDS camera frame rate range:\t\t\t', 'green'), '{:.02f} - {:.02f}'.format(*fps_range), ' fps')
+        try: self.log_file.write('\nIDS camera frame rate range:\t\t\t\t'+'{:.02f} - {:.02f}'.format(*fps_range)+' fps')
+        except: pass
+
+        return fps_range
+
+
+    def get_frame_rate(self):                                                                           # Returns the frame rate measured by the driver
+
+        dblFPS = ueye.DOUBLE()
+
+        rc = ueye.is_GetFramesPerSecond(self.hCam, dblFPS)
+
+        return dblFPS.value
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def set_trigger_mode(self, mode):                                                                   # 'freerun', 'software' (one exposure for each grab) or 'hardware'
+                                                                                                        # (one exposure for each rising edge on the camera trigger input)
+        if mode not in IdsCamera.TRIGGER_MODES:
+            raise ValueError('Unknown trigger mode: '+str(mode)+', expected one of '+str(tuple(IdsCamera.TRIGGER_MODES)))
+
+        if self.ok: ueye.is_StopLiveVideo(self.hCam, ueye.IS_FORCE_VIDEO_STOP)                          # The trigger mode can be changed only with the live video stopped
+
+        rc = ueye.is_SetExternalTrigger(self.hCam, IdsCamera.TRIGGER_MODES[mode])
+        if rc != ueye.IS_SUCCESS:
+            print(colored('is_SetExternalTrigger\t', 'white'), colored('---> ERROR', 'red'))
+            try: self.log_file.write('\nis_SetExternalTrigger\t---> ERROR')
+            except: pass
+        else: self.trigger_mode = mode
+
+        if self.ok: self.start_capture()
+
+        print(colored('Camera trigger mode:\t\t\t\t', 'green'), self.trigger_mode)
+        try: self.log_file.write('\nCamera trigger mode:\t\t\t\t\t\t'+self.trigger_mode)
+        except: pass
+
+
 ######################################################################################################################################################################
 ######################################################################################################################################################################
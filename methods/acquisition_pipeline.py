@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+from frame_storage import TiffStorage
+import numpy as np, threading, queue, time
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Acquisition pipeline class:
+# producer/consumer pipeline that decouples the frame grabbing from the (slow) writing on the external USB storage device.
+# The acquisition loop acts as the capture thread (producer): each selected frame is copied into one of the 'queue_depth' preallocated slots of a ring buffer and
+# the slot index is pushed in a bounded queue. A pool of 'n_writers' writer threads (consumers) pops the slots, saves the frames with cv2.imwrite and gives the
+# slots back to the ring (the writer can be any storage backend of frame_storage, called as writer(path, frame, metadata)). When the ring is full the 'drop_policy' decides what happens:
+#           - 'block': the capture thread waits for a free slot (back-pressure, no frame is lost)
+#           - 'drop_newest': the incoming frame is discarded
+#           - 'drop_oldest': the oldest queued (not yet written) frame is discarded and its slot is reused
+# Per-stage counters (submitted, queued, written, failed, dropped, discarded by the writer, time spent waiting and writing) are available through the 'stats'
+# method.
+#
+# Input:    - queue_depth: number of preallocated frame slots in the ring buffer
+#           - n_writers: number of writer threads
+#           - drop_policy: behaviour when the ring buffer is full ('block', 'drop_newest' or 'drop_oldest')
+#           - log_file: (optional) output file (a RunLogger also receives the write time of each frame)
+#           - writer: (optional) function writer(path, frame, metadata) returning True on success, None if the frame was discarded on purpose (eg: no
+#             storage device with enough free space, see storage_manager) (default: TiffStorage, ie: cv2.imwrite)
+
+class AcquisitionPipeline(object):
+
+    DROP_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __init__(self, queue_depth=64, n_writers=2, drop_policy='block', log_file=None, writer=None):
+
+        if drop_policy not in AcquisitionPipeline.DROP_POLICIES:
+            raise ValueError('Unknown drop policy: '+str(drop_policy)+', expected one of '+str(AcquisitionPipeline.DROP_POLICIES))
+
+        self.queue_depth = max(int(queue_depth), 1)
+        self.n_writers = max(int(n_writers), 1)
+        self.drop_policy = drop_policy
+        self.log_file = log_file
+        self.metrics = log_file if hasattr(log_file, 'timing') else None                                # RunLogger: per-frame write time
+        self.writer = writer if writer is not None else TiffStorage()
+
+        self.slots = None                                                                               # Preallocated frame buffers (allocated at the first submitted frame)
+        self.paths = [None]*self.queue_depth
+        self.metadata = [None]*self.queue_depth
+        self.free_slots = queue.Queue()                                                                 # Indexes of the slots available to the capture thread
+        self.filled_slots = queue.Queue()                                                               # Indexes of the slots waiting to be written
+        for i in range(self.queue_depth): self.free_slots.put(i)
+
+        self.lock = threading.Lock()
+        self.counters = {'submitted': 0, 'queued': 0, 'written': 0, 'failed': 0, 'dropped': 0, 'discarded': 0,
+                         'capture_wait_time': 0.0, 'write_time': 0.0, 'max_queue_depth': 0}
+        self.writers = []
+        self.running = False
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def start(self):
+
+        if self.running: return
+        self.running = True
+        for i in range(self.n_writers):                                                                 # Start the writer pool
+            writer = threading.Thread(target=self._writer_loop, name='pipeline_writer_'+str(i), daemon=True)
+            writer.start()
+            self.writers.append(writer)
+
+        print(colored('Acquisition pipeline:\t\t\t\t', 'green'), 'queue depth = '+str(self.queue_depth)+', writers = '+str(self.n_writers)+', drop policy = '+self.drop_policy)
+        try: self.log_file.write('\nAcquisition pipeline:\t\t\t\t\t\tqueue depth = '+str(self.queue_depth)+', writers = '+str(self.n_writers)+', drop policy = '+self.drop_policy)
+        except: pass
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def submit(self, path, frame, metadata=None):                                                       # Called by the capture thread: returns True if the frame has been queued
+
+        if not self.running: self.start()
+
+        with self.lock: self.counters['submitted'] += 1
+
+        if self.slots is None or self.slots.shape[1:] != frame.shape or self.slots.dtype != frame.dtype:
+            self._allocate(frame)
+
+        t_start = time.perf_counter()
+        slot = self._acquire_slot()
+        with self.lock: self.counters['capture_wait_time'] += time.perf_counter() - t_start
+        if slot is None:
+            with self.lock: self.counters['dropped'] += 1
+            return False
+
+        np.copyto(self.slots[slot], frame)                                                              # Single copy of the frame into the ring buffer
+        self.paths[slot] = path
+        self.metadata[slot] = metadata
+        self.filled_slots.put(slot)
+
+        with self.lock:
+            self.counters['queued'] += 1
+            self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], self.filled_slots.qsize())
+
+        return True
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def close(self):                                                                                    # Wait until all the queued frames are written and stop the writer pool
+
+        if not self.running: return
+        for i in range(len(self.writers)): self.filled_slots.put(None)                                  # One stop sentinel for each writer
+        for writer in self.writers: writer.join()
+        self.writers = []
+        self.running = False
+        if hasattr(self.writer, 'close'): self.writer.close()                                           # Flush and close the storage backend
+        if hasattr(self.writer, 'report'): self.writer.report(self.log_file)                            # Compression ratio and encode time
+
+        stats = self.stats()
+        summary = 'written = '+str(stats['written'])+', dropped = '+str(stats['dropped'])+', failed = '+str(stats['failed'])
+        if stats['discarded'] > 0: summary += ', discarded (storage full) = '+str(stats['discarded'])
+        print(colored('\nAcquisition pipeline:\t\t\t\t', 'green'), summary)
+        try: self.log_file.write('\n\nAcquisition pipeline:\t\t\t\t\t\t'+summary)
+        except: pass
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def stats(self):
+
+        with self.lock: stats = dict(self.counters)
+        stats['queue_depth'] = self.filled_slots.qsize()
+
+        return stats
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _allocate(self, frame):
+
+        while self.filled_slots.qsize() > 0: time.sleep(0.001)                                          # Frame shape changed: wait for the pending frames before reallocating
+        self.slots = np.empty((self.queue_depth,)+frame.shape, dtype=frame.dtype)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _acquire_slot(self):
+
+        if self.drop_policy == 'block': return self.free_slots.get()
+
+        try: return self.free_slots.get_nowait()
+        except queue.Empty: pass
+
+        if self.drop_policy == 'drop_newest': return None
+
+        try:                                                                                            # 'drop_oldest': steal the oldest frame not yet taken by a writer
+            slot = self.filled_slots.get_nowait()
+            if slot is not None:
+                with self.lock: self.counters['dropped'] += 1
+                return slot
+            self.filled_slots.put(None)
+        except queue.Empty: pass
+
+        return self.free_slots.get()                                                                    # All the slots are being written: wait for the first one
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _writer_loop(self):
+
+        while True:
+            slot = self.filled_slots.get()
+            if slot is None: break
+
+            t_start = time.perf_counter()
+            try: save_status = self.writer(self.paths[slot], self.slots[slot], self.metadata[slot])
+            except: save_status = False
+            t_write = time.perf_counter() - t_start
+
+            self.free_slots.put(slot)
+            if self.metrics is not None: self.metrics.timing('write_ms', 1000*t_write)
+            with self.lock:
+                self.counters['write_time'] += t_write
+                if save_status: self.counters['written'] += 1
+                elif save_status is None: self.counters['discarded'] += 1                               # Not a write error (eg: storage full)
+                else: self.counters['failed'] += 1
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import numpy as np, threading
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Auto-exposure controller class:
+# closed-loop correction of the illumination drifts during the measurement. The capture loop only hands over the histogram of each frame (the one already
+# computed by FrameStatistics for the frame variance, no copy: FrameStatistics rebinds 'hist' to a new array at every frame and never updates it in place,
+# so the array read by the thread is never modified), while a background thread evaluates the latest histogram every 'interval' seconds and
+# adjusts the camera settings through 'set_camera_exposure' and 'set_camera_blacklevel':
+#           - exposure: the mean pixel value is kept at 'target_mean' (by default, the mean of the background images, so that the background variance used
+#             by the frame selection stays valid), with a relative 'deadband'; the exposure is reduced if more than 'max_saturated' pixels are saturated
+#           - black level: raised if more than 'max_null' pixels are null, lowered if the darkest pixels ('low_percentile') are above 'black_margin'
+# Each correction is limited to a factor 'max_step' on the exposure and to 'black_level_step' on the black level, the settings are clipped to the given
+# ranges, and every change is logged (RunLogger 'auto_exposure' event or log file).
+#
+# Input:    - camera: camera object (IdsCamera or SimulatedCamera)
+#           - log_file: (optional) output file (or RunLogger object)
+#           - target_mean: (optional) target mean pixel value; if None, the mean of the first evaluated frame
+#           - exposure_range: minimum and maximum exposure time [ms]
+#           - black_level_range: minimum and maximum black level
+#           - interval: minimum time between two consecutive corrections [s]
+#           - deadband: relative error of the mean pixel value below which the exposure is not changed
+#           - max_step: maximum exposure change factor of a single correction
+#           - max_saturated: maximum fraction of saturated pixels
+#           - max_null: maximum fraction of null pixels
+#           - black_level_step: black level change of a single correction
+#           - black_margin: pixel value of the darkest pixels above which the black level is lowered
+#           - low_percentile: percentile of the darkest pixels [%]
+
+class AutoExposureController(object):
+
+    def __init__(self, camera, log_file=None, target_mean=None, exposure_range=(0.005, 100.0), black_level_range=(0, 255), interval=2.0, deadband=0.05,
+                 max_step=1.25, max_saturated=0.001, max_null=0.001, black_level_step=4, black_margin=16, low_percentile=0.1):
+
+        self.camera = camera
+        self.log_file = log_file
+        self.target_mean = target_mean
+        self.exposure_range = (float(exposure_range[0]), float(exposure_range[1]))
+        self.black_level_range = (int(black_level_range[0]), int(black_level_range[1]))
+        self.interval = float(interval)
+        self.deadband = float(deadband)
+        self.max_step = max(float(max_step), 1.0)
+        self.max_saturated = float(max_saturated)
+        self.max_null = float(max_null)
+        self.black_level_step = max(int(black_level_step), 1)
+        self.black_margin = int(black_margin)
+        self.low_percentile = float(low_percentile)
+
+        self.exposure = float(camera.exp_time) or self.exposure_range[0]                                # Driver auto-exposure (0): start from the shortest exposure
+        self.black_level = int(camera.black_level)
+        self.latest = None                                                                              # Latest frame histogram handed over by the capture loop
+        self.new_frame = threading.Event()
+        self.stopped = threading.Event()
+        self.running = False
+        self.thread = None
+        self.n_adjustments = 0
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def submit(self, hist):                                                                             # Called by the capture loop: hands over the frame histogram (no copy)
+
+        if hist is None: return
+        self.latest = hist
+        self.new_frame.set()
+
+
+    def start(self):
+
+        if self.running: return
+        self.running = True
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._control_loop, name='auto_exposure', daemon=True)
+        self.thread.start()
+
+        summary = 'exposure '+'{:.3f}'.format(self.exposure)+' ms '+str(self.exposure_range)+', black level '+str(self.black_level)+' '+str(self.black_level_range)
+        print(colored('Auto-exposure:\t\t\t\t\t', 'green'), summary)
+        try: self.log_file.write('\nAuto-exposure:\t\t\t\t\t\t\t\t'+summary)
+        except: pass
+
+
+    def stop(self):
+
+        if not self.running: return
+        self.running = False
+        self.stopped.set()
+        self.new_frame.set()
+        self.thread.join()
+        self.thread = None
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def update(self, hist):                                                                             # Returns the new (exposure, black level) for the given histogram
+
+        n = int(hist.sum())
+        if n == 0: return self.exposure, self.black_level
+
+        levels = np.arange(hist.size, dtype=np.float64)
+        mean = float(np.dot(hist, levels))/n
+        saturated, null = hist[-1]/n, hist[0]/n
+        low = int(np.searchsorted(np.cumsum(hist), n*self.low_percentile/100.0))                        # Pixel value of the darkest pixels
+        if self.target_mean is None: self.target_mean = mean
+
+        exposure = self.exposure
+        if saturated > self.max_saturated: exposure = self.exposure/self.max_step                       # Saturation: always reduce the exposure
+        elif mean > 0 and abs(mean - self.target_mean) > self.deadband*self.target_mean:
+            exposure = self.exposure*min(max(self.target_mean/mean, 1.0/self.max_step), self.max_step)
+        exposure = min(max(exposure, self.exposure_range[0]), self.exposure_range[1])
+
+        black_level = self.black_level
+        if null > self.max_null: black_level = self.black_level + self.black_level_step
+        elif low > self.black_margin: black_level = self.black_level - self.black_level_step
+        black_level = min(max(black_level, self.black_level_range[0]), self.black_level_range[1])
+
+        return exposure, black_level
+
+
+    def _control_loop(self):
+
+        while self.running:
+            self.new_frame.wait()
+            if not self.running: break
+            self.new_frame.clear()
+            hist = self.latest
+
+            exposure, black_level = self.update(hist)
+            if exposure != self.exposure or black_level != self.black_level:
+                if exposure != self.exposure:
+                    self.camera.exp_time = exposure                                                     # Kept by the camera, eg: for a readout change
+                    self.camera.set_camera_exposure(exposure)
+                if black_level != self.black_level:
+                    self.camera.black_level = black_level
+                    self.camera.set_camera_blacklevel(black_level)
+                self.exposure, self.black_level = exposure, black_level
+                self.n_adjustments += 1
+                self._log(hist)
+
+            if self.stopped.wait(self.interval): break                                                  # Rate limit (the frames in between are not evaluated)
+
+
+    def _log(self, hist):
+
+        n = max(int(hist.sum()), 1)
+        fields = {'exposure_ms': self.exposure, 'black_level': self.black_level, 'target_mean': self.target_mean,
+                  'saturated_fraction': hist[-1]/n, 'null_fraction': hist[0]/n}
+        message = 'Auto-exposure:\t\t\t\t\texposure '+'{:.3f}'.format(self.exposure)+' ms, black level '+str(self.black_level)
+        if hasattr(self.log_file, 'log'):
+            self.log_file.log('info', 'auto_exposure', message, **{key: float(value) for key, value in fields.items()})
+            return
+        print(message)
+        try: self.log_file.write('\n'+message)
+        except: pass
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
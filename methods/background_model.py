@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import numpy as np, threading, time
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Background model class:
+# streaming background statistics, updated frame by frame while the background images are grabbed (no need to read them back from the USB storage device).
+# The per-pixel running mean and variance are computed with the Welford algorithm on preallocated float32 arrays (in-place operations only), while the scalar
+# background variance is the running mean of the frame variances, as in the 'background' method. The first 'skip' frames are ignored, as 'background' does
+# with the first image of the folder. The statistics are saved in (and can be restored from) a single compressed .npz file.
+#
+# Input:    - skip: number of initial frames to ignore
+
+class BackgroundModel(object):
+
+    def __init__(self, skip=1):
+
+        self.skip = int(skip)
+        self.n_frames = 0                                                                               # Number of frames passed to 'update' (skipped ones included)
+        self.count = 0                                                                                  # Number of frames in the statistics
+        self.mean = None                                                                                # Per-pixel running mean
+        self.m2 = None                                                                                  # Per-pixel sum of squared deviations
+        self.delta = None
+        self.scratch = None
+        self.frame_var_mean = 0.0                                                                       # Running mean of the frame variances
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def update(self, frame, frame_var):
+
+        self.n_frames += 1
+        if self.n_frames <= self.skip: return
+        if frame.ndim == 3: frame = frame[:, :, 0]
+
+        if self.mean is None or self.mean.shape != frame.shape:
+            self.count = 0
+            self.frame_var_mean = 0.0
+            self.mean = np.zeros(frame.shape, dtype=np.float32)
+            self.m2 = np.zeros(frame.shape, dtype=np.float32)
+            self.delta = np.empty(frame.shape, dtype=np.float32)
+            self.scratch = np.empty(frame.shape, dtype=np.float32)
+
+        self.count += 1
+        np.subtract(frame, self.mean, out=self.delta)                                                   # delta = x - mean_(n-1)
+        np.multiply(self.delta, 1.0/self.count, out=self.scratch)
+        np.add(self.mean, self.scratch, out=self.mean)                                                  # mean_n = mean_(n-1) + delta/n
+        np.subtract(frame, self.mean, out=self.scratch)
+        np.multiply(self.scratch, self.delta, out=self.scratch)
+        np.add(self.m2, self.scratch, out=self.m2)                                                      # M2_n = M2_(n-1) + delta*(x - mean_n)
+
+        self.frame_var_mean += (float(frame_var) - self.frame_var_mean)/self.count
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def variance(self):                                                                                 # Returns the background mean variance and standard deviation
+
+        return self.frame_var_mean, np.sqrt(self.frame_var_mean)
+
+
+    def pixel_variance(self):                                                                           # Returns the per-pixel background variance
+
+        if self.m2 is None or self.count == 0: return None
+
+        return self.m2/max(self.count - 1, 1)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def save(self, path, log_file=None):
+
+        np.savez_compressed(path, mean=self.mean, var=self.pixel_variance(), count=self.count, frame_var=self.frame_var_mean)
+
+        print(colored('Background statistics saved:\t\t\t', 'green'), str(path), '('+str(self.count)+' images)')
+        try: log_file.write('\nBackground statistics saved:\t\t\t\t'+str(path)+' ('+str(self.count)+' images)')
+        except: pass
+
+
+    @staticmethod
+    def load(path):
+
+        model = BackgroundModel(skip=0)
+        with np.load(path) as data:
+            model.count = int(data['count'])
+            model.n_frames = model.count
+            model.frame_var_mean = float(data['frame_var'])
+            model.mean = data['mean'].astype(np.float32)
+            model.m2 = data['var'].astype(np.float32)*max(model.count - 1, 1)
+            model.delta = np.empty(model.mean.shape, dtype=np.float32)
+            model.scratch = np.empty(model.mean.shape, dtype=np.float32)
+
+        return model
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Adaptive background class:
+# rolling background of long measurements, compensating the laser power and thermal drifts that would make a frozen background variance over-accept or
+# over-reject frames. The object wraps the detector stage of 'variance_selection' (same detector(frame, frame_var) interface): every frame classified as
+# empty updates the background statistics of the detector with an exponential running mean (weight 'alpha', ie: a memory of about 1/alpha empty frames),
+# while the hit frames are never used. The update is done in place by the detector ('update_background'): the background variance of the variance
+# detector (one operation per frame), or the sampled per-pixel mean and the tile noise of the tile detector (a few passes on 1/stride^2 of the pixels).
+# Every 'checkpoint_interval' seconds the current statistics are saved in the run folder ('checkpoint_path' .npz file) by a separate thread, so that the
+# capture loop does not wait for the storage device; the run continues without stopping to record the background images again.
+#
+# Input:    - detector: detector stage (VarianceDetector or TileDetector, see object_detector)
+#           - alpha: weight of each empty frame in the exponential running statistics (0 < alpha <= 1)
+#           - checkpoint_path: (optional) .npz file of the checkpoints; if None, no checkpoint is saved
+#           - checkpoint_interval: time between two consecutive checkpoints [s]
+#           - log_file: (optional) output file (or RunLogger object)
+
+class AdaptiveBackground(object):
+
+    def __init__(self, detector, alpha=0.01, checkpoint_path=None, checkpoint_interval=600.0, log_file=None):
+
+        if not 0 < alpha <= 1: raise ValueError('Background update weight out of range (0, 1]: '+str(alpha))
+
+        self.detector = detector
+        self.alpha = float(alpha)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = float(checkpoint_interval)
+        self.log_file = log_file
+        self.n_frames = 0
+        self.n_updates = 0                                                                              # Empty frames used for the background
+        self.last_checkpoint = time.time()
+        self.thread = None
+
+        summary = 'alpha '+str(self.alpha)+' (about '+str(int(round(1/self.alpha)))+' empty frames)'
+        print(colored('Adaptive background:\t\t\t\t', 'green'), summary)
+        try: log_file.write('\nAdaptive background:\t\t\t\t\t\t'+summary)
+        except: pass
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __call__(self, frame, frame_var):                                                               # Returns (hit, bounding box, score) of the wrapped detector
+
+        hit, bbox, score = self.detector(frame, frame_var)
+        self.n_frames += 1
+        if not hit:
+            self.detector.update_background(frame, frame_var, self.alpha)
+            self.n_updates += 1
+        if self.checkpoint_path is not None and time.time() - self.last_checkpoint >= self.checkpoint_interval: self.checkpoint()
+
+        return hit, bbox, score
+
+
+    def checkpoint(self, wait=False):                                                                   # Saves the current statistics (in a separate thread)
+
+        self.last_checkpoint = time.time()
+        if self.thread is not None and self.thread.is_alive():
+            if not wait: return                                                                         # Previous checkpoint still being written
+            self.thread.join()
+
+        state = self.detector.state()                                                                   # Copy of the statistics, taken in the capture thread
+        state.update({'frames': self.n_frames, 'updates': self.n_updates, 'alpha': self.alpha, 'timestamp': self.last_checkpoint})
+        self.thread = threading.Thread(target=self._save, args=(state,), name='background_checkpoint', daemon=True)
+        self.thread.start()
+        if wait: self.thread.join()
+
+
+    def close(self):                                                                                    # Final checkpoint
+
+        if self.checkpoint_path is not None: self.checkpoint(wait=True)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _save(self, state):
+
+        try: np.savez(self.checkpoint_path, **state)
+        except OSError as error:
+            if hasattr(self.log_file, 'log'): self.log_file.log('warning', 'background_checkpoint', 'Background checkpoint failed:\t\t'+str(error))
+            return
+
+        fields = {'updates': self.n_updates, 'frames': self.n_frames}
+        if 'bkg_var' in state: fields['bkg_var'] = state['bkg_var']
+        if hasattr(self.log_file, 'log'):
+            self.log_file.log('debug', 'background_checkpoint', 'Background checkpoint:\t\t\t'+str(fields), **fields)
+            return
+        try: self.log_file.write('\nBackground checkpoint:\t\t\t\t\t'+str(fields))
+        except: pass
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
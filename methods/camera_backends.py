@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Camera and GPIO backends:
+# the acquisition methods do not import the hardware libraries (pyueye, RPi.GPIO) at module load anymore. The camera is created through 'open_camera' according
+# to the selected backend and the GPIO calls go through the module-level 'GPIO' proxy, which resolves to RPi.GPIO at the first use unless another pin controller
+# (eg: SimulatedGPIO) has been selected before. This allows to run the whole acquisition pipeline headless on a normal Linux box.
+#
+# Camera backends:  - 'ids': IDS Ueye camera through pyueye (IdsCamera)
+#                   - 'simulated': synthetic holograms or replayed TIFF stacks (SimulatedCamera)
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+CAMERA_BACKENDS = ('ids', 'simulated')
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# GPIO proxy class:
+# forwards every attribute (setmode, setup, input, output, BCM, ...) to the selected pin controller; RPi.GPIO is imported only when nothing else was selected.
+
+class GpioProxy(object):
+
+    def __init__(self):
+
+        self.backend = None
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def select(self, backend):                                                                          # Select the pin controller (None = RPi.GPIO)
+
+        self.backend = backend
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __getattr__(self, name):
+
+        if self.backend is None:
+            import RPi.GPIO
+            self.backend = RPi.GPIO
+
+        return getattr(self.backend, name)
+
+
+GPIO = GpioProxy()
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Camera factory method:
+# create (without connecting it) the camera object of the selected backend
+#
+# Input:    - backend: camera backend ('ids' or 'simulated')
+#           - log_file: output file
+#           - exposure_time: camera exposure time
+#           - black_level: camera black level offset
+#           - remote_control: auxiliary flag for LIVE software control
+#           - **kwargs: backend specific options (eg: n_buffers, frame_stats, source, fps)
+#
+# Return:   - camera: the camera object
+
+def open_camera(backend, log_file, exposure_time, black_level, remote_control, **kwargs):
+
+    if backend == 'ids':
+        from IDS_camera import IdsCamera
+        return IdsCamera(log_file, exposure_time, black_level, remote_control, **kwargs)
+
+    if backend == 'simulated':
+        from simulated_camera import SimulatedCamera
+        return SimulatedCamera(log_file, exposure_time, black_level, remote_control, **kwargs)
+
+    raise ValueError('Unknown camera backend: '+str(backend)+', expected one of '+str(CAMERA_BACKENDS))
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import time
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Frame scheduler class:
+# deadline-based pacing of the acquisition loops, replacing the time.sleep(time_sleep) after each save. The k-th frame is due at t0 + k*period: 'wait' sleeps
+# only for the time left until the next deadline, so that the grab, variance and write times do not add to the interval and the rate does not drift with the
+# disk latency. A frame ready after its deadline is counted as an overrun and, if the loop is late by more than one period, the missed deadlines are skipped
+# instead of bursting to catch up.
+# The achieved rate, the overruns and the jitter (lateness of the loop with respect to the deadlines) are available through 'stats'. With a null period the
+# loop is not paced (eg: when the camera frame rate or trigger sets the pace) and the achieved rate is the maximum rate of the acquisition loop.
+#
+# Input:    - period: time between two consecutive frames [s] (0: no pacing)
+
+class FrameScheduler(object):
+
+    def __init__(self, period):
+
+        self.period = float(period)
+        self.t_start = None
+        self.deadline = None
+        self.n_frames = 0
+        self.overruns = 0
+        self.max_lateness = 0.0
+        self.sum_lateness = 0.0
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def wait(self):                                                                                     # Wait for the next frame deadline
+
+        now = time.perf_counter()
+        self.n_frames += 1
+        if self.t_start is None: self.t_start = now
+        if self.period <= 0: return                                                                     # No pacing, only the frame count
+
+        if self.deadline is None: self.deadline = now + self.period                                     # First frame: the schedule starts now
+        else: self.deadline += self.period
+
+        remaining = self.deadline - now
+        if remaining > 0:
+            time.sleep(remaining)
+            return
+
+        lateness = -remaining                                                                           # Deadline missed (overrun)
+        self.overruns += 1
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.sum_lateness += lateness
+        if lateness > self.period: self.deadline += int(lateness/self.period)*self.period               # Skip the missed deadlines
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def stats(self):
+
+        elapsed = time.perf_counter() - self.t_start if self.t_start is not None else 0.0
+
+        return {'frames': self.n_frames, 'target_rate': 1.0/self.period if self.period > 0 else None,
+                'achieved_rate': self.n_frames/elapsed if elapsed > 0 else 0.0, 'overruns': self.overruns,
+                'max_lateness_ms': 1000*self.max_lateness, 'mean_lateness_ms': 1000*self.sum_lateness/max(self.n_frames, 1)}
+
+
+    def report(self, log_file=None):
+
+        stats = self.stats()
+        target = '{:.2f} fps'.format(stats['target_rate']) if stats['target_rate'] else 'free run'
+        summary = 'target {}, achieved {:.2f} fps, overruns {:d}, max lateness {:.1f} ms'.format(target, stats['achieved_rate'], stats['overruns'],
+                                                                                                 stats['max_lateness_ms'])
+        print(colored('Frame scheduler:\t\t\t\t', 'green'), summary)
+        try: log_file.write('\nFrame scheduler:\t\t\t\t\t\t\t'+summary)
+        except: pass
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import numpy as np, os                                                                                  # Import required libraries
+from frame_storage import read_frame_file
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Frame stack class:
+# batch of N frames held in a single contiguous (N, height, width) array (uint8 for the Mono8 frames; the first channel of multi-channel frames), for the
+# vectorized statistics of the background images and of the recorded runs:
+#           - per-frame statistics ('frame_statistics'): mean, variance, minimum and maximum value of each frame
+#           - per-pixel statistics ('pixel_statistics'): mean and variance of each pixel over the frames
+#           - median background ('median_background'): per-pixel median over the frames (robust to the particles crossing the field of view)
+#           - defect maps ('defect_maps'): hot and dead pixels of the sensor
+# The statistics are computed 'batch_size' frames at a time in a preallocated float32 scratch buffer (exact sums and sums of squares for 8 bit frames),
+# accumulated in float64, so that no temporary array of the size of the whole stack is created. The frames are loaded from files ('load') in a single
+# preallocated array; sets too large for the memory are processed by 'iter_chunks', which reuses the same array for every chunk of 'chunk_size' frames,
+# and by the 'stack_statistics' method.
+#
+# Input:    - frames: 3D array (N, height, width[, channels]) or list of 2D frames
+#           - names: (optional) list of the frame names
+#           - batch_size: number of frames of each vectorized batch
+
+class FrameStack(object):
+
+    def __init__(self, frames, names=None, batch_size=16):
+
+        if isinstance(frames, (list, tuple)): frames = np.stack([frame[:, :, 0] if frame.ndim == 3 else frame for frame in frames])
+        if frames.ndim == 4: frames = frames[:, :, :, 0]
+        if frames.ndim != 3: raise ValueError('Frame stack of shape '+str(frames.shape)+', expected (N, height, width)')
+
+        self.frames = np.ascontiguousarray(frames)                                                      # No copy for an already contiguous stack
+        self.names = list(names) if names is not None else None
+        self.batch_size = max(int(batch_size), 1)
+        self.scratch = None                                                                             # Preallocated float32 batch buffer
+
+
+    def __len__(self):
+
+        return self.frames.shape[0]
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    @staticmethod
+    def load(paths, stride=1, batch_size=16, out=None):                                                 # Loads every 'stride'-th frame file in one preallocated array
+
+        paths = list(paths)[::max(int(stride), 1)]
+        if len(paths) == 0: raise ValueError('No frame to load')
+
+        first = read_frame_file(paths[0])
+        if first is None: raise IOError('Could not read '+paths[0])
+        if first.ndim == 3: first = first[:, :, 0]
+        if out is None or out.shape[0] < len(paths) or out.shape[1:] != first.shape or out.dtype != first.dtype:
+            out = np.empty((len(paths),)+first.shape, dtype=first.dtype)
+
+        frames = out[:len(paths)]
+        frames[0] = first
+        for i, path in enumerate(paths[1:], 1):
+            frame = read_frame_file(path)
+            if frame is None: raise IOError('Could not read '+path)
+            frames[i] = frame[:, :, 0] if frame.ndim == 3 else frame
+
+        return FrameStack(frames, [os.path.basename(path) for path in paths], batch_size)
+
+
+    @staticmethod
+    def iter_chunks(paths, chunk_size=256, batch_size=16):                                              # Yields FrameStack objects of at most 'chunk_size' frames
+
+        paths, buffer = list(paths), None
+        for start in range(0, len(paths), max(int(chunk_size), 1)):
+            chunk = FrameStack.load(paths[start:start + chunk_size], batch_size=batch_size, out=buffer)
+            buffer = chunk.frames.base if chunk.frames.base is not None else chunk.frames               # Same array for the next chunk
+            yield chunk
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _batches(self):                                                                                 # Yields the float32 copy of each batch, as (n_frames, n_pixels)
+
+        n_pixels = self.frames.shape[1]*self.frames.shape[2]
+        if self.scratch is None or self.scratch.shape[1] != n_pixels: self.scratch = np.empty((self.batch_size, n_pixels), dtype=np.float32)
+        flat = self.frames.reshape(len(self), n_pixels)
+
+        for start in range(0, len(self), self.batch_size):
+            batch = self.scratch[:min(self.batch_size, len(self) - start)]
+            np.copyto(batch, flat[start:start + batch.shape[0]])
+            yield start, batch
+
+
+    def accumulate(self, pixel_sums=None):                                                              # Single pass on the stack: per-frame and per-pixel sums
+
+        n_pixels = self.frames.shape[1]*self.frames.shape[2]
+        frame_sum, frame_sumsq = np.empty(len(self)), np.empty(len(self))
+        frame_min, frame_max = np.empty(len(self)), np.empty(len(self))
+        if pixel_sums is None: pixel_sums = [np.zeros(n_pixels), np.zeros(n_pixels), 0]                 # [sum, sum of squares, number of frames]
+
+        for start, batch in self._batches():
+            stop = start + batch.shape[0]
+            frame_min[start:stop], frame_max[start:stop] = batch.min(axis=1), batch.max(axis=1)
+            frame_sum[start:stop] = batch.sum(axis=1, dtype=np.float64)
+            pixel_sums[0] += batch.sum(axis=0, dtype=np.float64)
+            np.multiply(batch, batch, out=batch)                                                        # Exact squares of the 8 bit values
+            frame_sumsq[start:stop] = batch.sum(axis=1, dtype=np.float64)
+            pixel_sums[1] += batch.sum(axis=0, dtype=np.float64)
+        pixel_sums[2] += len(self)
+
+        frame_mean = frame_sum/n_pixels
+        frame_stats = {'mean': frame_mean, 'var': np.maximum(frame_sumsq/n_pixels - frame_mean**2, 0.0), 'min': frame_min, 'max': frame_max}
+
+        return frame_stats, pixel_sums
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def frame_statistics(self):                                                                         # Returns {'mean', 'var', 'min', 'max'}: one value for each frame
+
+        return self.accumulate()[0]
+
+
+    def pixel_statistics(self):                                                                         # Returns the per-pixel mean and variance (float32 images)
+
+        return pixel_moments(self.accumulate()[1], self.frames.shape[1:])
+
+
+    def median_background(self, block_size=64e6):                                                       # Returns the per-pixel median over the frames (float32 image)
+
+        n, height, width = self.frames.shape
+        rows = max(int(block_size//max(n*width*self.frames.itemsize, 1)), 1)                            # Image rows of each block (bounded partition copy)
+        median = np.empty((height, width), dtype=np.float32)
+        for start in range(0, height, rows): median[start:start + rows] = np.median(self.frames[:, start:start + rows], axis=0)
+
+        return median
+
+
+    def defect_maps(self, k=6.0, mean=None, var=None):                                                  # Returns the hot and dead pixel maps (boolean images)
+
+        if mean is None or var is None: mean, var = self.pixel_statistics()
+
+        return defect_maps(mean, var, k)
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Pixel moments method:
+# per-pixel mean and variance from the sums accumulated by FrameStack.accumulate (over one or more stacks)
+#
+# Input:    - pixel_sums: [sum, sum of squares, number of frames]
+#           - shape: frame size (height, width)
+#
+# Return:   - mean: per-pixel mean (float32 image)
+#           - var: per-pixel variance (float32 image)
+
+def pixel_moments(pixel_sums, shape):
+
+    count = max(pixel_sums[2], 1)
+    mean = pixel_sums[0]/count
+    var = np.maximum(pixel_sums[1]/count - mean**2, 0.0)
+
+    return mean.reshape(shape).astype(np.float32), var.reshape(shape).astype(np.float32)
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Defect maps method:
+# hot and dead pixels of the sensor from the per-pixel statistics of a set of (background) frames: a pixel is hot if its mean value is more than 'k' robust
+# standard deviations (1.4826 x median absolute deviation of the mean image) above the median of the mean image, dead if it is more than 'k' robust standard
+# deviations below it or if its value never changes (null variance, eg: stuck pixels)
+#
+# Input:    - mean: per-pixel mean
+#           - var: per-pixel variance
+#           - k: threshold [robust standard deviations]
+#
+# Return:   - hot: boolean image of the hot pixels
+#           - dead: boolean image of the dead pixels
+
+def defect_maps(mean, var, k=6.0):
+
+    center = float(np.median(mean))
+    spread = max(1.4826*float(np.median(np.abs(mean - center))), 1e-3)
+
+    return mean > center + k*spread, (mean < center - k*spread) | (var == 0)
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Stack statistics method:
+# per-frame and per-pixel statistics of a set of frame files of any size, loaded 'chunk_size' frames at a time in the same preallocated array
+#
+# Input:    - paths: list of frame files
+#           - chunk_size: number of frames loaded at a time
+#           - batch_size: number of frames of each vectorized batch
+#
+# Return:   - stats: dictionary with the per-frame arrays ('frame_mean', 'frame_var', 'frame_min', 'frame_max'), the per-pixel images ('pixel_mean',
+#             'pixel_var') and the number of frames ('count')
+
+def stack_statistics(paths, chunk_size=256, batch_size=16):
+
+    frame_stats, pixel_sums, shape = [], None, None
+    for chunk in FrameStack.iter_chunks(paths, chunk_size, batch_size):
+        if shape is not None and chunk.frames.shape[1:] != shape: raise ValueError('Frames of different size: '+str(chunk.frames.shape[1:])+', '+str(shape))
+        stats, pixel_sums = chunk.accumulate(pixel_sums)
+        frame_stats.append(stats)
+        shape = chunk.frames.shape[1:]
+    if shape is None: raise ValueError('No frame to analyze')
+
+    pixel_mean, pixel_var = pixel_moments(pixel_sums, shape)
+    stats = {'frame_'+key: np.concatenate([chunk_stats[key] for chunk_stats in frame_stats]) for key in ('mean', 'var', 'min', 'max')}
+    stats.update({'pixel_mean': pixel_mean, 'pixel_var': pixel_var, 'count': pixel_sums[2]})
+
+    return stats
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
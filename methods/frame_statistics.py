@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import numpy as np, cv2, time                                                                           # Import required libraries
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Frame statistics class:
+# per-frame processing stage applied by IdsCamera.grab_image. The optional resize is skipped when the scale factor is 1.0 (no full-frame copy), the variance is
+# evaluated on a region of interest and/or on a strided subsample of the pixels, and, for 8/16 bits images, it is computed in a single pass by integer accumulation
+# (histogram of the pixel values, exact sum and sum of squares) instead of the float64 np.var. The strided subsample is gathered in a preallocated scratch buffer,
+# reused frame after frame, so that no memory is allocated on the hot path. The histogram ('hist') is a new array for every frame: it must be rebound and never
+# updated in place, since it is handed over to other threads without a copy (eg: AutoExposureController.submit).
+#
+# Input:    - scale: resize factor applied to the frame (1.0 = no resize)
+#           - roi: (optional) region of interest (y_start, y_stop, x_start, x_stop) used for the statistics
+#           - stride: subsampling step along both image axes used for the statistics (1 = every pixel)
+#           - integer: boolean value to enable the integer accumulation for 8/16 bits images
+
+class FrameStatistics(object):
+
+    def __init__(self, scale=1.0, roi=None, stride=1, integer=True):
+
+        self.scale = float(scale)
+        self.roi = tuple(roi) if roi is not None else None
+        self.stride = max(int(stride), 1)
+        self.integer = integer
+        self.scratch = None                                                                             # Contiguous buffer for the subsampled pixels
+        self.hist = None                                                                                # Histogram of the last analyzed frame (integer accumulation only; rebound,
+                                                                                                        # never updated in place)
+        self.last_time = 0.0                                                                            # Resize and statistics time of the last frame [s]
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def resize(self, frame):
+
+        if self.scale == 1.0: return frame                                                              # No-op resize: keep the original array
+
+        return cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def sample(self, frame):                                                                            # Returns the (contiguous) pixels on which the statistics are computed
+
+        if self.roi is not None:
+            y0, y1, x0, x1 = self.roi
+            frame = frame[y0:y1, x0:x1]
+        if self.stride > 1: frame = frame[::self.stride, ::self.stride]
+        if frame.flags['C_CONTIGUOUS']: return frame
+
+        if self.scratch is None or self.scratch.shape != frame.shape or self.scratch.dtype != frame.dtype:
+            self.scratch = np.empty(frame.shape, dtype=frame.dtype)
+        np.copyto(self.scratch, frame)
+
+        return self.scratch
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def variance(self, frame):
+
+        pixels = self.sample(frame)
+        if pixels.size == 0: return 0.0
+
+        if self.integer and pixels.dtype in (np.uint8, np.uint16):                                     # Single pass: histogram of the pixel values
+            self.hist = np.bincount(pixels.reshape(-1), minlength=256 if pixels.dtype == np.uint8 else 65536)
+            values = np.arange(self.hist.size, dtype=np.uint64)
+            n = int(pixels.size)
+            s1 = int(np.dot(self.hist.astype(np.uint64), values))                                       # Exact sum of the pixel values
+            s2 = int(np.dot(self.hist.astype(np.uint64), values*values))                                # Exact sum of the squared pixel values
+            return (n*s2 - s1*s1)/(n*n)
+
+        return float(np.var(pixels))
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __call__(self, frame):                                                                          # Returns the (eventually resized) frame, its variance and standard deviation
+
+        t_start = time.perf_counter()
+        frame = self.resize(frame)
+        frame_var = self.variance(frame)
+        self.last_time = time.perf_counter() - t_start
+
+        return frame, frame_var, np.sqrt(frame_var)
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Image histogram method:
+# histogram of the pixel values of an image (or of its region of interest, eventually sampled every 'stride' pixels) computed with a single np.bincount pass;
+# 8 bits images have 256 bins, 16 bits images 65536 bins, other images are clipped and converted to 8 bits
+#
+# Input:    - img: image to be analyzed
+#           - roi: (optional) region of interest (y_start, y_stop, x_start, x_stop); if None, the whole image
+#           - stride: subsampling step along both image axes (1 = every pixel)
+#
+# Return:   - hist: histogram of the pixel values
+
+def image_histogram(img, roi=None, stride=1):
+
+    if roi is not None: img = img[roi[0]:roi[1], roi[2]:roi[3]]
+    if stride > 1: img = img[::stride, ::stride]
+    if img.dtype not in (np.uint8, np.uint16): img = np.clip(img, 0, 255).astype(np.uint8)
+
+    return np.bincount(img.reshape(-1), minlength=256 if img.dtype == np.uint8 else 65536)
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Histogram statistics method:
+# minimum, maximum, mean value and standard deviation, number of null and saturated (last bin) pixels of an image, all derived from its histogram
+#
+# Input:    - hist: histogram of the pixel values (eg: from 'image_histogram' or FrameStatistics.hist)
+#
+# Return:   - stats: dictionary with the image statistics (min, max, mean, std, null_pixels, saturated_pixels)
+
+def histogram_statistics(hist):
+
+    n = int(hist.sum())
+    if n == 0: return {'min': 0, 'max': 0, 'mean': 0.0, 'std': 0.0, 'null_pixels': 0, 'saturated_pixels': 0}
+
+    levels = np.flatnonzero(hist)
+    values = np.arange(hist.size, dtype=np.float64)
+    mean = float(np.dot(hist, values))/n
+    var = max(float(np.dot(hist, values*values))/n - mean*mean, 0.0)
+
+    return {'min': int(levels[0]), 'max': int(levels[-1]), 'mean': mean, 'std': float(np.sqrt(var)), 'null_pixels': int(hist[0]),
+            'saturated_pixels': int(hist[-1])}
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -0,0 +1,583 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import numpy as np, cv2, os, io, time, threading, json
+try: import h5py                                                                                        # Optional: HDF5 container
+except ImportError: h5py = None
+try: import lz4.frame                                                                                   # Optional: LZ4 frame files
+except ImportError: lz4 = None
+try: import zstandard                                                                                   # Optional: Zstandard frame files
+except ImportError: zstandard = None
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Storage backends:
+# writer functions for the AcquisitionPipeline, called as storage(path, frame, metadata) by the writer threads and closed by the pipeline at the end of the run.
+#
+#           - 'tiff': one image file per frame (original layout, 'image_000NNNN.tif' in the data folder), encoded with one of the lossless FRAME_CODECS
+#           - 'hdf5': frames appended to a chunked, optionally compressed, HDF5 dataset (requires h5py)
+#           - 'npz': Zarr-style directory of chunk files (one .npz file every 'chunk_size' frames), no extra dependency
+#           - 'raw': memory-mapped, append-only log of fixed-size frames with an index file (highest write throughput, no encoding)
+#
+# In the chunked formats the per-frame metadata (index, timestamp, variance, exposure, frame name) is stored in a parallel table, the frames are collected
+# in an in-memory chunk and written 'chunk_size' at a time, and the container is flushed at least every 'flush_interval' seconds.
+
+STORAGE_FORMATS = ('tiff', 'hdf5', 'npz', 'raw')
+FRAME_CODECS = {'tiff': '.tif', 'tiff_lzw': '.tif', 'tiff_deflate': '.tif', 'png': '.png', 'lz4': '.lz4', 'zstd': '.zst'}
+
+METADATA_DTYPE = np.dtype([('index', np.int64), ('timestamp', np.float64), ('variance', np.float64), ('exposure', np.float64), ('name', 'S32')])
+RAW_INDEX_DTYPE = np.dtype(METADATA_DTYPE.descr + [('offset', np.int64)])
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# TIFF storage class:
+# one image file per frame, written with cv2.imwrite (the path of each frame is given by the caller)
+
+class TiffStorage(object):
+
+    def __call__(self, path, frame, metadata=None):
+
+        return cv2.imwrite(path, frame)
+
+
+    def close(self):
+
+        pass
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Frame file storage class:
+# one file per frame, losslessly compressed to reduce the bytes written through the USB bus. The frame is encoded in memory by the calling writer thread
+# (cv2.imencode and the LZ4/Zstandard compressors release the GIL, so the pipeline writer pool is also the encoder pool) directly from the ring buffer slot,
+# without intermediate copies, and the encoded buffer is written to the file. The file extension of the frame path is replaced by the one of the codec:
+#           - 'tiff': uncompressed TIFF (as cv2.imwrite)
+#           - 'tiff_lzw', 'tiff_deflate': TIFF with LZW or deflate compression (readable by any image viewer)
+#           - 'png': PNG with compression 'level' (0-9, default 1: fastest)
+#           - 'lz4', 'zstd': raw frame in the .npy layout compressed with LZ4 or Zstandard (compression 'level'; requires the lz4 or zstandard package),
+#             the fastest codecs, read back by 'read_frame_file'
+# The raw and encoded bytes and the encode and write times are accumulated for the compression report ('stats', 'report').
+#
+# Input:    - codec: one of the FRAME_CODECS
+#           - level: (optional) compression level (PNG, LZ4, Zstandard)
+
+class FrameFileStorage(object):
+
+    TIFF_COMPRESSION = {'tiff': 1, 'tiff_lzw': 5, 'tiff_deflate': 8}                                    # libtiff compression tags
+
+
+    def __init__(self, codec='tiff', level=None):
+
+        if codec not in FRAME_CODECS: raise ValueError('Unknown frame codec: '+str(codec)+', expected one of '+str(tuple(FRAME_CODECS)))
+        if codec == 'lz4' and lz4 is None: raise ImportError('lz4 is required for the lz4 frame codec')
+        if codec == 'zstd' and zstandard is None: raise ImportError('zstandard is required for the zstd frame codec')
+
+        self.codec = codec
+        self.level = level
+        self.extension = FRAME_CODECS[codec]
+        self.params = []
+        if codec in FrameFileStorage.TIFF_COMPRESSION: self.params = [cv2.IMWRITE_TIFF_COMPRESSION, FrameFileStorage.TIFF_COMPRESSION[codec]]
+        if codec == 'png': self.params = [cv2.IMWRITE_PNG_COMPRESSION, 1 if level is None else int(level)]
+        self.local = threading.local()                                                                  # One compressor for each writer thread
+        self.lock = threading.Lock()
+        self.counters = {'frames': 0, 'raw_bytes': 0, 'encoded_bytes': 0, 'encode_time': 0.0, 'write_time': 0.0}
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __call__(self, path, frame, metadata=None):
+
+        path = os.path.splitext(path)[0]+self.extension
+
+        t_start = time.perf_counter()
+        if self.codec in ('lz4', 'zstd'): chunks = self._compress(frame)
+        else:
+            ok, encoded = cv2.imencode(self.extension, frame, self.params)
+            if not ok: return False
+            chunks = [encoded]
+        t_encode = time.perf_counter()
+
+        try:
+            with open(path, 'wb') as frame_file:
+                for chunk in chunks: frame_file.write(chunk)
+        except OSError: return False
+        t_write = time.perf_counter()
+
+        with self.lock:
+            self.counters['frames'] += 1
+            self.counters['raw_bytes'] += frame.nbytes
+            self.counters['encoded_bytes'] += sum(len(chunk) for chunk in chunks)
+            self.counters['encode_time'] += t_encode - t_start
+            self.counters['write_time'] += t_write - t_encode
+
+        return True
+
+
+    def _compress(self, frame):                                                                         # Returns the compressed .npy header and frame data
+
+        frame = np.ascontiguousarray(frame)                                                             # No copy for the ring buffer slots
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(frame))
+
+        if self.codec == 'zstd':
+            if not hasattr(self.local, 'compressor'):
+                self.local.compressor = zstandard.ZstdCompressor(level=3 if self.level is None else int(self.level))
+            compressor = self.local.compressor.compressobj()
+            return [compressor.compress(header.getvalue()), compressor.compress(memoryview(frame).cast('B')), compressor.flush()]
+
+        compressor = lz4.frame.LZ4FrameCompressor(compression_level=0 if self.level is None else int(self.level))
+        return [compressor.begin(), compressor.compress(header.getvalue()), compressor.compress(memoryview(frame).cast('B')), compressor.flush()]
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def stats(self):                                                                                    # Returns the counters, the compression ratio and the encode time per frame [ms]
+
+        with self.lock: stats = dict(self.counters)
+        stats['ratio'] = stats['raw_bytes']/stats['encoded_bytes'] if stats['encoded_bytes'] > 0 else 0.0
+        stats['encode_ms'] = 1000*stats['encode_time']/max(stats['frames'], 1)
+        stats['write_ms'] = 1000*stats['write_time']/max(stats['frames'], 1)
+
+        return stats
+
+
+    def report(self, log_file=None):
+
+        stats = self.stats()
+        if stats['frames'] == 0: return
+        summary = '{}: ratio {:.2f}, encode {:.2f} ms/frame, write {:.2f} ms/frame, {:.1f} MB written'.format(self.codec, stats['ratio'], stats['encode_ms'],
+                                                                                                                stats['write_ms'], stats['encoded_bytes']/1e6)
+        print(colored('Frame compression:\t\t\t\t', 'green'), summary)
+        try: log_file.write('\nFrame compression:\t\t\t\t\t\t'+summary)
+        except: pass
+
+
+    def close(self):
+
+        pass
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Frame file reader method:
+# read a single frame file, whatever its codec (image files with cv2.imread, LZ4/Zstandard files written by FrameFileStorage)
+#
+# Input:    - path: frame file
+#
+# Return:   - frame: the frame (None if it can not be read)
+
+def read_frame_file(path):
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in ('.lz4', '.zst'): return cv2.imread(path, cv2.IMREAD_UNCHANGED)
+
+    if extension == '.lz4' and lz4 is None: raise ImportError('lz4 is required to read '+path)
+    if extension == '.zst' and zstandard is None: raise ImportError('zstandard is required to read '+path)
+    with open(path, 'rb') as frame_file: data = frame_file.read()
+    if extension == '.lz4': data = lz4.frame.decompress(data)
+    else: data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    return np.load(io.BytesIO(data))
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Chunked storage class:
+# appends the frames to a chunked container in the 'save_path' folder ('frames.h5' for the HDF5 format, 'chunk_NNNNNN.npz' files plus 'metadata.csv' for
+# the npz format). All the frames of a run must have the same shape. Thread-safe: it can be shared by all the writer threads of the pipeline.
+# 'chunk_size' is both the number of frames written at a time and the number of frames of each HDF5 chunk (compressed as a whole, with a much lower
+# overhead than one chunk per frame; the frames are read back one chunk at a time by 'iter_stored_frames').
+#
+# Input:    - save_path: output folder
+#           - storage_format: 'hdf5' or 'npz'
+#           - chunk_size: number of frames per chunk
+#           - compression: (optional) compression of the chunks (HDF5: 'gzip' or 'lzf'; npz: any value enables the zip deflate compression)
+#           - compression_level: gzip compression level (HDF5 only)
+#           - flush_interval: maximum time between two flushes of the container [s]
+
+class ChunkedStorage(object):
+
+    def __init__(self, save_path, storage_format='hdf5', chunk_size=64, compression='gzip', compression_level=1, flush_interval=5.0):
+
+        if storage_format not in ('hdf5', 'npz'): raise ValueError('Unknown chunked storage format: '+str(storage_format))
+        if storage_format == 'hdf5' and h5py is None: raise ImportError('h5py is required by the hdf5 storage format')
+
+        self.save_path = save_path
+        self.storage_format = storage_format
+        self.chunk_size = max(int(chunk_size), 1)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.chunk = None                                                                               # In-memory chunk of frames
+        self.chunk_metadata = np.zeros(self.chunk_size, dtype=METADATA_DTYPE)
+        self.n_chunk = 0                                                                                # Frames in the current chunk
+        self.n_frames = 0                                                                               # Frames written to the container
+        self.n_chunks = 0
+        self.last_flush = time.perf_counter()
+        self.h5file = None
+        self.csv_file = None
+
+        if not os.path.isdir(save_path): os.makedirs(save_path)
+        if storage_format == 'hdf5': self.h5file = h5py.File(os.path.join(save_path, 'frames.h5'), 'a')
+        else:
+            self.csv_file = open(os.path.join(save_path, 'metadata.csv'), 'a')
+            if self.csv_file.tell() == 0: self.csv_file.write('chunk,position,index,timestamp,variance,exposure,name\n')
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __call__(self, path, frame, metadata=None):
+
+        if metadata is None: metadata = {}
+
+        with self.lock:
+            if self.chunk is None: self.chunk = np.empty((self.chunk_size,)+frame.shape, dtype=frame.dtype)
+            elif self.chunk.shape[1:] != frame.shape: return False                                       # Frame shape changed during the run
+
+            self.chunk[self.n_chunk] = frame                                                            # Single copy into the chunk
+            self.chunk_metadata[self.n_chunk] = (metadata.get('index', self.n_frames + self.n_chunk), metadata.get('timestamp', time.time()),
+                                                 metadata.get('variance', np.nan), metadata.get('exposure', np.nan),
+                                                 os.path.basename(path).encode('ascii', 'replace')[:32])
+            self.n_chunk += 1
+
+            if self.n_chunk == self.chunk_size: self._write_chunk()
+            if time.perf_counter() - self.last_flush > self.flush_interval: self._flush()
+
+        return True
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def close(self):
+
+        with self.lock:
+            if self.n_chunk > 0: self._write_chunk()
+            if self.h5file is not None:
+                self.h5file.close()
+                self.h5file = None
+            if self.csv_file is not None:
+                self.csv_file.close()
+                self.csv_file = None
+
+        print(colored('Chunked storage:\t\t\t\t', 'green'), str(self.n_frames)+' frames in '+str(self.n_chunks)+' chunks ('+self.storage_format+')')
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _write_chunk(self):
+
+        frames, metadata = self.chunk[:self.n_chunk], self.chunk_metadata[:self.n_chunk]
+
+        if self.storage_format == 'hdf5':
+            if 'frames' not in self.h5file:
+                options = {'compression': self.compression, 'compression_opts': self.compression_level} if self.compression == 'gzip' else {'compression': self.compression}
+                self.h5file.create_dataset('frames', shape=(0,)+self.chunk.shape[1:], maxshape=(None,)+self.chunk.shape[1:],
+                                           chunks=(self.chunk_size,)+self.chunk.shape[1:], dtype=self.chunk.dtype, **options)
+                self.h5file.create_dataset('metadata', shape=(0,), maxshape=(None,), dtype=METADATA_DTYPE, chunks=(1024,))
+            dataset, table = self.h5file['frames'], self.h5file['metadata']
+            n = dataset.shape[0]
+            dataset.resize(n + self.n_chunk, axis=0)
+            dataset[n:n + self.n_chunk] = frames
+            table.resize(n + self.n_chunk, axis=0)
+            table[n:n + self.n_chunk] = metadata
+        else:
+            name = os.path.join(self.save_path, 'chunk_'+str(self.n_chunks).zfill(6)+'.npz')
+            if self.compression: np.savez_compressed(name, frames=frames, metadata=metadata)
+            else: np.savez(name, frames=frames, metadata=metadata)
+            for position, row in enumerate(metadata):
+                self.csv_file.write(','.join([str(self.n_chunks), str(position), str(row['index']), repr(float(row['timestamp'])), repr(float(row['variance'])),
+                                              repr(float(row['exposure'])), row['name'].decode('ascii')])+'\n')
+
+        self.n_frames += self.n_chunk
+        self.n_chunks += 1
+        self.n_chunk = 0
+
+
+    def _flush(self):
+
+        if self.h5file is not None: self.h5file.flush()
+        if self.csv_file is not None: self.csv_file.flush()
+        self.last_flush = time.perf_counter()
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Raw frame log class:
+# append-only store of fixed-size frames for high-rate bursts: 'frames.raw' is a preallocated, memory-mapped file of 'capacity' frames (grown by the same
+# amount when full), so that storing a frame costs one memcpy and no encoding. Each frame has a record in the small 'frames.idx' file (metadata plus the byte
+# offset of the frame in 'frames.raw'), while 'frames.json' describes the frame shape and dtype (written as soon as 'frames.raw' is mapped) and, at closing,
+# the number of frames. At closing, 'frames.raw' is truncated to the frames actually written. 'frames.idx' is flushed at least every 'flush_interval'
+# seconds, so that a log that was not closed (eg: power loss) can still be read up to the last flushed record. The log can be read back as zero-copy NumPy
+# views with 'open_raw_log' and converted with 'convert_raw_log'.
+#
+# Input:    - save_path: output folder
+#           - frame_shape: (optional) (height, width, bytes_per_pixel) of the frames (eg: from IdsCamera.size and bytes_per_pixel); if None, taken from the first frame
+#           - dtype: frame data type
+#           - capacity: number of preallocated frames (and growth step)
+#           - flush_interval: maximum time between two flushes of the index file [s]
+
+class RawFrameLog(object):
+
+    def __init__(self, save_path, frame_shape=None, dtype=np.uint8, capacity=1024, flush_interval=1.0):
+
+        self.save_path = save_path
+        self.frame_shape = tuple(frame_shape) if frame_shape is not None else None
+        self.dtype = np.dtype(dtype)
+        self.capacity = max(int(capacity), 1)
+        self.growth = self.capacity
+        self.lock = threading.Lock()
+        self.frames = None                                                                              # Memory-mapped frames
+        self.n_frames = 0
+        self.record = np.zeros(1, dtype=RAW_INDEX_DTYPE)
+        self.flush_interval = flush_interval
+        self.last_flush = time.perf_counter()
+
+        if not os.path.isdir(save_path): os.makedirs(save_path)
+        self.raw_path = os.path.join(save_path, 'frames.raw')
+        self.index_file = open(os.path.join(save_path, 'frames.idx'), 'wb')
+        if self.frame_shape is not None: self._map(self.capacity)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __call__(self, path, frame, metadata=None):
+
+        if metadata is None: metadata = {}
+
+        with self.lock:
+            if self.frames is None:
+                self.frame_shape, self.dtype = frame.shape, frame.dtype
+                self._map(self.capacity)
+            if frame.shape != self.frame_shape or frame.dtype != self.dtype: return False
+            if self.n_frames == self.capacity: self._map(self.capacity + self.growth)                   # Grow the preallocated file
+
+            self.frames[self.n_frames] = frame                                                          # One memcpy into the mapped file
+            self.record[0] = (metadata.get('index', self.n_frames), metadata.get('timestamp', time.time()), metadata.get('variance', np.nan),
+                              metadata.get('exposure', np.nan), os.path.basename(path).encode('ascii', 'replace')[:32],
+                              self.n_frames*self.dtype.itemsize*int(np.prod(self.frame_shape)))
+            self.index_file.write(self.record.tobytes())
+            self.n_frames += 1
+            if time.perf_counter() - self.last_flush > self.flush_interval:                             # Index readable after a crash
+                self.index_file.flush()
+                self.last_flush = time.perf_counter()
+
+        return True
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def close(self):
+
+        with self.lock:
+            if self.index_file is None: return
+            self.index_file.close()
+            self.index_file = None
+            if self.frames is not None:
+                self.frames.flush()
+                self.frames = None
+                with open(self.raw_path, 'r+b') as raw_file:                                            # Drop the preallocated frames not used
+                    raw_file.truncate(self.n_frames*self.dtype.itemsize*int(np.prod(self.frame_shape)))
+            self._header(self.n_frames)
+
+        print(colored('Raw frame log:\t\t\t\t\t', 'green'), str(self.n_frames)+' frames in '+self.raw_path)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _map(self, capacity):
+
+        if self.frames is not None: self.frames.flush()
+        frame_bytes = self.dtype.itemsize*int(np.prod(self.frame_shape))
+        with open(self.raw_path, 'ab') as raw_file:                                                     # Preallocate the file
+            raw_file.truncate(capacity*frame_bytes)
+            try: os.posix_fallocate(raw_file.fileno(), 0, capacity*frame_bytes)
+            except (AttributeError, OSError): pass
+        self.frames = np.memmap(self.raw_path, dtype=self.dtype, mode='r+', shape=(capacity,)+tuple(self.frame_shape))
+        if self.n_frames == 0: self._header()                                                           # Shape and dtype known: log readable even if not closed
+        self.capacity = capacity
+
+
+    def _header(self, count=None):                                                                      # Writes 'frames.json' (count: None until the log is closed)
+
+        header_path = os.path.join(self.save_path, 'frames.json')
+        with open(header_path+'.tmp', 'w') as header:
+            json.dump({'shape': list(self.frame_shape) if self.frame_shape is not None else None, 'dtype': self.dtype.str, 'count': count}, header)
+        os.replace(header_path+'.tmp', header_path)                                                     # Never a partial header
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Raw frame log reader method:
+# open a raw frame log without copying it in memory; for a log that was not closed (no frame count in 'frames.json'), the frames are the ones with a
+# complete record in 'frames.idx'
+#
+# Input:    - save_path: folder of the raw frame log
+#
+# Return:   - frames: read-only memory-mapped array (count, height, width, channels)
+#           - index: array of the per-frame records (RAW_INDEX_DTYPE)
+
+def open_raw_log(save_path):
+
+    header_path = os.path.join(save_path, 'frames.json')
+    if not os.path.isfile(header_path): raise IOError('Missing '+header_path+': no frame was written in the raw frame log')
+    with open(header_path) as header: header = json.load(header)
+    shape, dtype = tuple(header['shape'] or ()), np.dtype(header['dtype'])
+
+    index = np.fromfile(os.path.join(save_path, 'frames.idx'), dtype=np.uint8)                          # Last record possibly incomplete (log not closed)
+    index = index[:len(index) - len(index)%RAW_INDEX_DTYPE.itemsize].view(RAW_INDEX_DTYPE)
+    count = len(index) if header.get('count') is None else min(header['count'], len(index))             # Log not closed: frames with a record
+    raw_path = os.path.join(save_path, 'frames.raw')
+    if len(shape) > 0: count = min(count, os.path.getsize(raw_path)//(dtype.itemsize*int(np.prod(shape))))
+    if count == 0: return np.empty((0,)+shape, dtype=dtype), index[:0]
+
+    frames = np.memmap(raw_path, dtype=dtype, mode='r', shape=(count,)+shape)
+
+    return frames, index[:count]
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Raw frame log converter method:
+# convert a raw frame log to single image files or to a chunked container
+#
+# Input:    - save_path: folder of the raw frame log
+#           - output_format: 'tiff' (or any image extension supported by cv2.imwrite, eg: 'png'), 'hdf5' or 'npz'
+#           - output_path: output folder
+#           - **kwargs: options of the chunked formats (chunk_size, compression, compression_level, flush_interval)
+#
+# Return:   - n_frames: number of converted frames
+
+def convert_raw_log(save_path, output_format, output_path, **kwargs):
+
+    frames, index = open_raw_log(save_path)
+    if not os.path.isdir(output_path): os.makedirs(output_path)
+
+    if output_format in ('hdf5', 'npz'): storage = ChunkedStorage(output_path, output_format, **kwargs)
+    else: storage = TiffStorage()
+    extension = 'tif' if output_format == 'tiff' else output_format
+
+    for frame, record in zip(frames, index):
+        name = record['name'].decode('ascii') or 'image_'+str(record['index']).zfill(7)+'.tif'
+        metadata = {'index': int(record['index']), 'timestamp': float(record['timestamp']), 'variance': float(record['variance']),
+                    'exposure': float(record['exposure'])}
+        storage(os.path.join(output_path, os.path.splitext(name)[0]+'.'+extension), frame, metadata)
+    storage.close()
+
+    return len(frames)
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Storage factory method:
+# create the writer function of the selected storage format
+#
+# Input:    - storage_format: 'tiff', 'hdf5', 'npz' or 'raw'
+#           - save_path: output folder
+#           - **kwargs: options of the single files (codec, codec_level), of the chunked formats (chunk_size, compression, compression_level, flush_interval)
+#                       or of the raw log (frame_shape, dtype, capacity, flush_interval); the options of the other formats are ignored
+#
+# Return:   - storage: the storage object
+
+def open_storage(storage_format, save_path, **kwargs):
+
+    options = lambda *keys: {key: kwargs[key] for key in keys if key in kwargs}                         # Options of the selected format only
+
+    if storage_format == 'tiff': return FrameFileStorage(kwargs.get('codec', 'tiff'), kwargs.get('codec_level'))
+    if storage_format in ('hdf5', 'npz'):
+        return ChunkedStorage(save_path, storage_format, **options('chunk_size', 'compression', 'compression_level', 'flush_interval'))
+    if storage_format == 'raw': return RawFrameLog(save_path, **options('frame_shape', 'dtype', 'capacity', 'flush_interval'))
+
+    raise ValueError('Unknown storage format: '+str(storage_format)+', expected one of '+str(STORAGE_FORMATS))
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Stored frames reader method:
+# iterate over the frames of a data folder, whatever its storage format ('frames.h5', 'chunk_NNNNNN.npz' files, 'frames.raw' log or single image files)
+#
+# Input:    - save_path: data folder
+#           - image_extension: image format of the single image files
+#           - unit: (optional) work unit returned by 'stored_frame_units'; if None, all the frames are read
+#
+# Return:   - generator of (name, frame, metadata) tuples (metadata is None for single image files)
+
+def iter_stored_frames(save_path, image_extension='tif', unit=None):
+
+    h5_path = os.path.join(save_path, 'frames.h5')
+    if os.path.isfile(h5_path):
+        if h5py is None: raise ImportError('h5py is required to read '+h5_path)
+        with h5py.File(h5_path, 'r') as h5file:
+            frames, table = h5file['frames'], h5file['metadata']
+            start, stop = (unit[1], unit[2]) if unit is not None else (0, frames.shape[0])
+            step = frames.chunks[0] if frames.chunks is not None else 1
+            while start < stop:                                                                         # One HDF5 chunk decompressed at a time
+                block_stop = min(stop, (start//step + 1)*step)
+                for frame, metadata in zip(frames[start:block_stop], table[start:block_stop]): yield metadata['name'].decode('ascii'), frame, metadata
+                start = block_stop
+        return
+
+    if os.path.isfile(os.path.join(save_path, 'frames.raw')):
+        frames, index = open_raw_log(save_path)
+        start, stop = (unit[1], unit[2]) if unit is not None else (0, len(frames))
+        for frame, record in zip(frames[start:stop], index[start:stop]): yield record['name'].decode('ascii'), frame, record
+        return
+
+    chunk_names = sorted(name for name in os.listdir(save_path) if name.startswith('chunk_') and name.endswith('.npz'))
+    if len(chunk_names) > 0:
+        if unit is not None: chunk_names = [unit[1]]
+        for chunk_name in chunk_names:
+            with np.load(os.path.join(save_path, chunk_name)) as chunk:
+                frames, table = chunk['frames'], chunk['metadata']
+            for frame, metadata in zip(frames, table): yield metadata['name'].decode('ascii'), frame, metadata
+        return
+
+    names = unit[1] if unit is not None else sorted(name for name in os.listdir(save_path) if name.lower().endswith('.'+image_extension.lower()))
+    for name in names: yield name, read_frame_file(os.path.join(save_path, name)), None
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Stored frames partition method:
+# split the frames of a data folder in independent work units, which can be read in parallel by different processes with 'iter_stored_frames' (each
+# process opens the container by itself, so that no frame has to be sent between processes): ranges of 'batch_size' frames for the HDF5 container and
+# the raw log, one unit per chunk for the npz chunks, lists of 'batch_size' file names for the single image files
+#
+# Input:    - save_path: data folder
+#           - image_extension: image format of the single image files
+#           - batch_size: number of frames of each unit
+#
+# Return:   - units: list of ('range', start, stop), ('chunk', chunk_name) or ('files', names) tuples
+
+def stored_frame_units(save_path, image_extension='tif', batch_size=64):
+
+    batch_size = max(int(batch_size), 1)
+
+    h5_path = os.path.join(save_path, 'frames.h5')
+    if os.path.isfile(h5_path):
+        if h5py is None: raise ImportError('h5py is required to read '+h5_path)
+        with h5py.File(h5_path, 'r') as h5file: n_frames = h5file['frames'].shape[0]
+        return [('range', start, min(start + batch_size, n_frames)) for start in range(0, n_frames, batch_size)]
+
+    if os.path.isfile(os.path.join(save_path, 'frames.raw')):
+        n_frames = len(open_raw_log(save_path)[0])
+        return [('range', start, min(start + batch_size, n_frames)) for start in range(0, n_frames, batch_size)]
+
+    chunk_names = sorted(name for name in os.listdir(save_path) if name.startswith('chunk_') and name.endswith('.npz'))
+    if len(chunk_names) > 0: return [('chunk', chunk_name) for chunk_name in chunk_names]
+
+    names = sorted(name for name in os.listdir(save_path) if name.lower().endswith('.'+image_extension.lower()))
+    return [('files', tuple(names[start:start + batch_size])) for start in range(0, len(names), batch_size)]
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
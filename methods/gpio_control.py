@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import threading, time                                                                                  # Import required libraries
+from camera_backends import GPIO
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# GPIO controller class:
+# control subsystem replacing the busy-wait polling of the RaspController pins in the acquisition loops. The RUN/ACQUIRE/STOP/EXIT pin states are kept
+# in memory and updated by a single state-machine thread reading all the pins every 'poll_interval' seconds. Edge-detection callbacks
+# (GPIO.add_event_detect) are not used: the pins are configured as outputs, set by the acquisition itself and toggled by RaspController, and RPi.GPIO
+# rejects edge detection on output pins. The acquisition loop reads the cached states through 'input' (a dictionary lookup, no GPIO access) and waits for
+# a pin change with 'wait_for'/'wait_change' instead of spinning on GPIO.input. Other components can subscribe to the (pin, value) events.
+#
+# Input:    - pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT: RPi pin numbers
+#           - mode: 'poll' (state-machine thread; the only mode available)
+#           - poll_interval: time between two consecutive readings of the pins [s]
+
+class GpioController(object):
+
+    def __init__(self, pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT, mode='poll', poll_interval=0.05):
+
+        if mode != 'poll': raise ValueError('Unknown GPIO control mode: '+str(mode)+", expected 'poll' (no edge detection on the output pins)")
+
+        self.pins = {'RUN': pin_RUN, 'ACQUIRE': pin_ACQUIRE, 'STOP': pin_STOP, 'EXIT': pin_EXIT}
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.state = {}                                                                                 # Cached pin states {pin: value}
+        self.condition = threading.Condition()
+        self.subscribers = []
+        self.thread = None
+        self.running = False
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def start(self):
+
+        if self.running: return
+        self.running = True
+        for pin in self.pins.values(): self.state[pin] = GPIO.input(pin)
+
+        self.thread = threading.Thread(target=self._poll_loop, name='gpio_controller', daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+
+        if not self.running: return
+        self.running = False
+        self.thread.join()
+        with self.condition: self.condition.notify_all()
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def input(self, pin):                                                                               # Cached state of the pin (same semantics as GPIO.input)
+
+        return self.state.get(pin, 0)
+
+
+    def output(self, pin, value):                                                                       # Set the pin and publish the new state immediately
+
+        GPIO.output(pin, value)
+        self._publish(pin, int(value))
+
+
+    def subscribe(self, callback):                                                                      # callback(pin, value) is called at every pin change
+
+        self.subscribers.append(callback)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def wait_for(self, pin, value, timeout=None):                                                       # Block (without spinning) until the pin reaches the value or EXIT is set
+
+        pin_EXIT = self.pins['EXIT']
+        with self.condition:
+            return self.condition.wait_for(lambda: self.state.get(pin, 0) == value or self.state.get(pin_EXIT, 0) == 1 or not self.running,
+                                           timeout)
+
+
+    def wait_change(self, timeout=None):                                                                # Block until any pin changes (or timeout)
+
+        with self.condition: return self.condition.wait(timeout)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _publish(self, pin, value):
+
+        with self.condition:
+            if self.state.get(pin) == value: return
+            self.state[pin] = value
+            self.condition.notify_all()
+        for callback in self.subscribers: callback(pin, value)
+
+
+    def _poll_loop(self):
+
+        while self.running:
+            for pin in self.pins.values(): self._publish(pin, GPIO.input(pin))
+            time.sleep(self.poll_interval)
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+from frame_storage import TiffStorage
+import numpy as np, os, threading
+try: import pyfftw                                                                                      # Optional: FFTW plans (fastest on the Raspberry Pi CPU)
+except ImportError: pyfftw = None
+try: import scipy.fft as fft_backend                                                                    # Fallback: multithreaded scipy FFT
+except ImportError: import numpy.fft as fft_backend
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Angular spectrum reconstruction class:
+# real-time holographic reconstruction of the acquired frames. Each hologram is divided by the background (per-pixel background image or, if not available,
+# the frame mean) and propagated to one or more z-planes with the angular spectrum method:
+#
+#           E(z) = IFFT{ FFT{I/I_bkg} * H(z) },    H(z) = exp(i 2pi z sqrt((n/wavelength)^2 - fx^2 - fy^2))   (evanescent waves removed)
+#
+# The transfer functions are computed once and cached per (shape, z, wavelength, n); the FFTs are planned once per frame shape with FFTW (pyfftw, listed in
+# setup/requirements.txt) and all the intermediate arrays are preallocated and reused. Buffers and plans are kept per thread, so that the reconstruction can
+# run in the writer threads of the AcquisitionPipeline without ever blocking the capture loop. Without pyfftw, scipy.fft (or numpy.fft) is used as a
+# fallback: the results are the same, but each FFT allocates a new complex array.
+#
+# Input:    - pixel_size: camera pixel size [um]
+#           - wavelength: laser wavelength [um]
+#           - medium_index: medium refractive index at the selected wavelength
+#           - z_planes: list of propagation distances [um]
+#           - background: (optional) per-pixel background image
+#           - n_threads: number of threads used by each FFT
+
+class AngularSpectrumReconstructor(object):
+
+    def __init__(self, pixel_size, wavelength, medium_index, z_planes, background=None, n_threads=1):
+
+        self.pixel_size = float(pixel_size)
+        self.wavelength = float(wavelength)
+        self.medium_index = float(medium_index)
+        self.z_planes = [float(z) for z in np.atleast_1d(z_planes)]
+        self.n_threads = max(int(n_threads), 1)
+        self.transfer_functions = {}                                                                    # Cache {(shape, z, wavelength, n): H}
+        self.cache_lock = threading.Lock()
+        self.local = threading.local()                                                                  # Per-thread buffers and FFT plans
+        self.background = None
+        self.set_background(background)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def set_background(self, background):                                                              # Per-pixel background image (None = normalization by the frame mean)
+
+        if background is None: self.background = None
+        else:
+            background = np.asarray(background, dtype=np.float32)
+            if background.ndim == 3: background = background[:, :, 0]
+            self.background = np.maximum(background, 1.0)                                               # Avoid divisions by zero on dead pixels
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def transfer_function(self, shape, z):
+
+        key = (shape, z, self.wavelength, self.medium_index)
+        with self.cache_lock:
+            if key in self.transfer_functions: return self.transfer_functions[key]
+
+        fy = np.fft.fftfreq(shape[0], d=self.pixel_size)[:, np.newaxis]                                 # Spatial frequencies [1/um]
+        fx = np.fft.fftfreq(shape[1], d=self.pixel_size)[np.newaxis, :]
+        arg = (self.medium_index/self.wavelength)**2 - fx**2 - fy**2
+        H = np.exp(2j*np.pi*z*np.sqrt(np.maximum(arg, 0.0)))
+        H[arg < 0] = 0                                                                                  # Evanescent waves
+        H = H.astype(np.complex64)
+
+        with self.cache_lock: self.transfer_functions[key] = H
+
+        return H
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _buffers(self, shape):                                                                          # Returns the (preallocated) buffers and FFT plans of the calling thread
+
+        buffers = getattr(self.local, 'buffers', None)
+        if buffers is not None and buffers['shape'] == shape: return buffers
+
+        buffers = {'shape': shape,
+                   'contrast': np.empty(shape, dtype=np.float32),
+                   'output': np.empty((len(self.z_planes),)+shape, dtype=np.float32)}
+        if pyfftw is not None:
+            buffers['field'] = pyfftw.empty_aligned(shape, dtype=np.complex64)
+            buffers['spectrum'] = pyfftw.empty_aligned(shape, dtype=np.complex64)
+            buffers['propagated'] = pyfftw.empty_aligned(shape, dtype=np.complex64)
+            buffers['fft'] = pyfftw.FFTW(buffers['field'], buffers['spectrum'], axes=(0, 1), direction='FFTW_FORWARD',
+                                         threads=self.n_threads, flags=('FFTW_MEASURE',))
+            buffers['ifft'] = pyfftw.FFTW(buffers['propagated'], buffers['field'], axes=(0, 1), direction='FFTW_BACKWARD',
+                                          threads=self.n_threads, flags=('FFTW_MEASURE',))
+        else:
+            buffers['field'] = np.empty(shape, dtype=np.complex64)
+            buffers['propagated'] = np.empty(shape, dtype=np.complex64)
+        self.local.buffers = buffers
+
+        return buffers
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __call__(self, frame):                                                                          # Returns the (n_planes, height, width) stack of reconstructed amplitudes
+                                                                                                        # (the array is reused by the next call of the same thread)
+        if frame.ndim == 3: frame = frame[:, :, 0]
+        shape = frame.shape
+        buffers = self._buffers(shape)
+
+        if self.background is not None and self.background.shape == shape:                             # Background-divided hologram
+            np.divide(frame, self.background, out=buffers['contrast'], casting='unsafe')
+        else:
+            np.multiply(frame, 1.0/max(float(frame.mean()), 1.0), out=buffers['contrast'], casting='unsafe')
+        buffers['field'][...] = buffers['contrast']
+
+        if pyfftw is not None:
+            buffers['fft']()
+            spectrum = buffers['spectrum']
+        else:
+            spectrum = fft_backend.fft2(buffers['field'], workers=self.n_threads) if fft_backend.__name__ == 'scipy.fft' else fft_backend.fft2(buffers['field'])
+
+        for i, z in enumerate(self.z_planes):
+            np.multiply(spectrum, self.transfer_function(shape, z), out=buffers['propagated'])
+            if pyfftw is not None:
+                buffers['ifft']()
+                field = buffers['field']
+            elif fft_backend.__name__ == 'scipy.fft':
+                field = fft_backend.ifft2(buffers['propagated'], workers=self.n_threads, overwrite_x=True)
+            else:
+                field = fft_backend.ifft2(buffers['propagated'])
+            np.abs(field, out=buffers['output'][i])
+
+        return buffers['output']
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Reconstruction writer class:
+# writer function for the AcquisitionPipeline: the frame is saved with the given writer and then reconstructed; the stack of reconstructed amplitudes
+# (one plane per z) is saved as .npy file with the same name of the frame in the reconstruction folder. Frames that were not saved (eg: storage full) are
+# not reconstructed. The reconstruction runs in the writer threads, off the capture path. A float32 stack takes 4 x n_planes the bytes of an 8 bit frame:
+# the stacks can be cropped to the region of interest and saved with a smaller data type (float16, or an integer type after multiplication by 'scale'),
+# and their number and total size are reported at the end of the run.
+#
+# Input:    - reconstructor: AngularSpectrumReconstructor object
+#           - output_path: folder of the reconstructed stacks, or function returning it (eg: the folder on the active storage device of a StorageManager)
+#           - writer: (optional) function writer(path, frame, metadata) saving the raw frame (default: TiffStorage, ie: cv2.imwrite)
+#           - dtype: data type of the saved stacks (eg: 'float32', 'float16', 'uint8')
+#           - crop: (optional) region of the stacks saved (y_start, y_stop, x_start, x_stop) (None = whole frame)
+#           - scale: multiplier of the amplitudes before the conversion to an integer data type
+
+class ReconstructionWriter(object):
+
+    def __init__(self, reconstructor, output_path, writer=None, dtype='float32', crop=None, scale=1.0):
+
+        self.reconstructor = reconstructor
+        self.output_path = output_path
+        self.writer = writer if writer is not None else TiffStorage()
+        self.dtype = np.dtype(dtype)
+        self.crop = tuple(crop) if crop is not None else None
+        self.scale = float(scale)
+        self.lock = threading.Lock()
+        self.n_stacks, self.n_bytes = 0, 0                                                              # Saved stacks and their size
+        if not callable(output_path) and not os.path.isdir(output_path): os.makedirs(output_path)
+
+        print(colored('Real-time reconstruction planes:\t\t', 'green'), ', '.join('{:.1f}'.format(z) for z in reconstructor.z_planes), ' um')
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __call__(self, path, frame, metadata=None):
+
+        save_status = self.writer(path, frame, metadata)
+        if not save_status: return save_status                                                          # Frame not saved: no reconstruction
+
+        output_path = self.output_path() if callable(self.output_path) else self.output_path
+        stack = self.reconstructor(frame)
+        if self.crop is not None: stack = stack[:, self.crop[0]:self.crop[1], self.crop[2]:self.crop[3]]
+        if self.dtype.kind in 'iu':                                                                     # Integer stacks: scaled and clipped amplitudes
+            info = np.iinfo(self.dtype)
+            stack = np.clip(stack*self.scale, info.min, info.max).astype(self.dtype)
+        elif stack.dtype != self.dtype: stack = stack.astype(self.dtype)
+        np.save(os.path.join(output_path, os.path.splitext(os.path.basename(path))[0]+'.npy'), stack)
+
+        with self.lock:
+            self.n_stacks += 1
+            self.n_bytes += stack.nbytes
+
+        return save_status
+
+
+    def close(self):
+
+        if hasattr(self.writer, 'close'): self.writer.close()
+
+
+    def report(self, log_file=None):                                                                    # Compression and storage summaries of the wrapped writer
+
+        if hasattr(self.writer, 'report'): self.writer.report(log_file)
+
+        summary = (str(self.n_stacks)+' stacks, '+'{:.1f}'.format(self.n_bytes/1e6)+' MB ('+self.dtype.name+
+                   (', crop '+str(self.crop) if self.crop is not None else '')+')')
+        print(colored('Reconstructed stacks:\t\t\t\t', 'green'), summary)
+        try: log_file.write('\nReconstructed stacks:\t\t\t\t\t\t'+summary)
+        except: pass
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
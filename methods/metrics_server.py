@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import collections, shutil, threading, time
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Acquisition metrics class:
+# live health metrics of the acquisition, fed by the RunLogger thread (per-frame records, write times of the writer pool and 'image_check' events), so that
+# no work is added to the capture loop. The metrics are rendered in the Prometheus text format by 'render':
+#           - frames grabbed, kept and rejected by the frame selection, post-event frames saved by the pre-trigger ring, and the frame rate over the last
+#             'fps_window' seconds (for each camera)
+#           - writer queue depth of the last frame, and frames written, dropped and failed by the attached acquisition pipelines
+#           - histogram of the frame write latency
+#           - free and total space of the storage device, and free space, write bandwidth and spillovers of the attached storage manager
+#           - minimum, maximum and mean value, saturated and null pixels of the last 'image_check'
+#
+# Input:    - storage_path: path on the storage device (for the free space)
+#           - fps_window: time window of the frame rate [s]
+
+class AcquisitionMetrics(object):
+
+    WRITE_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)               # Write latency histogram buckets [s]
+
+
+    def __init__(self, storage_path='/media/usb/', fps_window=10.0):
+
+        self.storage_path = storage_path
+        self.fps_window = float(fps_window)
+        self.lock = threading.Lock()
+        self.grabbed = collections.defaultdict(int)
+        self.kept = collections.defaultdict(int)
+        self.post_event = collections.defaultdict(int)                                                  # Rejected frames saved as post-event context
+        self.queue_depth = {}
+        self.frame_times = collections.defaultdict(collections.deque)                                   # Frame times in the fps window
+        self.write_buckets = [0]*len(AcquisitionMetrics.WRITE_BUCKETS)
+        self.write_count = 0
+        self.write_sum = 0.0
+        self.image_check = {}
+        self.pipelines = {}
+        self.storage = None
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def attach_pipeline(self, pipeline, camera='camera_0'):                                             # Written, dropped and failed frames read at each scrape
+
+        with self.lock: self.pipelines[camera] = pipeline
+
+
+    def attach_storage(self, storage):                                                                  # StorageManager: state of the storage targets read at each scrape
+
+        with self.lock: self.storage = storage
+
+
+    def observe_frame(self, counters):                                                                  # Per-frame record of the RunLogger
+
+        camera = counters.get('camera', 'camera_0')
+        now = time.time()
+        with self.lock:
+            self.grabbed[camera] += 1
+            if counters.get('kept'): self.kept[camera] += 1
+            if counters.get('post_event'): self.post_event[camera] += 1
+            if 'queue_depth' in counters: self.queue_depth[camera] = counters['queue_depth']
+            times = self.frame_times[camera]
+            times.append(now)
+            while times and times[0] < now - self.fps_window: times.popleft()
+
+
+    def observe_timing(self, name, value):                                                              # Timing of the RunLogger (only the write time is used)
+
+        if name != 'write_ms': return
+        seconds = value/1000.0
+        with self.lock:
+            self.write_count += 1
+            self.write_sum += seconds
+            for i, bound in enumerate(AcquisitionMetrics.WRITE_BUCKETS):
+                if seconds <= bound:
+                    self.write_buckets[i] += 1
+                    break
+
+
+    def observe_event(self, event, fields):                                                             # Event of the RunLogger (only 'image_check' is used)
+
+        if event != 'image_check': return
+        with self.lock: self.image_check = dict(fields)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def render(self):                                                                                   # Returns the metrics in the Prometheus text exposition format
+
+        lines = []
+        def metric(name, kind, text, samples):
+            lines.append('# HELP holocamera_'+name+' '+text)
+            lines.append('# TYPE holocamera_'+name+' '+kind)
+            for labels, value in samples: lines.append('holocamera_'+name+labels+' '+repr(float(value)))
+
+        now = time.time()
+        with self.lock:
+            cameras = sorted(self.grabbed)
+            fps = {}
+            for camera in cameras:
+                times = self.frame_times[camera]
+                while times and times[0] < now - self.fps_window: times.popleft()
+                fps[camera] = (len(times) - 1)/(times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+            grabbed, kept, post_event, queue_depth = dict(self.grabbed), dict(self.kept), dict(self.post_event), dict(self.queue_depth)
+            write_buckets, write_count, write_sum = list(self.write_buckets), self.write_count, self.write_sum
+            image_check, pipelines, storage = dict(self.image_check), dict(self.pipelines), self.storage
+
+        label = lambda camera: '{camera="'+camera+'"}'
+        metric('frames_grabbed_total', 'counter', 'Frames grabbed by the acquisition loop.', [(label(c), grabbed[c]) for c in cameras])
+        metric('frames_kept_total', 'counter', 'Frames kept by the frame selection.', [(label(c), kept.get(c, 0)) for c in cameras])
+        metric('frames_rejected_total', 'counter', 'Frames rejected by the frame selection.', [(label(c), grabbed[c] - kept.get(c, 0)) for c in cameras])
+        metric('frames_post_event_total', 'counter', 'Rejected frames saved after a selected frame (pre-trigger ring).',
+               [(label(c), post_event.get(c, 0)) for c in cameras])
+        metric('fps', 'gauge', 'Acquisition frame rate over the last '+str(self.fps_window)+' s.', [(label(c), fps[c]) for c in cameras])
+        metric('queue_depth', 'gauge', 'Frames waiting for the writer pool.', [(label(c), queue_depth[c]) for c in sorted(queue_depth)])
+
+        stats = {camera: pipeline.stats() for camera, pipeline in pipelines.items()}
+        for key, text in (('written', 'written'), ('dropped', 'dropped by the full frame buffer'), ('failed', 'not written (storage error)'),
+                          ('discarded', 'discarded by the writer (no storage device with enough free space)')):
+            metric('frames_'+key+'_total', 'counter', 'Frames '+text+'.', [(label(c), stats[c].get(key, 0)) for c in sorted(stats)])
+
+        cumulative, samples = 0, []
+        for bound, count in zip(AcquisitionMetrics.WRITE_BUCKETS, write_buckets):
+            cumulative += count
+            samples.append(('_bucket{le="'+repr(bound)+'"}', cumulative))
+        samples += [('_bucket{le="+Inf"}', write_count), ('_sum', write_sum), ('_count', write_count)]
+        lines.append('# HELP holocamera_write_latency_seconds Time to write a frame on the storage device.')
+        lines.append('# TYPE holocamera_write_latency_seconds histogram')
+        for suffix, value in samples: lines.append('holocamera_write_latency_seconds'+suffix+' '+repr(float(value)))
+
+        try:
+            disk = shutil.disk_usage(self.storage_path)
+            metric('disk_free_bytes', 'gauge', 'Free space of the storage device.', [('{path="'+self.storage_path+'"}', disk.free)])
+            metric('disk_total_bytes', 'gauge', 'Size of the storage device.', [('{path="'+self.storage_path+'"}', disk.total)])
+        except OSError: pass                                                                            # Storage device not mounted
+
+        if storage is not None:
+            stats = storage.stats()
+            target = lambda t: '{target="'+t['path']+'"}'
+            metric('storage_free_bytes', 'gauge', 'Free space of each storage target.', [(target(t), t['free']) for t in stats['targets']])
+            metric('storage_bandwidth_bytes', 'gauge', 'Measured write bandwidth of each storage target [bytes/s].',
+                   [(target(t), t['bandwidth']) for t in stats['targets']])
+            metric('storage_active', 'gauge', 'Storage target receiving the frames.', [(target(t), t['path'] == stats['active']) for t in stats['targets']])
+            for key in ('spillovers', 'dropped', 'slow_writes'):
+                metric('storage_'+key+'_total', 'counter', 'Storage manager '+key.replace('_', ' ')+'.', [('', stats[key])])
+
+        for key, text in (('saturated_pixels', 'Saturated pixels'), ('null_pixels', 'Null pixels'), ('min', 'Minimum pixel value'),
+                          ('max', 'Maximum pixel value'), ('mean', 'Mean pixel value')):
+            if key in image_check: metric('image_check_'+key, 'gauge', text+' of the last image check.', [('', image_check[key])])
+
+        return '\n'.join(lines)+'\n'
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Metrics server class:
+# minimal HTTP endpoint (standard library only) serving the acquisition metrics at http://<raspberry>:<port>/metrics, eg: for Prometheus or a plain curl
+# through the RaspAP network. The server runs in its own daemon thread and only reads the metrics, so it never blocks the acquisition.
+#
+# Input:    - metrics: AcquisitionMetrics object
+#           - port: TCP port
+#           - host: listening address ('0.0.0.0' = all the interfaces)
+
+class MetricsServer(object):
+
+    def __init__(self, metrics, port=9100, host='0.0.0.0'):
+
+        self.metrics = metrics
+        self.port = int(port)
+        self.host = host
+        self.server = None
+        self.thread = None
+
+
+    def start(self):
+
+        if self.server is not None: return
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args): pass                                                  # No per-request output on the terminal
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics_server', daemon=True)
+        self.thread.start()
+
+        print(colored('Metrics endpoint:\t\t\t\t', 'green'), 'http://'+self.host+':'+str(self.port)+'/metrics')
+
+
+    def stop(self):
+
+        if self.server is None: return
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.server = None
+        self.thread = None
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
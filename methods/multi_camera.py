@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import os, time, copy, threading, collections
+from datetime import datetime
+from utils import *
+from camera_backends import GPIO, open_camera
+from acquisition_pipeline import AcquisitionPipeline
+from frame_storage import open_storage
+from background_model import BackgroundModel
+from gpio_control import GpioController
+from frame_scheduler import FrameScheduler
+from run_logger import RunLogger
+from metrics_server import AcquisitionMetrics, MetricsServer
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Multi-camera coordinator class:
+# runs one capture thread per camera, each one grabbing, filtering (variance selection against the background of its own camera) and queueing the frames to
+# the AcquisitionPipeline of its camera, so that the cameras are read in parallel and the aggregate throughput is limited by the USB bus and by the storage
+# rather than by a single capture loop. Every grabbed frame (kept or not) is also recorded as (timestamp, index, kept) in a per-camera queue: the coordinator
+# pairs the queue heads whose host timestamps are within 'tolerance' of each other, discards the older frames with no counterpart, and writes one line per
+# frame pair (per-camera frame index, timestamp and kept flag, timestamp skew) in 'pairs.csv'.
+#
+# Input:    - cameras: list of connected camera objects (IdsCamera or SimulatedCamera)
+#           - pipelines: list of started AcquisitionPipeline objects, one for each camera
+#           - save_paths: list of output folders, one for each camera
+#           - bkg_vars: list of background variances, one for each camera
+#           - var_treshold: treshold to evaluate the variance comparison
+#           - names: (optional) list of camera names used in the pairs file header
+#           - tolerance: (optional) maximum timestamp difference of two paired frames [s]; default: half frame period (5 ms if the loops are not paced)
+#           - time_sleep: frame period of the capture loops [s] (0: no pacing)
+#           - exposure_time: exposure time written in the frame metadata
+#           - pairs_path: (optional) path of the frame pairs file
+#           - log_file: (optional) output file
+
+class MultiCameraCoordinator(object):
+
+    def __init__(self, cameras, pipelines, save_paths, bkg_vars, var_treshold, names=None, tolerance=None, time_sleep=0.0, exposure_time=None,
+                 pairs_path=None, log_file=None):
+
+        self.cameras = list(cameras)
+        self.pipelines = list(pipelines)
+        self.save_paths = list(save_paths)
+        self.bkg_vars = list(bkg_vars)
+        self.var_treshold = var_treshold
+        self.names = list(names) if names is not None else ['camera_'+str(k) for k in range(len(self.cameras))]
+        self.tolerance = tolerance if tolerance is not None else (0.5*time_sleep if time_sleep > 0 else 0.005)
+        self.time_sleep = time_sleep
+        self.exposure_time = exposure_time
+        self.log_file = log_file
+        self.metrics = log_file if hasattr(log_file, 'frame') else None                                 # RunLogger: per-frame counters of the capture threads
+
+        n_cameras = len(self.cameras)
+        self.pending = [collections.deque() for k in range(n_cameras)]                                  # Grabbed frames waiting for their counterparts
+        self.lock = threading.Lock()
+        self.threads = []
+        self.schedulers = [FrameScheduler(time_sleep) for k in range(n_cameras)]
+        self.running = False
+        self.grabbed = [0]*n_cameras
+        self.kept = [0]*n_cameras
+        self.failed = [0]*n_cameras
+        self.unpaired = [0]*n_cameras
+        self.n_pairs = 0
+        self.max_skew = 0.0
+        self.t_start = None
+        self.t_stop = None
+
+        self.pairs_file = None
+        if pairs_path is not None:
+            self.pairs_file = open(pairs_path, 'w')
+            self.pairs_file.write('pair,skew_ms,'+','.join(name+'_index,'+name+'_timestamp,'+name+'_kept' for name in self.names)+'\n')
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def start(self):
+
+        if self.running: return
+        self.running = True
+        self.t_start = time.perf_counter()
+        for k in range(len(self.cameras)):
+            thread = threading.Thread(target=self._capture_loop, args=(k,), name='capture_'+self.names[k], daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+
+    def stop(self):
+
+        if not self.running: return
+        self.running = False
+        for thread in self.threads: thread.join()
+        self.threads = []
+        self.t_stop = time.perf_counter()
+        self.pair()                                                                                     # Pair the last frames
+        if self.pairs_file is not None:
+            self.pairs_file.close()
+            self.pairs_file = None
+
+
+    def run(self, control, pin_STOP, pin_EXIT):                                                         # Acquire until pin_STOP is set to LOW or pin_EXIT to HIGH
+
+        self.start()
+        while control.input(pin_STOP)==1 and control.input(pin_EXIT)==0:
+            control.wait_change(0.2)
+            self.pair()
+        self.stop()
+        self.report()
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def pair(self):                                                                                     # Pairs the queued frames by timestamp; returns the number of new pairs
+
+        pairs = []
+        with self.lock:
+            while all(self.pending):
+                heads = [queue[0][0] for queue in self.pending]
+                t_latest = max(heads)
+                late = [k for k, t in enumerate(heads) if t < t_latest - self.tolerance]
+                if late:                                                                                # No counterpart can arrive for the older frames
+                    for k in late:
+                        self.pending[k].popleft()
+                        self.unpaired[k] += 1
+                    continue
+                pairs.append(tuple(queue.popleft() for queue in self.pending))
+
+        for pair in pairs:
+            timestamps = [frame[0] for frame in pair]
+            skew = max(timestamps) - min(timestamps)
+            self.max_skew = max(self.max_skew, skew)
+            if self.pairs_file is not None:
+                self.pairs_file.write(str(self.n_pairs)+','+'{:.3f}'.format(1000*skew)+','+
+                                      ','.join(str(index)+','+'{:.6f}'.format(timestamp)+','+str(int(kept)) for timestamp, index, kept in pair)+'\n')
+            self.n_pairs += 1
+
+        return len(pairs)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def stats(self):
+
+        elapsed = (self.t_stop or time.perf_counter()) - self.t_start if self.t_start is not None else 0.0
+
+        return {'cameras': self.names, 'grabbed': list(self.grabbed), 'kept': list(self.kept), 'failed_grabs': list(self.failed),
+                'fps': [n/elapsed if elapsed > 0 else 0.0 for n in self.grabbed],
+                'aggregate_fps': sum(self.grabbed)/elapsed if elapsed > 0 else 0.0,
+                'pairs': self.n_pairs, 'unpaired': list(self.unpaired), 'max_skew_ms': 1000*self.max_skew}
+
+
+    def report(self):
+
+        stats = self.stats()
+        for k, name in enumerate(self.names):
+            summary = '{:d} frames ({:.2f} fps), {:d} kept, {:d} unpaired, {:d} failed grabs'.format(stats['grabbed'][k], stats['fps'][k], stats['kept'][k],
+                                                                                                   stats['unpaired'][k], stats['failed_grabs'][k])
+            print(colored(name+':\t\t\t\t\t', 'green'), summary)
+            try: self.log_file.write('\n'+name+':\t\t\t\t\t\t\t\t'+summary)
+            except: pass
+        summary = '{:.2f} fps, {:d} frame pairs, max skew {:.2f} ms'.format(stats['aggregate_fps'], stats['pairs'], stats['max_skew_ms'])
+        print(colored('Multi-camera acquisition:\t\t\t', 'green'), summary)
+        try: self.log_file.write('\nMulti-camera acquisition:\t\t\t\t\t'+summary)
+        except: pass
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _capture_loop(self, k):
+
+        camera, pipeline, scheduler = self.cameras[k], self.pipelines[k], self.schedulers[k]
+        image_index = 0
+
+        while self.running:
+
+            t_grab = time.perf_counter()
+            grabbed = camera.grab_image()                                                               # Retrieve the image, its variance and the stadard deviation
+            t_grab = time.perf_counter() - t_grab
+            if grabbed is None:
+                self.failed[k] += 1
+                continue
+            frame, frame_var, frame_dev = grabbed
+            timestamp = camera.last_timestamp if camera.last_timestamp is not None else time.time()
+
+            t_select = time.perf_counter()
+            frame_name = 'image_'+str(image_index).zfill(7)+'.tif'
+            metadata = {'index': image_index, 'timestamp': timestamp, 'variance': frame_var, 'exposure': self.exposure_time}
+            kept = variance_selection(self.bkg_vars[k], frame_var, self.var_treshold, self.save_paths[k], frame_name, frame, label=True,
+                                      pipeline=pipeline, metadata=metadata)                             # Queue data for the folder of the camera if it passes the background filter
+
+            t_select = time.perf_counter() - t_select
+            if self.metrics is not None:
+                t_stats = camera.frame_stats.last_time
+                self.metrics.frame(image_index, camera=self.names[k], grab_ms=1000*(t_grab - t_stats), stats_ms=1000*t_stats,
+                                   select_ms=1000*t_select, queue_depth=pipeline.filled_slots.qsize(), kept=bool(kept))
+
+            with self.lock: self.pending[k].append((timestamp, image_index, bool(kept)))
+            self.grabbed[k] += 1
+            self.kept[k] += int(bool(kept))
+            image_index += 1
+
+            scheduler.wait()                                                                            # Wait for the next frame deadline
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Multi-camera acquisition method:
+# multi-camera counterpart of 'start_offline_acquisition' (stereo or multi-wavelength setups): the cameras listed in 'camera_selectors' are connected at
+# the same time, the background images of each camera are acquired (one camera after the other) in its own folder, and the hologram acquisition runs one
+# capture thread and one writer pool for each camera through the MultiCameraCoordinator. Each camera has its own 'background', 'data' and statistics under
+# 'camera_<n>' in the run folder, while the frame pairs are listed in 'pairs.csv'. The acquisition is controlled through the same RUN/ACQUIRE/STOP/EXIT pins.
+#
+# Input:    - camera_selectors: list of camera IDs or serial numbers (see IdsCamera.select_camera)
+#           - pairing_tolerance: (optional) maximum timestamp difference of two paired frames [s]
+#           - metrics_port: (optional) TCP port of the HTTP metrics endpoint, with the metrics of each camera; None = disabled
+#           - the other parameters are the ones of 'start_offline_acquisition'
+#
+# Return:   - None
+
+def start_multi_camera_acquisition(camera_selectors, time_sleep, exposure_time, black_level, sleep_option, bkg_index_limit, var_treshold, pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT, remote_control, queue_depth=64, n_writers=2, drop_policy='block', n_buffers=1, frame_stats=None, camera_backend='ids', camera_options=None, gpio=None, storage_root='/media/usb/', gpio_mode='poll', gpio_poll_interval=0.05, storage_format='tiff', storage_options=None, frame_rate=None, pixel_clock=None, trigger_mode='freerun', aoi=None, binning=1, subsampling=1, pairing_tolerance=None, metrics_port=None):
+
+    if gpio is not None: GPIO.select(gpio)                                                              # Pin controller (default: RPi.GPIO)
+    if camera_options is None: camera_options = {}
+    metrics, metrics_server = None, None
+    if metrics_port is not None:                                                                        # Live acquisition metrics (labelled by camera)
+        metrics = AcquisitionMetrics(storage_root)
+        metrics_server = MetricsServer(metrics, metrics_port)
+        metrics_server.start()
+    names = ['camera_'+str(k) for k in range(len(camera_selectors))]
+
+    GPIO.setmode(GPIO.BCM)                                                                              # Raspberry GPIO mode setting (BCM = GPIO numbering; BOARD = pin numbering)
+    GPIO.setwarnings(False)                                                                             # Suppress GPIO warnings
+
+    GPIO.setup(pin_RUN, GPIO.OUT)                                                                       # Set GPIO operation mode (OUTPUT)
+    GPIO.setup(pin_ACQUIRE, GPIO.OUT)
+    GPIO.setup(pin_STOP, GPIO.OUT)
+    GPIO.setup(pin_EXIT, GPIO.OUT)
+    GPIO.output(pin_STOP, 1)
+    GPIO.output(pin_ACQUIRE, 0)
+    GPIO.output(pin_EXIT, 0)
+
+    control = GpioController(pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT, gpio_mode, gpio_poll_interval)   # Cached pin states, updated without busy-wait polling
+    control.start()
+
+    while control.input(pin_EXIT)==0:
+
+        if control.input(pin_RUN)==0 and control.input(pin_STOP)==0: break                              # Same exit rule of start_offline_acquisition
+        if control.input(pin_RUN)==0 or control.input(pin_STOP)==0:                                     # Idle until RaspController starts an acquisition
+            control.wait_change(0.5)
+            continue
+
+        run_path = os.path.join(storage_root, datetime.now().strftime("%Y%m%d_%H%M%S"))                 # Run folder, one sub-folder for each camera
+        os.makedirs(run_path+'/log_files/')
+        for name in names:
+            os.makedirs(run_path+'/'+name+'/data/')
+            os.makedirs(run_path+'/'+name+'/background/')
+        log_file = RunLogger(run_path+'/log_files/', metrics=metrics)                                   # Buffered text log and JSON lines events
+        cameras, pipelines, bkg_vars = [], [], []
+
+        try:
+            for name, selector in zip(names, camera_selectors):                                         # Connect all the cameras (one FrameStatistics object for each capture thread)
+                print(colored('\n'+name+':\t\t\t\t\t', 'green'), str(selector) or 'first available camera')
+                log_file.write('\n\n'+name+':\t\t\t\t\t\t\t\t'+(str(selector) or 'first available camera'))
+                camera = open_camera(camera_backend, log_file, exposure_time, black_level, remote_control, selector=selector, n_buffers=n_buffers,
+                                     frame_stats=copy.deepcopy(frame_stats), frame_rate=frame_rate, pixel_clock=pixel_clock, trigger_mode=trigger_mode,
+                                     aoi=aoi, binning=binning, subsampling=subsampling, **camera_options)
+                camera.connect()
+                cameras.append(camera)
+                if not camera.ok:
+                    print(colored('\nCould not connect '+name+', acquisition aborted.\n', 'red'))
+                    log_file.write('\n\nCould not connect '+name+', acquisition aborted.\n')
+                    control.output(pin_STOP, 0)
+                    break
+            if not all(camera.ok for camera in cameras): continue
+
+            for name, camera in zip(names, cameras):                                                    # Background acquisition and statistics of each camera
+                background_model = BackgroundModel()
+                background_acquisition(camera, run_path+'/'+name+'/background/', bkg_index_limit, log_file, time_sleep, sleep_option, pin_EXIT,
+                                       background_model, control)
+                background_model.save(run_path+'/'+name+'/background_statistics.npz', log_file)
+                bkg_vars.append(background_model.variance()[0])
+
+            print(colored('\nWaiting before starting the measurement, set GPIO 15 state to HIGH.\n', 'white'))
+            log_file.write('\n\nWaiting before starting the measurement, set GPIO 15 state to HIGH.\n')
+            control.wait_for(pin_ACQUIRE, 1)                                                            # Wait (idle) until the GPIO realtive to data acquisition is set to HIGH state
+            if control.input(pin_EXIT)==1: break
+
+            print(colored('\n- - - - - - - - - - DATA ACQUISITION START - - - - - - - - - - \n', 'green'))
+            log_file.write('\n\n- - - - - - - - - - DATA ACQUISITION START - - - - - - - - - - \n')
+
+            for name, camera in zip(names, cameras):                                                    # One writer pool for each camera
+                options = dict(storage_options or {})
+                if storage_format == 'raw' and camera.frame_stats.scale == 1.0:
+                    options.setdefault('frame_shape', (camera.size[1], camera.size[0], camera.bytes_per_pixel))
+                pipeline = AcquisitionPipeline(queue_depth, n_writers, drop_policy, log_file,
+                                               writer=open_storage(storage_format, run_path+'/'+name+'/data/', **options))
+                pipeline.start()
+                pipelines.append(pipeline)
+                if metrics is not None: metrics.attach_pipeline(pipeline, name)
+
+            coordinator = MultiCameraCoordinator(cameras, pipelines, [run_path+'/'+name+'/data/' for name in names], bkg_vars, var_treshold, names,
+                                                 pairing_tolerance, time_sleep if sleep_option==True else 0.0, exposure_time,
+                                                 run_path+'/pairs.csv', log_file)
+            coordinator.run(control, pin_STOP, pin_EXIT)                                                # Parallel acquisition until pin_STOP is set to LOW
+
+            print(colored('\n\n- - - - - - - - - - DATA ACQUISITION END - - - - - - - - - - - \n', 'green'))
+            log_file.write('\n\n\n- - - - - - - - - - DATA ACQUISITION END - - - - - - - - - - - \n')
+
+        finally:                                                                                        # Also on exit (pin_EXIT) during the background acquisition
+            for pipeline in pipelines: pipeline.close()                                                 # Write the queued frames and stop the writer pools
+            for camera in cameras:
+                if camera.ok: camera.disconnect()
+            if not log_file.closed: log_file.close()
+
+    print(colored('\n----> EXIT PROGRAM\n', 'red'))
+    control.stop()
+    if metrics_server is not None: metrics_server.stop()
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
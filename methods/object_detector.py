@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import numpy as np
+
+
+DETECTORS = ('variance', 'tiles')
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Variance detector class:
+# the original selection criterion of 'variance_selection' as a detector stage: the frame is a hit if its global variance differs from the background one by
+# at least 'var_treshold' percent. No bounding box is available.
+#
+# Input:    - bkg_var: background variance
+#           - var_treshold: treshold to evaluate the variance comparison [%]
+
+class VarianceDetector(object):
+
+    def __init__(self, bkg_var, var_treshold):
+
+        self.bkg_var = bkg_var
+        self.var_treshold = var_treshold
+
+
+    def __call__(self, frame, frame_var):                                                               # Returns (hit, bounding box, score)
+
+        score = (abs(frame_var - self.bkg_var)/frame_var)*100 if frame_var > 0 else 0.0
+
+        return score >= self.var_treshold, None, score
+
+
+    def update_background(self, frame, frame_var, alpha):                                               # Exponential update from an empty frame (see AdaptiveBackground)
+
+        self.bkg_var += alpha*(float(frame_var) - self.bkg_var)
+
+
+    def state(self):                                                                                    # Background statistics of the checkpoints
+
+        return {'bkg_var': self.bkg_var}
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Tile detector class:
+# local detector for small or faint objects, which barely change the global variance of a large field. The frame (sampled every 'stride' pixels) is subtracted
+# from the per-pixel background mean, the residual global offset (laser intensity drift) is removed and the mean squared residual is computed on square tiles
+# of 'tile' x 'tile' sampled pixels. Each tile energy is divided by the background noise of the tile (mean per-pixel background variance, or, if not available,
+# the median tile energy of the frame): the frame is a hit if at least 'min_tiles' tiles exceed 'threshold', and the bounding box of the hit tiles is returned.
+# All the operations are vectorized on preallocated float32 buffers (4 passes on 1/stride^2 of the pixels), so that the cost is close to the one of np.var on
+# the full frame. Frames whose size does not match the background are always kept (hit without bounding box), so that no data is lost after a readout change.
+#
+# Input:    - tile: tile size [sampled pixels]
+#           - threshold: minimum ratio between the tile energy and the background noise of a hit tile
+#           - min_tiles: minimum number of hit tiles of a hit frame
+#           - stride: subsampling step along both image axes
+#           - normalize: boolean value to remove the mean residual (global intensity drift) before computing the tile energies
+
+class TileDetector(object):
+
+    def __init__(self, tile=16, threshold=4.0, min_tiles=1, stride=2, normalize=True):
+
+        self.tile = max(int(tile), 1)
+        self.threshold = float(threshold)
+        self.min_tiles = max(int(min_tiles), 1)
+        self.stride = max(int(stride), 1)
+        self.normalize = normalize
+        self.background = None                                                                          # Sampled background mean, cropped to whole tiles
+        self.tile_noise = None                                                                          # Background noise of each tile (None: median tile energy)
+        self.residual = None                                                                            # Preallocated residual buffer
+        self.score_map = None                                                                           # Tile scores of the last frame
+        self.frame_shape = None                                                                         # Frame size of the background
+        self.delta = None                                                                               # Preallocated buffer of the background updates
+        self.gain = None
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def set_background(self, mean, var=None):                                                           # Per-pixel background mean and (optional) variance, eg: from BackgroundModel
+
+        if mean.ndim == 3: mean = mean[:, :, 0]
+        if var is not None and var.ndim == 3: var = var[:, :, 0]
+        s, t = self.stride, self.tile
+        self.frame_shape = mean.shape[:2]
+        sampled = mean[::s, ::s]
+        n_rows, n_cols = sampled.shape[0]//t, sampled.shape[1]//t
+        if n_rows == 0 or n_cols == 0: raise ValueError('Tile size '+str(t)+' larger than the sampled background '+str(sampled.shape))
+
+        self.background = np.ascontiguousarray(sampled[:n_rows*t, :n_cols*t], dtype=np.float32)
+        self.residual = np.empty(self.background.shape, dtype=np.float32)
+        self.delta = np.empty(self.background.shape, dtype=np.float32)
+        self.gain = np.empty((n_rows, n_cols), dtype=np.float32)
+        self.tile_noise = None
+        if var is not None:
+            tiles = np.asarray(var[::s, ::s][:n_rows*t, :n_cols*t], dtype=np.float32).reshape(n_rows, t, n_cols, t)
+            self.tile_noise = np.maximum(tiles.mean(axis=(1, 3)), 1e-3)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __call__(self, frame, frame_var=None):                                                          # Returns (hit, bounding box (x0, y0, x1, y1) in frame pixels, score)
+
+        if self.background is None: raise RuntimeError('TileDetector: background not set')
+        if frame.ndim == 3: frame = frame[:, :, 0]
+        if frame.shape[:2] != self.frame_shape: return True, None, np.nan                               # Different readout: keep the frame
+
+        s, t = self.stride, self.tile
+        n_rows, n_cols = self.background.shape[0]//t, self.background.shape[1]//t
+        pixels = frame[:n_rows*t*s:s, :n_cols*t*s:s]
+
+        np.subtract(pixels, self.background, out=self.residual)                                         # Background-subtracted frame
+        if self.normalize: np.subtract(self.residual, self.residual.mean(), out=self.residual)          # Remove the global intensity drift
+        np.multiply(self.residual, self.residual, out=self.residual)
+        energy = self.residual.reshape(n_rows, t, n_cols, t).mean(axis=(1, 3))                          # Mean squared residual of each tile
+
+        noise = self.tile_noise if self.tile_noise is not None else max(float(np.median(energy)), 1e-3)
+        self.score_map = energy/noise
+        hits = self.score_map > self.threshold
+        score = float(self.score_map.max())
+        if np.count_nonzero(hits) < self.min_tiles: return False, None, score
+
+        rows, cols = np.flatnonzero(hits.any(axis=1)), np.flatnonzero(hits.any(axis=0))
+        step = t*s
+        bbox = (int(cols[0]*step), int(rows[0]*step), int((cols[-1] + 1)*step), int((rows[-1] + 1)*step))
+
+        return True, bbox, score
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def update_background(self, frame, frame_var, alpha):                                               # Exponential update from the last (empty) frame passed to __call__
+
+        if frame.ndim == 3: frame = frame[:, :, 0]
+        if frame.shape[:2] != self.frame_shape: return
+
+        s, t = self.stride, self.tile
+        n_rows, n_cols = self.background.shape[0]//t, self.background.shape[1]//t
+        pixels = frame[:n_rows*t*s:s, :n_cols*t*s:s]
+
+        np.subtract(pixels, self.background, out=self.delta)
+        np.multiply(self.delta, alpha, out=self.delta)
+        np.add(self.background, self.delta, out=self.background)                                        # mean = mean + alpha*(x - mean)
+        if self.tile_noise is not None and self.score_map is not None:                                  # Tile energy of the frame = score*noise
+            np.multiply(self.score_map, alpha, out=self.gain)
+            np.add(self.gain, 1.0 - alpha, out=self.gain)
+            np.multiply(self.tile_noise, self.gain, out=self.tile_noise)                                # noise = (1 - alpha)*noise + alpha*energy
+            np.maximum(self.tile_noise, 1e-3, out=self.tile_noise)
+
+
+    def state(self):                                                                                    # Background statistics of the checkpoints
+
+        state = {'background': self.background.copy(), 'stride': self.stride, 'tile': self.tile}
+        if self.tile_noise is not None: state['tile_noise'] = self.tile_noise.copy()
+
+        return state
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Detector factory method:
+# returns the detector stage used by 'variance_selection'; the tile detector needs the per-pixel background statistics and falls back to the variance
+# detector if they are not available (eg: background variance loaded from the background images)
+#
+# Input:    - detector: 'variance' (global variance comparison) or 'tiles' (background-subtracted local statistics)
+#           - bkg_var: background variance
+#           - var_treshold: treshold of the variance detector [%]
+#           - background_model: (optional) BackgroundModel object with the per-pixel background statistics
+#           - log_file: (optional) output file
+#           - **kwargs: options of the tile detector (tile, threshold, min_tiles, stride, normalize)
+#
+# Return:   - detector object: detector(frame, frame_var) returns (hit, bounding box, score)
+
+def open_detector(detector, bkg_var, var_treshold, background_model=None, log_file=None, **kwargs):
+
+    if detector not in DETECTORS: raise ValueError('Unknown detector: '+str(detector)+', expected one of '+str(DETECTORS))
+
+    if detector == 'tiles':
+        if background_model is not None and background_model.count > 0:
+            stage = TileDetector(**kwargs)
+            stage.set_background(background_model.mean, background_model.pixel_variance())
+            print(colored('Object detector:\t\t\t\t', 'green'), 'tiles '+str(stage.tile)+'x'+str(stage.tile)+', stride '+str(stage.stride)+
+                  ', threshold '+str(stage.threshold))
+            try: log_file.write('\nObject detector:\t\t\t\t\t\t\ttiles '+str(stage.tile)+'x'+str(stage.tile)+', stride '+str(stage.stride)+
+                                ', threshold '+str(stage.threshold))
+            except: pass
+            return stage
+        print(colored('Object detector:\t\t\t\t', 'green'), 'no background statistics, global variance used')
+        try: log_file.write('\nObject detector:\t\t\t\t\t\t\tno background statistics, global variance used')
+        except: pass
+
+    return VarianceDetector(bkg_var, var_treshold)
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
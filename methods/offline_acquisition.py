@@ -13,8 +13,20 @@ from termcolor import colored
 import numpy as np, os, time, sys
 from datetime import datetime
 from utils import *
-from IDS_camera import IdsCamera
-import RPi.GPIO as GPIO
+from camera_backends import GPIO, open_camera
+from acquisition_pipeline import AcquisitionPipeline
+from holo_reconstruction import AngularSpectrumReconstructor, ReconstructionWriter
+from frame_storage import open_storage
+from background_model import BackgroundModel, AdaptiveBackground
+from gpio_control import GpioController
+from run_logger import RunLogger
+from metrics_server import AcquisitionMetrics, MetricsServer
+from storage_manager import StorageManager
+from remote_control import PreviewSource, RemoteControlServer
+from auto_exposure import AutoExposureController
+from pretrigger_ring import PreTriggerRing
+from frame_scheduler import FrameScheduler
+from object_detector import open_detector
 
 
 ######################################################################################################################################################################
@@ -29,7 +41,7 @@ import RPi.GPIO as GPIO
 # AT the end of the loop, the user can choose wether to change some settings (eg: exposure time, time sleep, live option, etc...) before starting another acquisition.
 # THIS METHOD IS INTERACTIVE AND THE USER CAN PROCEED AND CONTROL IT STEP-BY-STEP TRHOUGH THE RASPCONTROLLER APP ON SMARTPHONE OR TABLET. 
 #
-# Input:    - time_sleep: time sleep between two consecutive images
+# Input:    - time_sleep: time sleep between two consecutive images (frame period, deadline-based)
 #           - exposure_time: Ueye camera exposure time
 #           - black_level: Ueye camera bleck level offset
 #           - image_index: (incremental) index of the acquired image
@@ -46,10 +58,59 @@ import RPi.GPIO as GPIO
 #           - pin_RUN: number of RPi pin to start the program
 #           - pin_STOP: number of RPi pin to stop/restart image acquisition
 #           - pin_LIVE: number pf RPi pin to enable/disable live image visualization
+#           - queue_depth: number of frames buffered between the capture loop and the writer threads
+#           - n_writers: number of writer threads saving the frames on the external storage device
+#           - drop_policy: behaviour when the frame buffer is full ('block', 'drop_newest' or 'drop_oldest')
+#           - n_buffers: number of Ueye image memories in the driver ring (1 = single image memory, free run)
+#           - frame_stats: (optional) FrameStatistics object defining the per-frame resize and variance computation
+#           - camera_backend: camera backend ('ids' for the IDS Ueye camera, 'simulated' for the synthetic camera)
+#           - camera_options: (optional) dictionary of backend specific camera options (eg: source, fps for the simulated camera)
+#           - gpio: (optional) pin controller replacing RPi.GPIO (eg: SimulatedGPIO for headless runs)
+#           - storage_root: root directory of the run folders
+#           - storage_targets: (optional) list of spillover root directories (eg: a second mount or the SD card), used when 'storage_root' is full or failing
+#           - min_free_space: minimum free space of the storage device receiving the frames [MB] (see storage_manager)
+#           - min_bandwidth: minimum write bandwidth of the storage device receiving the frames [MB/s] (0 = not checked)
+#           - control_port: (optional) TCP port of the remote control and live preview service (see remote_control); None = disabled
+#           - preview_fps: maximum frame rate of the live preview [fps]
+#           - preview_width: width of the live preview frames [pixels]
+#           - reconstruction_planes: (optional) list of z-planes [um] for the real-time angular spectrum reconstruction of the saved holograms
+#           - reconstruction_threads: number of threads used by each reconstruction FFT
+#           - reconstruction_options: (optional) dictionary of options of the saved stacks (dtype, crop, scale, see ReconstructionWriter)
+#           - gpio_mode: 'poll' (single state-machine thread reading the pins; edge detection is not available on the output pins)
+#           - gpio_poll_interval: time between two consecutive readings of the pins in 'poll' mode [s]
+#           - storage_format: 'tiff' (one image file per frame), 'hdf5' or 'npz' (chunked containers with a per-frame metadata table) or 'raw' (memory-mapped log)
+#           - storage_options: (optional) dictionary of storage options (chunk_size, compression, compression_level, flush_interval; capacity for the raw log)
+#           - frame_rate: (optional) camera sensor frame rate [fps]
+#           - pixel_clock: (optional) camera sensor pixel clock [MHz]
+#           - trigger_mode: camera trigger mode ('freerun', 'software' or 'hardware')
+#           - aoi: (optional) sensor area of interest (x, y, width, height) read out by the camera (None = full sensor)
+#           - binning: sensor binning factor (1 = disabled)
+#           - subsampling: sensor subsampling factor (1 = disabled)
+#           - detector: frame selection stage, 'variance' (global variance comparison) or 'tiles' (background-subtracted local statistics, see object_detector)
+#           - detector_options: (optional) dictionary of detector options (tile, threshold, min_tiles, stride, normalize)
+#           - metrics_port: (optional) TCP port of the HTTP metrics endpoint (see metrics_server); None = disabled
+#           - check_interval: number of images between two consecutive image checks (1 = every image; printed on the terminal at most every 50 images)
+#           - check_roi: (optional) region of interest of the image checks (default: the one of the camera FrameStatistics)
+#           - check_stride: subsampling step of the image checks along both image axes (1 = every pixel)
+#           - auto_exposure: boolean value to enable the closed-loop exposure and black level correction during the measurement (see auto_exposure)
+#           - auto_exposure_options: (optional) dictionary of AutoExposureController options (exposure_range, black_level_range, interval, ...)
+#           - pretrigger_frames: number of images saved before each selected image (0 = disabled, see pretrigger_ring)
+#           - posttrigger_frames: number of images saved after each selected image (0 = disabled)
+#           - pretrigger_budget: maximum memory of the pre-trigger ring [MB]
+#           - background_alpha: weight of each empty image in the rolling background update (0 = background frozen, see AdaptiveBackground)
+#           - background_checkpoint: time between two consecutive checkpoints of the rolling background in the run folder [s]
 #
 # Return:   - None
 
-def start_offline_acquisition(time_sleep, exposure_time, black_level, image_index, sleep_option, bkg_index_limit, bkg_var, image_extension, _extension_length, pixel_size, wavelength, medium_index, var_treshold, pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT, remote_control):
+def start_offline_acquisition(time_sleep, exposure_time, black_level, image_index, sleep_option, bkg_index_limit, bkg_var, image_extension, _extension_length, pixel_size, wavelength, medium_index, var_treshold, pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT, remote_control, queue_depth=64, n_writers=2, drop_policy='block', n_buffers=1, frame_stats=None, camera_backend='ids', camera_options=None, gpio=None, storage_root='/media/usb/', reconstruction_planes=None, reconstruction_threads=1, gpio_mode='poll', gpio_poll_interval=0.05, storage_format='tiff', storage_options=None, frame_rate=None, pixel_clock=None, trigger_mode='freerun', aoi=None, binning=1, subsampling=1, detector='variance', detector_options=None, metrics_port=None, check_interval=50, check_roi=None, check_stride=1, auto_exposure=False, auto_exposure_options=None, pretrigger_frames=0, posttrigger_frames=0, pretrigger_budget=64, background_alpha=0, background_checkpoint=600, storage_targets=None, min_free_space=500, min_bandwidth=0, control_port=None, preview_fps=5, preview_width=640, reconstruction_options=None):
+
+    if gpio is not None: GPIO.select(gpio)                                                              # Pin controller (default: RPi.GPIO)
+    if camera_options is None: camera_options = {}
+    metrics, metrics_server = None, None
+    if metrics_port is not None:                                                                        # Live acquisition metrics, shared by all the runs
+        metrics = AcquisitionMetrics(storage_root)
+        metrics_server = MetricsServer(metrics, metrics_port)
+        metrics_server.start()
 
     GPIO.setmode(GPIO.BCM)                                                                              # Raspberry GPIO mode setting (BCM = GPIO numbering; BOARD = pin numbering)
     GPIO.setwarnings(False)                                                                             # Suppress GPIO warnings
@@ -62,16 +123,24 @@ def start_offline_acquisition(time_sleep, exposure_time, black_level, image_inde
     GPIO.output(pin_ACQUIRE, 0)
     GPIO.output(pin_EXIT, 0)
 
+    control = GpioController(pin_RUN, pin_ACQUIRE, pin_STOP, pin_EXIT, gpio_mode, gpio_poll_interval)   # Cached pin states, updated without busy-wait polling
+    control.start()
+    remote, preview = None, None
+    if control_port is not None:                                                                        # Remote commands and live preview through the RaspAP network
+        preview = PreviewSource(preview_fps, preview_width)
+        remote = RemoteControlServer(control, control_port, preview=preview)
+        remote.start()
+
     while True:
 
-        if GPIO.input(pin_RUN)==1:                                                                      # If pin_RUN value is HIGH, start the image acquisition
+        if control.input(pin_RUN)==1:                                                                   # If pin_RUN value is HIGH, start the image acquisition
 
-            GPIO.output(pin_STOP, 1)
-            while GPIO.input(pin_RUN)==1:
+            control.output(pin_STOP, 1)
+            while control.input(pin_RUN)==1:
 
-                if GPIO.input(pin_STOP)==1:                                                             # While pin_STOP is HIGH, the image acquisition is performed
+                if control.input(pin_STOP)==1:                                                          # While pin_STOP is HIGH, the image acquisition is performed
 
-                    if GPIO.input(pin_EXIT)==1: sys.exit()
+                    if control.input(pin_EXIT)==1: sys.exit()
 
                     counter_idx = 0
 
@@ -84,20 +153,18 @@ def start_offline_acquisition(time_sleep, exposure_time, black_level, image_inde
                     os.system('clear')
                     print(colored('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -\n- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -', 'green'))
                     print('\nCreating the folder for image data.\n')                                    # Creating folder for save the images, background images and log files
-                    save_path = '/media/usb/'+datetime.now().strftime("%Y%m%d_%H%M%S")+'/data/'
-                    log_path = '/media/usb/'+datetime.now().strftime("%Y%m%d_%H%M%S")+'/log_files/'
-                    bkg_path = '/media/usb/'+datetime.now().strftime("%Y%m%d_%H%M%S")+'/background/'
-
-                    if os.path.isdir(save_path): print('')                                              # Creates the folders if they do not already exist
-                    else: os.makedirs(save_path)
-                    if os.path.isdir(log_path): print('')
-                    else: os.makedirs(log_path)
-                    if os.path.isdir(bkg_path): print('')
-                    else: os.makedirs(bkg_path)
-
-                    log_file = open(log_path+'log_file.txt', 'w')
-
-                    if GPIO.input(pin_EXIT)==1: 
+                    storage = StorageManager([storage_root]+list(storage_targets or []), min_free_space, min_bandwidth)
+                    folders = ('data', 'log_files', 'background')+(('reconstruction',) if reconstruction_planes else ())
+                    run_path = storage.prepare_run(datetime.now().strftime("%Y%m%d_%H%M%S"), folders)   # Run folders created on every storage device
+                    save_path = run_path+'/data/'
+                    log_path = run_path+'/log_files/'
+                    bkg_path = run_path+'/background/'
+
+                    log_file = RunLogger(log_path, metrics=metrics)                                     # Buffered text log and JSON lines events (log_file.txt, events.jsonl)
+                    storage.probe(log_file)                                                             # Free space and write bandwidth of the storage devices
+                    if metrics is not None: metrics.attach_storage(storage)
+
+                    if control.input(pin_EXIT)==1: 
                         log_file.close()                                                                # Close log file
                         sys.exit()
 
@@ -107,7 +174,10 @@ def start_offline_acquisition(time_sleep, exposure_time, black_level, image_inde
                     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
 
 
-                    camera = IdsCamera(log_file, exposure_time, black_level, remote_control)            # Connect to the IDS Ueye camera
+                    camera = open_camera(camera_backend, log_file, exposure_time, black_level,          # Connect to the IDS Ueye camera (or to the simulated one)
+                                         remote_control, n_buffers=n_buffers, frame_stats=frame_stats, frame_rate=frame_rate,
+                                         pixel_clock=pixel_clock, trigger_mode=trigger_mode, aoi=aoi, binning=binning,
+                                         subsampling=subsampling, **camera_options)
                     camera.connect()
 
                     print(colored('\nImage format:\t\t\t\t\t', 'green'), str(image_extension))          # Log file header and terminal printouts
@@ -120,7 +190,7 @@ def start_offline_acquisition(time_sleep, exposure_time, black_level, image_inde
                     log_file.write('\nWavelength:\t\t\t\t\t\t\t\t\t'+ str(wavelength)+' um')
                     log_file.write('\nMedium refractive index:\t\t\t\t\t'+ '{:.05f}'.format(medium_index)+'\n')
 
-                    if GPIO.input(pin_EXIT)==1: 
+                    if control.input(pin_EXIT)==1: 
                         log_file.close()                                                                # Close log file
                         camera.disconnect()                                                             # Disconnect Ueye camera
                         sys.exit()
@@ -131,21 +201,24 @@ def start_offline_acquisition(time_sleep, exposure_time, black_level, image_inde
                     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
 
 
+                    background_model = BackgroundModel()                                                # Background statistics built while the images are grabbed
                     background_acquisition(camera, bkg_path, bkg_index_limit, log_file, time_sleep, 
-                                           sleep_option, pin_EXIT)                                      # Background acquisition
+                                           sleep_option, pin_EXIT, background_model, control,
+                                           check_roi=check_roi, preview=preview)                        # Background acquisition
+                    if background_model.count > 0: background_model.save(run_path+'/background_statistics.npz', log_file)
                     print(colored('\nWaiting before starting the measurement, set GPIO 15 state to HIGH.\n', 'white'))
                     log_file.write('\n\nWaiting before starting the measurement, set GPIO 15 state to HIGH.\n')
 
-                    if GPIO.input(pin_EXIT)==1: 
+                    if control.input(pin_EXIT)==1: 
                         log_file.close()                                                                # Close log file
                         camera.disconnect()                                                             # Disconnect Ueye camera
                         sys.exit()
 
-                    while GPIO.input(pin_ACQUIRE)==0:                                                   # Wait until the GPIO realtive to data acquisition is set to HIGH state
-                        if GPIO.input(pin_ACQUIRE)==1: break
+                    control.wait_for(pin_ACQUIRE, 1)                                                    # Wait (idle) until the GPIO realtive to data acquisition is set to HIGH state
 
-                    try :                                                                               # (Try to) upload the backgrpund images
-                        bkg_var, bkg_dev = background(bkg_path, image_extension)
+                    try :                                                                               # Background statistics (or, if not available, (try to) upload the background images)
+                        if background_model.count > 0: bkg_var, bkg_dev = background_model.variance()
+                        else: bkg_var, bkg_dev = background(bkg_path, image_extension)
                         if bkg_var==0: 
                             print(colored('No background image detected or NULL background variance, invalid values!\n', 'red'))
                         exit
@@ -160,7 +233,7 @@ def start_offline_acquisition(time_sleep, exposure_time, black_level, image_inde
                             print(colored('\nImage extension not recognized!\n\t- required format: '+image_extension+'\n\t- provided extension: '+os.listdir(bkg_path)[0][-_extension_length:]+'\n', 'red'))
                             log_file.write('\n\nImage extension not recognized!\n\t- required format: '+image_extension+'\n\t- provided extension: '+os.listdir(bkg_path)[0][-_extension_length:]+'\n')
 
-                    if GPIO.input(pin_EXIT)==1: 
+                    if control.input(pin_EXIT)==1: 
                         log_file.close()                                                                # Close log file
                         camera.disconnect()                                                             # Disconnect Ueye camera
                         sys.exit()
@@ -182,14 +255,57 @@ def start_offline_acquisition(time_sleep, exposure_time, black_level, image_inde
                         print(colored('Time sleep between two consecutive images:\t', 'green'), str(sleep_option), colored(', T = ', 'green'), str(time_sleep*1000), colored('ms', 'green'))
                         log_file.write('\nTime sleep between two consecutive images:\t'+str(sleep_option)+', T = '+str(time_sleep*1000)+' ms')
 
-                    if GPIO.input(pin_EXIT)==1: 
+                    if control.input(pin_EXIT)==1: 
                         log_file.close()                                                                # Close log file
                         camera.disconnect()                                                             # Disconnect Ueye camera
                         sys.exit()
 
+                    storage_options = dict(storage_options or {})
+                    if storage_format == 'raw' and camera.frame_stats.scale == 1.0:                     # Raw log preallocated for frames of the camera size
+                        storage_options.setdefault('frame_shape', (camera.size[1], camera.size[0], camera.bytes_per_pixel))
+                    writer = storage.open_writer(lambda folder: open_storage(storage_format, folder,    # Storage backend of the selected frames, on the
+                                                                             **storage_options))        # storage device with enough free space
+                    if reconstruction_planes:                                                           # Real-time reconstruction of the saved holograms in the writer threads
+                        reconstructor = AngularSpectrumReconstructor(pixel_size, wavelength, medium_index, reconstruction_planes,
+                                                                     background=background_model.mean, n_threads=reconstruction_threads)
+                        writer = ReconstructionWriter(reconstructor, lambda: storage.active_folder('reconstruction'), writer,
+                                                      **(reconstruction_options or {}))                 # Data type and crop of the saved stacks
+
+                    pipeline = AcquisitionPipeline(queue_depth, n_writers, drop_policy, log_file,       # Writer pool decoupling the frame grabbing from the USB writes
+                                                   writer=writer)
+                    pipeline.start()
+                    if metrics is not None: metrics.attach_pipeline(pipeline)
+                    detector_stage = open_detector(detector, bkg_var, var_treshold, background_model, log_file,
+                                                   **(detector_options or {}))                          # Frame selection stage
+                    if background_alpha > 0:                                                            # Rolling background updated from the empty images
+                        detector_stage = AdaptiveBackground(detector_stage, background_alpha, run_path+'/background_adaptive.npz',
+                                                            background_checkpoint, log_file)
+                    detections_file = None
+                    if detector == 'tiles':                                                             # Detection score and bounding box of the kept frames
+                        detections_file = open(run_path+'/detections.csv', 'w')
+                        detections_file.write('index,name,score,x0,y0,x1,y1\n')
+                    scheduler = FrameScheduler(time_sleep if sleep_option==True else 0.0)               # Deadline-based frame pacing (or rate measurement only)
+                    exposure_control = None
+                    if auto_exposure:                                                                   # Exposure and black level tracking the background mean level
+                        options = dict(auto_exposure_options or {})
+                        if background_model.count > 0: options.setdefault('target_mean', float(background_model.mean.mean()))
+                        exposure_control = AutoExposureController(camera, log_file, **options)
+                        exposure_control.start()
+                    ring = None
+                    n_timeouts = 0                                                                      # Grabs without a new image (timeout or failed capture)
+                    if pretrigger_frames > 0 or posttrigger_frames > 0:                                 # Images around each selected image (event context)
+                        ring = PreTriggerRing(pipeline, pretrigger_frames, posttrigger_frames, pretrigger_budget, log_file)
+
                     while True:                                                                         # Continuous image display
 
-                        frame, frame_var, frame_dev = camera.grab_image()                               # Retrieve the image from IDS Ueye camera, its variance and the stadard deviation
+                        t_grab = time.perf_counter()
+                        grabbed = camera.grab_image()                                                   # Retrieve the image from IDS Ueye camera, its variance and the stadard deviation
+                        t_grab = time.perf_counter() - t_grab
+                        if grabbed is None:                                                             # Timeout or failed capture: no image this time
+                            n_timeouts += 1
+                            if control.input(pin_EXIT)==1 or control.input(pin_STOP)==0: break
+                            continue
+                        frame, frame_var, frame_dev = grabbed
 
                         if image_index in range(0, 10): frame_name = f'image_000000{image_index}.tif'   # Settting image incremental index
                         elif image_index in range(10, 100): frame_name = f'image_00000{image_index}.tif'
@@ -201,22 +317,38 @@ def start_offline_acquisition(time_sleep, exposure_time, black_level, image_inde
                         image_index += 1
                         counter_idx += 1
 
-                        if GPIO.input(pin_EXIT)==1: 
-                            log_file.close()                                                            # Close log file
-                            camera.disconnect()                                                         # Disconnect Ueye camera
-                            sys.exit()
+                        if preview is not None: preview.offer(frame)                                    # Live preview (never blocks the capture loop)
+                        if exposure_control is not None:                                                # Frame histogram to the auto-exposure thread
+                            exposure_control.submit(camera.frame_stats.hist)
 
-                        if counter_idx%50 == 0:                                                        # Retrieving RPi CPU temperature and from DS18B20
-                            
-                            print(colored('\nImage check', 'yellow'), '\t- Image number:\t\t\t', image_index)
-                            log_file.write('\nImage check - Image number:\t\t\t\t\t'+str(image_index)+'\n')
-                            image_check(frame, log_file)
+                        if control.input(pin_EXIT)==1: break                                            # Same cleanup of the end of the acquisition, then exit
 
-                        variance_selection(bkg_var, frame_var, var_treshold, save_path, frame_name, frame, label=True)      # Save data in the specified folder and apply background filter if label==True
+                        if counter_idx%check_interval == 0:                                             # Image statistics (printed and written by the logger thread)
 
-                        if sleep_option==True: time.sleep(time_sleep)                                   # Time gap between two consecutive images
+                            hist = None                                                                 # Histogram of the frame variance, if computed on the same pixels
+                            if check_roi is None and camera.frame_stats.stride == check_stride: hist = camera.frame_stats.hist
+                            image_check(frame, log_file, check_roi if check_roi is not None else camera.frame_stats.roi, image_index, hist,
+                                        check_stride, 'info' if counter_idx%max(check_interval, 50) == 0 else 'debug')
 
-                        if GPIO.input(pin_STOP)==0: break
+                        t_select = time.perf_counter()
+                        metadata = {'index': image_index - 1, 'timestamp': time.time(), 'variance': frame_var, 'exposure': camera.exp_time}
+                        kept = variance_selection(bkg_var, frame_var, var_treshold, save_path, frame_name, frame, label=True,
+                                                  pipeline=pipeline, metadata=metadata, ring=ring,
+                                                  detector=detector_stage)                              # Queue data for the specified folder and apply background filter if label==True
+                        if kept and detections_file is not None:
+                            bbox = metadata.get('bbox') or ('', '', '', '')
+                            detections_file.write(str(image_index - 1)+','+frame_name+','+'{:.3f}'.format(metadata.get('score', np.nan))+','+
+                                                  ','.join(str(v) for v in bbox)+'\n')
+                        t_select = time.perf_counter() - t_select
+
+                        t_stats = camera.frame_stats.last_time                                          # Per-frame counters [ms]
+                        context = {'post_event': ring.post_event} if ring is not None else {}           # Saved after a selected frame, but not kept
+                        log_file.frame(image_index - 1, grab_ms=1000*(t_grab - t_stats), stats_ms=1000*t_stats, select_ms=1000*t_select,
+                                       queue_depth=pipeline.filled_slots.qsize(), kept=bool(kept), **context)
+
+                        scheduler.wait()                                                                # Wait for the next frame deadline
+
+                        if control.input(pin_STOP)==0: break
 
 
                     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -224,12 +356,24 @@ def start_offline_acquisition(time_sleep, exposure_time, black_level, image_inde
                     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
 
 
+                    scheduler.report(log_file)                                                          # Target and achieved acquisition rate
+                    if n_timeouts > 0:                                                                  # No image from the camera (eg: missing hardware trigger)
+                        print(colored('Grab timeouts:\t\t\t\t\t', 'red'), str(n_timeouts))
+                        log_file.write('\nGrab timeouts:\t\t\t\t\t\t\t\t'+str(n_timeouts))
+                    if exposure_control is not None: exposure_control.stop()
+                    if ring is not None: ring.report()
+                    if background_alpha > 0: detector_stage.close()                                     # Last checkpoint of the rolling background
+                    if detections_file is not None: detections_file.close()
+                    pipeline.close()                                                                    # Write the queued frames and stop the writer pool
                     camera.disconnect()                                                                 # Disconnect Ueye camera
 
                     print(colored('\n\n- - - - - - - - - - DATA ACQUISITION END - - - - - - - - - - - \n', 'green'))
                     log_file.write('\n\n\n- - - - - - - - - - DATA ACQUISITION END - - - - - - - - - - - \n')
 
                     log_file.close()                                                                    # Close log file
+                    if control.input(pin_EXIT)==1: sys.exit()
+
+                if control.input(pin_STOP)==0: control.wait_change(0.5)                                 # Idle until RaspController changes a pin
 
 
         # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -239,7 +383,12 @@ def start_offline_acquisition(time_sleep, exposure_time, black_level, image_inde
 
             print(colored('\n----> EXIT PROGRAM\n', 'red'))
 
-        if GPIO.input(pin_RUN)==0 and GPIO.input(pin_STOP)==0: break
+        if control.input(pin_RUN)==0 and control.input(pin_STOP)==0: break
+        control.wait_change(0.5)
+
+    control.stop()
+    if remote is not None: remote.stop()
+    if metrics_server is not None: metrics_server.stop()
 
 
 ######################################################################################################################################################################
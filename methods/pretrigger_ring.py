@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import numpy as np
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Pre-trigger ring class:
+# keeps the context of each detected event: the frames rejected by the frame selection are copied in a preallocated in-memory ring of the last 'pre_frames'
+# frames instead of being discarded. When the detector fires, the ring content (the frames just before the event, oldest first) and the hit frame are
+# queued to the acquisition pipeline, followed by the next 'post_frames' frames, whatever their selection result. Every frame is saved at most once, so
+# consecutive events share their context frames. Only the frames actually queued are counted as saved ('pre_saved', 'post_saved'; 'not_queued' if the
+# pipeline dropped them). The post-event frames are not kept by the frame selection: 'push' returns False for them, while 'post_event' tells the caller
+# that the last frame was queued as post-event context (reported apart from the kept frames).
+# The ring is allocated at the first frame, with a number of slots fixed by 'ram_budget' (if smaller than 'pre_frames'): the memory use is constant and
+# no memory is allocated frame after frame (one copy of each rejected frame into its slot). A frame size change (eg: readout change) drops the ring content
+# and reallocates it.
+#
+# Input:    - pipeline: AcquisitionPipeline object (or any object with a submit(path, frame, metadata) method)
+#           - pre_frames: number of frames saved before each event
+#           - post_frames: number of frames saved after each event
+#           - ram_budget: maximum memory of the ring [MB]
+#           - log_file: (optional) output file
+
+class PreTriggerRing(object):
+
+    def __init__(self, pipeline, pre_frames=5, post_frames=5, ram_budget=64, log_file=None):
+
+        self.pipeline = pipeline
+        self.pre_frames = max(int(pre_frames), 0)
+        self.post_frames = max(int(post_frames), 0)
+        self.ram_budget = float(ram_budget)
+        self.log_file = log_file
+
+        self.slots = None                                                                               # Preallocated ring of the rejected frames
+        self.paths = []
+        self.metadata = []
+        self.capacity = 0
+        self.head = 0                                                                                   # Next slot to be written
+        self.count = 0                                                                                  # Frames in the ring
+        self.post_remaining = 0
+        self.post_event = False                                                                         # Last pushed frame queued as post-event context
+        self.counters = {'events': 0, 'hits': 0, 'pre_saved': 0, 'post_saved': 0, 'not_queued': 0, 'discarded': 0}
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def push(self, path, frame, metadata, hit):                                                         # Called by the capture loop for every frame; returns the save status
+                                                                                                        # of the selected frames (False for the context frames)
+        self.post_event = False
+        if hit:
+            if self.post_remaining == 0: self.counters['events'] += 1                                   # New event (not the continuation of the previous one)
+            self.counters['hits'] += 1
+            self.flush()
+            self.post_remaining = self.post_frames
+            return self.pipeline.submit(path, frame, self._tag(metadata, 'hit'))
+
+        if self.post_remaining > 0:                                                                     # Frames after the event
+            self.post_remaining -= 1
+            self.post_event = self._submit(path, frame, metadata, 'post')
+            return False
+
+        if self.pre_frames == 0: return False
+        if self.slots is None or self.slots.shape[1:] != frame.shape or self.slots.dtype != frame.dtype: self._allocate(frame)
+        if self.count == self.capacity: self.counters['discarded'] += 1                                 # The oldest frame of the ring is overwritten
+        np.copyto(self.slots[self.head], frame)
+        self.paths[self.head] = path
+        self.metadata[self.head] = metadata
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+        return False
+
+
+    def flush(self):                                                                                    # Queues the frames of the ring, oldest first
+
+        for i in range(self.count):
+            slot = (self.head - self.count + i) % self.capacity
+            self._submit(self.paths[slot], self.slots[slot], self.metadata[slot], 'pre')
+            self.paths[slot], self.metadata[slot] = None, None
+        self.count = 0
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _submit(self, path, frame, metadata, role):                                                     # Queues a context frame; returns True if it has been queued
+
+        queued = self.pipeline.submit(path, frame, self._tag(metadata, role))
+        self.counters[role+'_saved' if queued else 'not_queued'] += 1
+
+        return queued
+
+
+    def _tag(self, metadata, role):                                                                     # Event number and role of the frame in the metadata
+
+        if metadata is not None: metadata['event'], metadata['role'] = self.counters['events'], role
+
+        return metadata
+
+
+    def _allocate(self, frame):
+
+        self.capacity = max(min(self.pre_frames, int(self.ram_budget*1e6//max(frame.nbytes, 1))), 1)
+        self.slots = np.empty((self.capacity,)+frame.shape, dtype=frame.dtype)
+        self.paths = [None]*self.capacity
+        self.metadata = [None]*self.capacity
+        self.head, self.count = 0, 0
+
+        summary = str(self.capacity)+' pre-event frames ('+'{:.1f}'.format(self.slots.nbytes/1e6)+' MB), '+str(self.post_frames)+' post-event frames'
+        print(colored('Pre-trigger ring:\t\t\t\t', 'green'), summary)
+        try: self.log_file.write('\nPre-trigger ring:\t\t\t\t\t\t\t'+summary)
+        except: pass
+
+
+    def report(self):
+
+        summary = ', '.join(key+' = '+str(value) for key, value in self.counters.items())
+        print(colored('Pre-trigger ring:\t\t\t\t', 'green'), summary)
+        try: self.log_file.write('\nPre-trigger ring:\t\t\t\t\t\t\t'+summary)
+        except: pass
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import numpy as np, cv2, asyncio, json, threading, time, urllib.request
+
+
+REMOTE_COMMANDS = {'start': (('RUN', 1), ('STOP', 1)),                                                  # Pin states set by each command, in order
+                   'acquire': (('ACQUIRE', 1),),
+                   'stop': (('ACQUIRE', 0), ('STOP', 0)),
+                   'exit': (('EXIT', 1), ('ACQUIRE', 0), ('STOP', 0), ('RUN', 0))}
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Preview source class:
+# hand-over of the frames from the capture loop to the preview encoder. The capture loop calls 'offer' with every grabbed frame: if nobody is watching, or
+# less than 1/'max_fps' seconds passed since the last preview frame, the call returns immediately; otherwise the frame is copied in a preallocated buffer,
+# only if the buffer is not being read by the encoder (non-blocking lock), so that the capture loop never waits for the preview. The encoder thread
+# downscales the buffer to 'width' pixels and encodes it as JPEG ('encode').
+#
+# Input:    - max_fps: maximum preview frame rate [fps]
+#           - width: width of the preview frames [pixels] (never upscaled)
+#           - quality: JPEG quality (0-100)
+
+class PreviewSource(object):
+
+    def __init__(self, max_fps=5, width=640, quality=70):
+
+        self.interval = 1.0/max(float(max_fps), 0.1)
+        self.width = max(int(width), 1)
+        self.quality = int(quality)
+        self.lock = threading.Lock()
+        self.frame = None                                                                               # Preallocated copy of the last preview frame
+        self.seq = 0                                                                                    # Number of frames copied in the buffer
+        self.last_offer = 0.0
+        self.clients = 0                                                                                # Active viewers (set by the server)
+        self.busy = 0                                                                                   # Frames skipped because the encoder was reading the buffer
+
+
+    def offer(self, frame):                                                                             # Called by the capture loop: returns True if the frame has been copied
+
+        if self.clients == 0: return False
+        now = time.perf_counter()
+        if now - self.last_offer < self.interval: return False
+        if not self.lock.acquire(blocking=False):
+            self.busy += 1
+            return False
+        try:
+            if self.frame is None or self.frame.shape != frame.shape or self.frame.dtype != frame.dtype: self.frame = np.empty_like(frame)
+            np.copyto(self.frame, frame)
+            self.seq += 1
+        finally: self.lock.release()
+        self.last_offer = now
+
+        return True
+
+
+    def encode(self):                                                                                   # Returns (seq, JPEG bytes) of the buffer, or None
+
+        with self.lock:
+            if self.frame is None: return None
+            seq = self.seq
+            height, width = self.frame.shape[:2]
+            scale = min(1.0, self.width/width)
+            small = cv2.resize(self.frame, (max(int(width*scale), 1), max(int(height*scale), 1)), interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+
+        return (seq, jpeg.tobytes()) if ok else None
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Remote control server class:
+# asyncio HTTP service (standard library only, in its own thread and event loop) for the control of the acquisition and a live preview through the RaspAP
+# network, alongside the RaspController pins:
+#           - POST /start, /acquire, /stop, /exit: set the RUN/ACQUIRE/STOP/EXIT states through the GpioController (see REMOTE_COMMANDS), exactly as if
+#             RaspController had toggled the pins; the reply is the JSON status
+#           - GET /status: JSON pin states and preview counters
+#           - GET /preview.mjpg: MJPEG stream (multipart/x-mixed-replace, viewable in a browser) of the downscaled frames, at most 'max_fps' frames/s
+#           - GET /preview.jpg: single JPEG frame
+# The frames are encoded once, in an executor thread, and shared by all the viewers. Each viewer waits for its previous frame to be sent before taking the
+# latest one (per-client backpressure): a slow client skips frames without slowing down the other clients, the encoder or the capture loop, and a client
+# whose socket does not drain within 'drain_timeout' seconds is disconnected. The service can be driven locally by the loopback client functions
+# 'remote_command' and 'remote_snapshot'.
+#
+# Input:    - control: GpioController object
+#           - port: TCP port (0 = any free port)
+#           - host: listening address ('0.0.0.0' = all the interfaces)
+#           - preview: (optional) PreviewSource object fed by the capture loop; if None, the preview is disabled
+#           - drain_timeout: maximum time to send a preview frame to a client [s]
+
+class RemoteControlServer(object):
+
+    def __init__(self, control, port=8080, host='0.0.0.0', preview=None, drain_timeout=5.0):
+
+        self.control = control
+        self.port = int(port)
+        self.host = host
+        self.preview = preview
+        self.drain_timeout = float(drain_timeout)
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.jpeg = None                                                                                # Last encoded preview frame
+        self.jpeg_seq = 0
+        self.new_jpeg = None
+        self.counters = {'commands': 0, 'frames_encoded': 0, 'frames_sent': 0, 'frames_skipped': 0, 'clients_dropped': 0}
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def start(self):
+
+        if self.thread is not None: return
+        self.ready.clear()
+        self.thread = threading.Thread(target=self._run, name='remote_control', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+        print(colored('Remote control:\t\t\t\t\t', 'green'), 'http://'+self.host+':'+str(self.port)+'/status'+
+              (', preview '+str(round(1/self.preview.interval, 1))+' fps' if self.preview is not None else ''))
+
+
+    def stop(self):
+
+        if self.thread is None: return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.thread = None
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def command(self, name):                                                                            # Applies a REMOTE_COMMANDS entry (any thread)
+
+        if name not in REMOTE_COMMANDS: raise ValueError('Unknown remote command: '+str(name)+', expected one of '+str(tuple(REMOTE_COMMANDS)))
+        for pin_name, value in REMOTE_COMMANDS[name]: self.control.output(self.control.pins[pin_name], value)
+        self.counters['commands'] += 1
+
+        print(colored('Remote command:\t\t\t\t\t', 'green'), name)
+
+
+    def status(self):
+
+        status = {name: self.control.input(pin) for name, pin in self.control.pins.items()}
+        status.update(self.counters)
+        if self.preview is not None: status.update({'preview_clients': self.preview.clients, 'preview_busy': self.preview.busy})
+
+        return status
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _run(self):
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.new_jpeg = asyncio.Condition()
+        server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = server.sockets[0].getsockname()[1]
+        if self.preview is not None: self.loop.create_task(self._encoder())
+        self.ready.set()
+
+        self.loop.run_forever()
+
+        tasks = asyncio.all_tasks(self.loop)                                                            # Stop the encoder and disconnect the viewers
+        for task in tasks: task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+        self.loop.close()
+
+
+    async def _encoder(self):                                                                           # Encodes the last preview frame while somebody is watching
+
+        last_seq = 0
+        while True:
+            await asyncio.sleep(self.preview.interval)
+            if self.preview.clients == 0 or self.preview.seq == last_seq: continue
+            result = await self.loop.run_in_executor(None, self.preview.encode)
+            if result is None: continue
+            last_seq, self.jpeg = result
+            self.jpeg_seq += 1
+            self.counters['frames_encoded'] += 1
+            async with self.new_jpeg: self.new_jpeg.notify_all()
+
+
+    async def _next_jpeg(self, seq, timeout=None):                                                      # Waits for a preview frame newer than 'seq'
+
+        async with self.new_jpeg:
+            await asyncio.wait_for(self.new_jpeg.wait_for(lambda: self.jpeg_seq > seq), timeout)
+
+        return self.jpeg_seq, self.jpeg
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    async def _handle(self, reader, writer):
+
+        try:
+            request = (await asyncio.wait_for(reader.readline(), 10.0)).decode('latin-1').split()
+            while (await asyncio.wait_for(reader.readline(), 10.0)) not in (b'\r\n', b'\n', b''): pass  # Request headers (ignored)
+            if len(request) < 2: return
+            method, path = request[0], request[1].split('?')[0].strip('/')
+
+            if path == 'status': await self._reply(writer, 200, self.status())
+            elif path in REMOTE_COMMANDS:
+                if method != 'POST': await self._reply(writer, 405, {'error': 'use POST /'+path})
+                else:
+                    self.command(path)
+                    await self._reply(writer, 200, self.status())
+            elif path in ('preview.jpg', 'preview.mjpg') and self.preview is not None:
+                if path == 'preview.jpg': await self._snapshot(writer)
+                else: await self._stream(writer)
+            else: await self._reply(writer, 404, {'error': 'not found: /'+path})
+        except (asyncio.TimeoutError, asyncio.CancelledError, ConnectionError): pass                    # Client gone, or server stopped
+        finally: writer.close()
+
+
+    async def _reply(self, writer, code, body, content_type='application/json'):
+
+        if not isinstance(body, bytes): body = json.dumps(body).encode('utf-8')
+        writer.write(('HTTP/1.0 '+str(code)+' '+{200: 'OK', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable'}[code]+
+                      '\r\nContent-Type: '+content_type+'\r\nContent-Length: '+str(len(body))+'\r\n\r\n').encode('latin-1')+body)
+        await asyncio.wait_for(writer.drain(), self.drain_timeout)
+
+
+    async def _snapshot(self, writer):
+
+        self.preview.clients += 1
+        try: seq, jpeg = await self._next_jpeg(self.jpeg_seq, 2.0 + 2*self.preview.interval)
+        except asyncio.TimeoutError: seq, jpeg = self.jpeg_seq, self.jpeg                               # No new frame (acquisition idle): last one, if any
+        finally: self.preview.clients -= 1
+
+        if jpeg is None: await self._reply(writer, 503, {'error': 'no preview frame available'})
+        else: await self._reply(writer, 200, jpeg, 'image/jpeg')
+
+
+    async def _stream(self, writer):
+
+        self.preview.clients += 1
+        try:
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=frame\r\nCache-Control: no-cache\r\n\r\n')
+            sent = self.jpeg_seq
+            while True:
+                seq, jpeg = await self._next_jpeg(sent)
+                if sent > 0: self.counters['frames_skipped'] += seq - sent - 1                          # Frames encoded while this client was still sending
+                sent = seq
+                writer.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '+str(len(jpeg)).encode('ascii')+b'\r\n\r\n'+jpeg+b'\r\n')
+                try: await asyncio.wait_for(writer.drain(), self.drain_timeout)                         # Per-client backpressure
+                except asyncio.TimeoutError:
+                    self.counters['clients_dropped'] += 1
+                    return
+                self.counters['frames_sent'] += 1
+        finally: self.preview.clients -= 1
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Loopback client methods:
+# send a command to (or read a preview frame from) a running RemoteControlServer, eg: from another terminal of the Raspberry or from a local test
+#
+# Input:    - command: one of REMOTE_COMMANDS, or 'status'
+#           - host: server address
+#           - port: server TCP port
+#           - timeout: maximum time to wait for the reply [s]
+#
+# Return:   - status: dictionary of pin states and counters (remote_command), or JPEG bytes of a preview frame (remote_snapshot)
+
+def remote_command(command, host='127.0.0.1', port=8080, timeout=5.0):
+
+    request = urllib.request.Request('http://'+host+':'+str(port)+'/'+command, data=b'' if command != 'status' else None)
+    with urllib.request.urlopen(request, timeout=timeout) as reply: return json.loads(reply.read().decode('utf-8'))
+
+
+def remote_snapshot(host='127.0.0.1', port=8080, timeout=5.0):
+
+    with urllib.request.urlopen('http://'+host+':'+str(port)+'/preview.jpg', timeout=timeout) as reply: return reply.read()
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import numpy as np, os, time, json, multiprocessing
+from utils import background
+from frame_statistics import FrameStatistics
+from frame_storage import TiffStorage, iter_stored_frames, stored_frame_units
+from background_model import BackgroundModel
+from object_detector import open_detector
+from holo_reconstruction import AngularSpectrumReconstructor, ReconstructionWriter
+
+
+MANIFEST_HEADER = 'name,kept,score,variance,x0,y0,x1,y1\n'
+
+_worker = {}                                                                                            # Per-process state, set by '_init_worker'
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Worker initialization method:
+# builds, once in each process of the pool, the frame statistics, the detector and (optionally) the reconstruction and copy stages of the reprocessing
+#
+# Input:    - config: reprocessing configuration (see 'reprocess_run')
+#           - done: set of the frame names already in the manifest
+#
+# Return:   - None
+
+def _init_worker(config, done):
+
+    background_model = config['background_model']
+
+    _worker['config'] = config
+    _worker['done'] = done
+    _worker['frame_stats'] = FrameStatistics(stride=config['stats_stride'])
+    _worker['detector'] = open_detector(config['detector'], config['bkg_var'], config['var_treshold'], background_model, **config['detector_options'])
+
+    writer = TiffStorage() if config['copy_kept'] else None
+    if config['reconstruction_planes']:
+        reconstructor = AngularSpectrumReconstructor(config['pixel_size'], config['wavelength'], config['medium_index'], config['reconstruction_planes'],
+                                                     background=background_model.mean if background_model is not None else None)
+        writer = ReconstructionWriter(reconstructor, os.path.join(config['output_path'], 'reconstruction'),
+                                      writer if writer is not None else _skip_writer)
+    _worker['writer'] = writer
+
+
+def _skip_writer(path, frame, metadata=None):                                                           # Reconstruction only: the kept frames are not copied
+
+    return True
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Work unit processing method:
+# reads the frames of one work unit from the data folder, skips the ones already in the manifest, computes the frame variance, applies the detector and
+# saves/reconstructs the kept frames
+#
+# Input:    - unit: work unit (see frame_storage.stored_frame_units)
+#
+# Return:   - rows: list of (name, kept, score, variance, bounding box) tuples
+
+def _process_unit(unit):
+
+    config, writer = _worker['config'], _worker['writer']
+    rows = []
+
+    for name, frame, metadata in iter_stored_frames(config['data_path'], config['image_extension'], unit):
+        if name in _worker['done'] or frame is None: continue
+        if frame.ndim == 2: frame = frame[:, :, np.newaxis]
+
+        frame, frame_var, _ = _worker['frame_stats'](frame)
+        hit, bbox, score = _worker['detector'](frame, frame_var)
+        if hit and writer is not None: writer(os.path.join(config['output_path'], 'data', os.path.splitext(name)[0]+'.tif'), frame)
+        rows.append((name, bool(hit), float(score), float(frame_var), bbox))
+
+    return rows
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Run reprocessing method:
+# re-applies the frame selection (with a different variance treshold or detector) and, optionally, the hologram reconstruction to the frames recorded in
+# the 'data' folder of a run (any storage format), without repeating the acquisition. The frames are split in work units read in parallel by a process pool
+# (each process reads its own frames from the storage device, so that the throughput scales with the number of cores until the disk is saturated).
+# Every processed frame is appended to 'manifest.csv' in the output folder as soon as its unit is done: an interrupted reprocessing restarts from the frames
+# not yet in the manifest. At the end, the totals are written in 'summary.json'.
+#
+# Input:    - run_path: run folder (with 'data', 'background' and, if available, 'background_statistics.npz')
+#           - output_path: (optional) output folder; default: 'reprocessed' in the run folder
+#           - detector: 'variance' or 'tiles' (see object_detector)
+#           - detector_options: (optional) dictionary of detector options
+#           - var_treshold: treshold of the variance detector [%]
+#           - stats_stride: subsampling step of the frame variance computation
+#           - reconstruction_planes: (optional) list of z-planes [um] for the reconstruction of the kept frames
+#           - pixel_size, wavelength, medium_index: reconstruction parameters
+#           - copy_kept: boolean value to write the kept frames (TIFF) in the 'data' folder of the output
+#           - n_workers: number of processes (default: number of cores)
+#           - batch_size: number of frames of each work unit
+#           - image_extension: image format of the single image files
+#
+# Return:   - summary: dictionary with the reprocessing totals
+
+def reprocess_run(run_path, output_path=None, detector='variance', detector_options=None, var_treshold=5, stats_stride=1, reconstruction_planes=None,
+                  pixel_size=5.3, wavelength=0.6335, medium_index=1.0, copy_kept=False, n_workers=None, batch_size=64, image_extension='tif'):
+
+    data_path = os.path.join(run_path, 'data')
+    if output_path is None: output_path = os.path.join(run_path, 'reprocessed')
+    if not os.path.isdir(os.path.join(output_path, 'data')): os.makedirs(os.path.join(output_path, 'data'))
+    n_workers = n_workers or multiprocessing.cpu_count()
+
+    manifest_path = os.path.join(output_path, 'manifest.csv')                                           # Frames already processed by an interrupted reprocessing
+    done, kept_before = set(), 0
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as manifest:
+            for line in list(manifest)[1:]:
+                fields = line.rstrip('\n').split(',')
+                if len(fields) < 2: continue
+                done.add(fields[0])
+                kept_before += int(fields[1] == '1')
+
+    statistics_path = os.path.join(run_path, 'background_statistics.npz')                               # Background statistics (or variance of the background images)
+    background_model = None
+    if os.path.isfile(statistics_path):
+        background_model = BackgroundModel.load(statistics_path)
+        bkg_var = background_model.variance()[0]
+    else: bkg_var = background(os.path.join(run_path, 'background')+'/', image_extension)[0]
+
+    config = {'data_path': data_path, 'output_path': output_path, 'image_extension': image_extension, 'detector': detector,
+              'detector_options': dict(detector_options or {}), 'var_treshold': var_treshold, 'bkg_var': bkg_var,
+              'background_model': background_model, 'stats_stride': stats_stride, 'reconstruction_planes': list(reconstruction_planes or []),
+              'pixel_size': pixel_size, 'wavelength': wavelength, 'medium_index': medium_index, 'copy_kept': copy_kept}
+
+    units = stored_frame_units(data_path, image_extension, batch_size)
+    units = [unit for unit in units if unit[0] != 'files' or not done.issuperset(unit[1])]              # Single image files: the completed units are not even read
+
+    print(colored('Reprocessing:\t\t\t\t\t', 'green'), run_path+' ('+str(len(units))+' work units, '+str(n_workers)+' processes, '+
+          str(len(done))+' frames already done)')
+
+    processed, kept = 0, 0
+    t_start = time.perf_counter()
+    new_manifest = not os.path.isfile(manifest_path)
+    with open(manifest_path, 'a') as manifest, multiprocessing.Pool(n_workers, _init_worker, (config, done)) as pool:
+        if new_manifest: manifest.write(MANIFEST_HEADER)
+        for rows in pool.imap_unordered(_process_unit, units):
+            for name, hit, score, frame_var, bbox in rows:
+                manifest.write(name+','+str(int(hit))+','+'{:.4f}'.format(score)+','+'{:.4f}'.format(frame_var)+','+
+                               ','.join(str(v) for v in (bbox or ('', '', '', '')))+'\n')
+            manifest.flush()                                                                            # Resume point
+            processed += len(rows)
+            kept += sum(1 for row in rows if row[1])
+    elapsed = time.perf_counter() - t_start
+
+    summary = {'run_path': run_path, 'output_path': output_path, 'detector': detector, 'detector_options': config['detector_options'],
+               'var_treshold': var_treshold, 'background_variance': float(bkg_var), 'reconstruction_planes': config['reconstruction_planes'],
+               'processes': n_workers, 'frames_processed': processed, 'frames_kept': kept, 'frames_skipped': len(done),
+               'total_frames': processed + len(done), 'total_kept': kept + kept_before, 'elapsed_s': elapsed,
+               'fps': processed/elapsed if elapsed > 0 else 0.0}
+    with open(os.path.join(output_path, 'summary.json'), 'w') as summary_file: json.dump(summary, summary_file, indent=2)
+
+    print(colored('Reprocessing done:\t\t\t\t', 'green'), '{:d} frames ({:.1f} fps), {:d} kept, {:d} already done'.format(processed, summary['fps'], kept,
+                                                                                                                         len(done)))
+
+    return summary
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
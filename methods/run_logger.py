@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import json, queue, threading, time
+
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+LEVEL_COLORS = {'debug': None, 'info': None, 'warning': 'yellow', 'error': 'red'}
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Run logger class:
+# buffered, asynchronous replacement of the run log file. The acquisition threads only push records in a queue, while a background thread prints them on the
+# terminal, appends them to the text log ('log_file.txt', same layout as before) and to a machine-readable JSON lines file ('events.jsonl', one object per
+# line with time, level, event and fields). The files are flushed every 'flush_interval' seconds instead of at each write, so that neither the terminal nor
+# the storage device add to the frame time.
+# The object can be used wherever the log file was used: 'write' and 'close' keep the file interface (the text is buffered), 'log' adds a structured
+# event with a severity level (printed on the terminal if at least 'terminal_level'), 'frame' records the per-frame counters (grab, statistics, selection
+# and write time, queue depth, ...) and 'timing' adds a single timing measured by another thread (eg: the writer pool). Mean and maximum of each counter
+# are reported when the logger is closed. If the queue is full (disk stalled), the new records are discarded and counted instead of blocking the caller.
+# The records can also feed the live metrics of an AcquisitionMetrics object (see metrics_server), updated by the same background thread.
+#
+# Input:    - log_path: folder of the log files
+#           - terminal_level: minimum level of the events printed on the terminal
+#           - flush_interval: time between two consecutive flushes of the log files [s]
+#           - frame_records: boolean value to write every per-frame record in 'events.jsonl' (otherwise only the summary is written)
+#           - max_records: maximum number of queued records
+#           - metrics: (optional) AcquisitionMetrics object
+
+class RunLogger(object):
+
+    def __init__(self, log_path, terminal_level='info', flush_interval=1.0, frame_records=True, max_records=100000, metrics=None):
+
+        if terminal_level not in LEVELS: raise ValueError('Unknown log level: '+str(terminal_level)+', expected one of '+str(tuple(LEVELS)))
+
+        self.terminal_level = LEVELS[terminal_level]
+        self.flush_interval = float(flush_interval)
+        self.frame_records = frame_records
+        self.metrics = metrics
+        self.text_file = open(log_path+'log_file.txt', 'w')
+        self.json_file = open(log_path+'events.jsonl', 'w')
+        self.records = queue.Queue(max_records)
+        self.counters = {}                                                                              # {name: [count, sum, max]} of the per-frame counters
+        self.discarded = 0
+        self.closed = False
+
+        self.thread = threading.Thread(target=self._writer_loop, name='run_logger', daemon=True)
+        self.thread.start()
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def write(self, text):                                                                              # Text log only (file interface)
+
+        self._put(('text', text))
+
+
+    def log(self, level, event, message=None, color=None, **fields):                                    # Structured event, eg: log('warning', 'disk_full', 'Disk full', free=0)
+
+        if level not in LEVELS: level = 'info'
+        self._put(('event', time.time(), level, event, message, color, fields))
+
+
+    def frame(self, index, **counters):                                                                 # Per-frame counters (times in ms), eg: frame(12, grab_ms=3.1, kept=True)
+
+        self._put(('frame', time.time(), index, counters))
+
+
+    def timing(self, name, value):                                                                      # Single counter measured by another thread, eg: timing('write_ms', 8.2)
+
+        self._put(('timing', name, value))
+
+
+    def _put(self, record):
+
+        if self.closed: return
+        try: self.records.put_nowait(record)
+        except queue.Full: self.discarded += 1
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def summary(self):                                                                                  # Returns {name: (count, mean, max)} of the per-frame counters
+
+        return {name: (count, total/count, maximum) for name, (count, total, maximum) in list(self.counters.items()) if count > 0}
+
+
+    def close(self):                                                                                    # Write the counters summary and the queued records, close the files
+
+        if self.closed: return
+        self.records.put(('summary',))
+        self.records.put(None)
+        self.closed = True
+        self.thread.join()
+        self.text_file.close()
+        self.json_file.close()
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _count(self, name, value):
+
+        if isinstance(value, bool): value = int(value)                                                  # Mean of a boolean counter: fraction of the frames
+        if not isinstance(value, (int, float)): return
+        counter = self.counters.setdefault(name, [0, 0.0, value])
+        counter[0] += 1
+        counter[1] += value
+        counter[2] = max(counter[2], value)
+
+
+    def _writer_loop(self):
+
+        last_flush = time.perf_counter()
+        while True:
+            try: record = self.records.get(timeout=self.flush_interval)
+            except queue.Empty: record = ()
+
+            if record is None: break
+            if len(record) > 0: self._handle(record)
+
+            if time.perf_counter() - last_flush >= self.flush_interval:                                 # Periodic flush of both files
+                self.text_file.flush()
+                self.json_file.flush()
+                last_flush = time.perf_counter()
+
+
+    def _handle(self, record):
+
+        kind = record[0]
+        if kind == 'text': self.text_file.write(record[1])
+
+        elif kind == 'event':
+            t, level, event, message, color, fields = record[1:]
+            if message is not None:
+                if LEVELS[level] >= self.terminal_level: print(colored(message, color or LEVEL_COLORS[level]) if color or LEVEL_COLORS[level] else message)
+                self.text_file.write('\n'+message)
+            self.json_file.write(json.dumps(dict({'t': t, 'level': level, 'event': event}, **fields), default=str)+'\n')
+            if self.metrics is not None: self.metrics.observe_event(event, fields)
+
+        elif kind == 'frame':
+            t, index, counters = record[1:]
+            for name, value in counters.items(): self._count(name, value)
+            if self.metrics is not None: self.metrics.observe_frame(counters)
+            if self.frame_records: self.json_file.write(json.dumps(dict({'t': t, 'level': 'debug', 'event': 'frame', 'index': index}, **counters),
+                                                                   default=str)+'\n')
+
+        elif kind == 'timing':
+            self._count(record[1], record[2])
+            if self.metrics is not None: self.metrics.observe_timing(record[1], record[2])
+
+        elif kind == 'summary':
+            summary = self.summary()
+            text = ', '.join('{} {:.2f}/{:.2f}'.format(name, mean, maximum) for name, (count, mean, maximum) in summary.items())
+            if summary:
+                print(colored('Frame counters (mean/max):\t\t\t', 'green'), text)
+                self.text_file.write('\nFrame counters (mean/max):\t\t\t\t\t'+text)
+            if self.discarded > 0: self.text_file.write('\nLog records discarded:\t\t\t\t\t\t'+str(self.discarded))
+            self.json_file.write(json.dumps({'t': time.time(), 'level': 'info', 'event': 'summary', 'discarded': self.discarded,
+                                             'counters': {name: {'count': count, 'mean': mean, 'max': maximum}
+                                                          for name, (count, mean, maximum) in summary.items()}})+'\n')
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+from frame_statistics import FrameStatistics
+import numpy as np, cv2, os, time
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Simulated camera class:
+# drop-in replacement of IdsCamera (same methods and attributes used by the acquisition pipeline) which does not need the IDS hardware nor pyueye.
+# The frames are either replayed from a TIFF stack (a directory of single-page TIFF files or one multi-page TIFF file) or generated at connection time as
+# synthetic in-line holograms: a Gaussian laser beam plus the concentric fringe patterns of point-like particles at random positions, with Gaussian noise.
+# The frames are precomputed so that grabbing costs no more than reading the sensor memory; the frame rate of the sensor is emulated by waiting for the
+# next frame deadline in grab_image, and the frames the consumer was too slow to read are counted in 'missed_frames'.
+#
+# Input:    - log_file: output file
+#           - exposure_time: exposure time [ms] (only logged)
+#           - black_level: black level offset (only logged)
+#           - remote_control: auxiliary flag for LIVE software control
+#           - selector: camera ID or serial number (only logged)
+#           - n_buffers: number of image memories (kept for interface compatibility)
+#           - frame_stats: (optional) FrameStatistics object defining the per-frame resize and variance computation
+#           - source: (optional) TIFF directory or multi-page TIFF file to replay; if None, synthetic holograms are generated
+#           - fps: emulated sensor frame rate (None = as fast as possible)
+#           - size: (width, height) of the synthetic frames
+#           - n_templates: number of precomputed synthetic frames
+#           - object_probability: fraction of synthetic frames containing at least one particle
+#           - noise_level: standard deviation of the Gaussian noise [grey levels]
+#           - pixel_size: camera pixel size [um]
+#           - wavelength: laser wavelength [um]
+#           - frame_rate: (optional) sensor frame rate, as for IdsCamera (overrides 'fps')
+#           - pixel_clock: (optional) pixel clock [MHz] (only logged)
+#           - trigger_mode: 'freerun' or 'hardware' (frames paced by 'fps') or 'software' (one frame for each grab, no pacing)
+#           - aoi: (optional) sensor AOI (x, y, width, height), in binned/subsampled pixels as for IdsCamera (None = full frame)
+#           - binning: binning factor (mean of factor x factor pixels)
+#           - subsampling: subsampling factor (one pixel every 'subsampling' along both axes)
+#           - seed: (optional) random generator seed
+
+class SimulatedCamera(object):
+
+    def __init__(self, log_file, exposure_time, black_level, remote_control, selector='', n_buffers=1, frame_stats=None,
+                 source=None, fps=10.0, size=(1280, 1024), n_templates=16, object_probability=0.25, noise_level=2.0,
+                 pixel_size=5.3, wavelength=0.6335, frame_rate=None, pixel_clock=None, trigger_mode='freerun', aoi=None, binning=1,
+                 subsampling=1, seed=None):
+        self.log_file = log_file
+        self.exp_time = exposure_time
+        self.black_level = black_level
+        self.remote_control = remote_control
+        self.selector = selector
+        self.n_buffers = max(int(n_buffers), 1)
+        self.frame_stats = frame_stats if frame_stats is not None else FrameStatistics()
+        self.source = source
+        self.fps = frame_rate if frame_rate is not None else fps
+        self.pixel_clock = pixel_clock
+        self.trigger_mode = trigger_mode
+        self.aoi = tuple(aoi) if aoi is not None else None
+        self.binning = int(binning)
+        self.subsampling = int(subsampling)
+        self.sensor_templates = []                                                                      # Full-sensor frames, before the readout settings
+        self.n_templates = max(int(n_templates), 1)
+        self.object_probability = object_probability
+        self.noise_level = noise_level
+        self.pixel_size = pixel_size
+        self.wavelength = wavelength
+        self.rng = np.random.default_rng(seed)
+        self.templates = []
+        self.template_index = 0
+        self.width, self.height = int(size[0]), int(size[1])
+        self.size = (self.width, self.height)
+        self.nBitsPerPixel = 8
+        self.bytes_per_pixel = 1
+        self.ok = False
+        self.last_frame = None
+        self.last_timestamp = None
+        self.next_deadline = None
+        self.frame_count = 0
+        self.missed_frames = 0
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def connect(self):
+
+        if self.source is not None: self.sensor_templates = self.load_tiff_stack(self.source)
+        else: self.sensor_templates = [self.generate_hologram() for i in range(self.n_templates)]
+        self.templates = [self.readout(frame) for frame in self.sensor_templates]
+
+        if len(self.templates) == 0:
+            print(colored('Simulated camera\t\t', 'white'), colored('---> ERROR (no frame to replay)', 'red'))
+            try: self.log_file.write('\nSimulated camera\t\t---> ERROR (no frame to replay)')
+            except: pass
+            return
+
+        self.height, self.width = self.templates[0].shape[:2]
+        self.size = (self.width, self.height)
+        self.bytes_per_pixel = self.templates[0].shape[2]
+        self.nBitsPerPixel = 8*self.bytes_per_pixel*self.templates[0].itemsize
+
+        print(colored('Camera model:\t\t\t\t\t', 'green'), 'simulated ('+('replay of '+str(self.source) if self.source is not None else 'synthetic holograms')+')')
+        print(colored('Camera image size:\t\t\t\t', 'green'), str(self.size))
+        print(colored('Simulated frame rate:\t\t\t\t', 'green'), str(self.fps)+' fps\n')
+        try:
+            self.log_file.write('\nCamera model:\t\t\t\t\t\t\t\tsimulated ('+('replay of '+str(self.source) if self.source is not None else 'synthetic holograms')+')')
+            self.log_file.write('\nCamera image size:\t\t\t\t\t\t\t'+str(self.size))
+            self.log_file.write('\nSimulated frame rate:\t\t\t\t\t\t'+str(self.fps)+' fps\n')
+        except: pass
+
+        self.next_deadline = time.perf_counter()
+        self.ok = True
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def readout(self, frame):                                                                           # Applies binning, subsampling and AOI to a full-sensor frame
+
+        if self.binning > 1:
+            b = self.binning
+            h, w = frame.shape[0]//b*b, frame.shape[1]//b*b
+            frame = frame[:h, :w].reshape(h//b, b, w//b, b, -1).mean(axis=(1, 3)).astype(frame.dtype)
+        if self.subsampling > 1: frame = frame[::self.subsampling, ::self.subsampling]
+        if self.aoi is not None:
+            x, y, width, height = self.aoi
+            frame = frame[y:y+height, x:x+width]
+
+        return np.ascontiguousarray(frame)
+
+
+    def set_readout(self, aoi=None, binning=1, subsampling=1):
+
+        self.aoi = tuple(aoi) if aoi is not None else None
+        self.binning = int(binning)
+        self.subsampling = int(subsampling)
+        if len(self.sensor_templates) == 0: return
+
+        self.templates = [self.readout(frame) for frame in self.sensor_templates]
+        self.template_index = 0
+        self.height, self.width = self.templates[0].shape[:2]
+        self.size = (self.width, self.height)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def load_tiff_stack(self, source):                                                                  # Returns the list of (height, width, channels) frames of the stack
+
+        if os.path.isdir(source):
+            names = sorted(name for name in os.listdir(source) if name.lower().endswith(('.tif', '.tiff')))
+            frames = [cv2.imread(os.path.join(source, name), cv2.IMREAD_UNCHANGED) for name in names]
+        else:
+            ok, frames = cv2.imreadmulti(source, flags=cv2.IMREAD_UNCHANGED)
+            if not ok: frames = []
+
+        frames = [frame if frame.ndim == 3 else frame[:, :, np.newaxis] for frame in frames if frame is not None]
+
+        return [np.ascontiguousarray(frame) for frame in frames]
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def generate_hologram(self):                                                                        # Returns one synthetic in-line hologram (Mono8)
+
+        y, x = np.mgrid[0:self.height, 0:self.width].astype(np.float32)
+        x0, y0 = self.width/2, self.height/2
+        beam = np.exp(-((x - x0)**2 + (y - y0)**2)/(2*(0.6*max(self.width, self.height))**2))          # Gaussian laser beam envelope
+        image = 0.8*beam
+
+        n_objects = self.rng.integers(1, 4) if self.rng.random() < self.object_probability else 0
+        for i in range(n_objects):                                                                      # Fringes of a point-like scatterer at distance z from the sensor
+            xp, yp = self.rng.uniform(0.1, 0.9)*self.width, self.rng.uniform(0.1, 0.9)*self.height
+            z = self.rng.uniform(5e3, 3e4)                                                              # [um]
+            r2 = ((x - xp)**2 + (y - yp)**2)*self.pixel_size**2
+            envelope = np.exp(-r2/(2*(0.15*z)**2))
+            image += 0.15*envelope*beam*np.sin(np.pi*r2/(self.wavelength*z))
+
+        image = 255*image + self.rng.normal(0, self.noise_level, image.shape)
+
+        return np.clip(image, 0, 255).astype(np.uint8)[:, :, np.newaxis]
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def grab_buffer(self, timeout_ms=1000):
+
+        if not self.ok: return None
+
+        if self.fps and self.trigger_mode != 'software':                                                # Emulate the sensor frame rate
+            now = time.perf_counter()
+            if now < self.next_deadline: time.sleep(self.next_deadline - now)
+            else:
+                late = int((now - self.next_deadline)*self.fps)
+                self.missed_frames += late
+                self.next_deadline += late/self.fps
+            self.next_deadline += 1.0/self.fps
+
+        frame = self.templates[self.template_index]
+        self.template_index = (self.template_index + 1) % len(self.templates)
+        self.frame_count += 1
+        self.last_timestamp = time.time()
+
+        return frame, self.template_index
+
+
+    def release_buffer(self, mem_id):
+
+        pass
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def grab_image(self):
+
+        buffer = self.grab_buffer()
+        if buffer is None: return None
+
+        frame, frame_var, frame_dev = self.frame_stats(buffer[0])                                       # Eventually resize the image and compute its variance and standard deviation
+        self.last_frame = frame
+
+        return frame, frame_var, frame_dev
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def disconnect(self):
+
+        self.ok = False
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def set_camera_exposure(self, level_ms):
+
+        self.exp_time = level_ms
+
+
+    def get_camera_exposure(self, force_val=False):
+
+        return self.exp_time
+
+
+    def set_camera_blacklevel(self, blacklevel_value):
+
+        self.black_level = blacklevel_value
+
+
+    def get_camera_blacklevel(self):
+
+        return self.black_level
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def set_pixel_clock(self, clock_mhz):
+
+        self.pixel_clock = clock_mhz
+
+
+    def get_pixel_clock(self):
+
+        return self.pixel_clock
+
+
+    def set_frame_rate(self, fps):
+
+        self.fps = fps
+        if self.ok: self.next_deadline = time.perf_counter()
+
+        return fps
+
+
+    def get_frame_rate_range(self):
+
+        return None
+
+
+    def get_frame_rate(self):
+
+        return self.fps
+
+
+    def set_trigger_mode(self, mode):
+
+        if mode not in ('freerun', 'software', 'hardware'):
+            raise ValueError('Unknown trigger mode: '+str(mode)+", expected one of ('freerun', 'software', 'hardware')")
+        self.trigger_mode = mode
+        if self.ok: self.next_deadline = time.perf_counter()
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
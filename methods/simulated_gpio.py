@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import threading, time                                                                                  # Import required libraries
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Simulated GPIO class:
+# in-memory replacement of the RPi.GPIO module (same constants and functions used by the acquisition methods). The pin states can be changed from another
+# thread with 'set_pin', or by a timed script of (time [s], pin, value) events, counted from the first 'setmode' call and applied by a background thread (as
+# RaspController does, so that the edge callbacks fire also when nobody reads the pins); this reproduces the RaspController actions (RUN, ACQUIRE, STOP,
+# EXIT) during a headless run.
+#
+# Input:    - script: (optional) list of (time, pin, value) events
+
+class SimulatedGPIO(object):
+
+    BCM, BOARD = 11, 10
+    OUT, IN = 0, 1
+    LOW, HIGH = 0, 1
+    PUD_OFF, PUD_DOWN, PUD_UP = 20, 21, 22
+    RISING, FALLING, BOTH = 31, 32, 33
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __init__(self, script=None):
+
+        self.pins = {}
+        self.modes = {}
+        self.callbacks = {}
+        self.script = sorted(script, key=lambda event: event[0]) if script is not None else []
+        self.t_start = None
+        self.n_reads = 0                                                                                # Number of GPIO.input calls (polling cost)
+        self.lock = threading.RLock()
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def setmode(self, mode):
+
+        if self.t_start is not None: return
+        self.t_start = time.perf_counter()
+        if len(self.script) > 0: threading.Thread(target=self._script_loop, name='simulated_gpio_script', daemon=True).start()
+
+
+    def setwarnings(self, flag):
+
+        pass
+
+
+    def setup(self, pin, mode, pull_up_down=None, initial=None):
+
+        with self.lock:
+            self.modes[pin] = mode
+            if initial is not None: self.pins[pin] = int(initial)
+            else: self.pins.setdefault(pin, 0)
+
+
+    def cleanup(self, pin=None):
+
+        with self.lock:
+            if pin is None: self.callbacks = {}
+            else: self.callbacks.pop(pin, None)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def input(self, pin):
+
+        with self.lock:
+            self.n_reads += 1
+            self._run_script()
+            return self.pins.get(pin, 0)
+
+
+    def output(self, pin, value):
+
+        self.set_pin(pin, value)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+
+        with self.lock: self.callbacks[pin] = (edge, [callback] if callback is not None else [])
+
+
+    def add_event_callback(self, pin, callback):
+
+        with self.lock: self.callbacks[pin][1].append(callback)
+
+
+    def remove_event_detect(self, pin):
+
+        with self.lock: self.callbacks.pop(pin, None)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def set_pin(self, pin, value):                                                                      # Change a pin state (as RaspController does) and fire the edge callbacks
+
+        with self.lock:
+            old_value = self.pins.get(pin, 0)
+            self.pins[pin] = int(value)
+            edge, callbacks = self.callbacks.get(pin, (None, []))
+            rising, falling = old_value == 0 and int(value) == 1, old_value == 1 and int(value) == 0
+            if (rising and edge in (self.RISING, self.BOTH)) or (falling and edge in (self.FALLING, self.BOTH)):
+                for callback in callbacks: callback(pin)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def _script_loop(self):
+
+        while True:
+            with self.lock:
+                if len(self.script) == 0: return
+                delay = self.script[0][0] - (time.perf_counter() - self.t_start)
+            time.sleep(max(delay, 0.0))
+            with self.lock: self._run_script()
+
+
+    def _run_script(self):
+
+        if self.t_start is None or len(self.script) == 0: return
+
+        elapsed = time.perf_counter() - self.t_start
+        while len(self.script) > 0 and self.script[0][0] <= elapsed:
+            _, pin, value = self.script.pop(0)
+            self.set_pin(pin, value)
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+from termcolor import colored                                                                           # Import required libraries
+import os, shutil, threading, time
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Storage target class:
+# state of a storage device (mount point) used by the StorageManager: free space (refreshed at most every 'check_interval' seconds, estimated in between),
+# write bandwidth (exponential mean of the frame bytes over the write time), written frames and bytes, write errors.
+#
+# Input:    - path: root directory of the run folders on the device (eg: '/media/usb/')
+
+class StorageTarget(object):
+
+    def __init__(self, path):
+
+        self.path = path
+        self.run_path = None                                                                            # Run folder on this device
+        self.free = 0
+        self.total = 0
+        self.last_check = 0.0
+        self.bandwidth = None                                                                           # Write bandwidth [bytes/s]
+        self.frames = 0
+        self.bytes = 0
+        self.write_time = 0.0
+        self.failed = 0
+        self.consecutive_failures = 0
+
+
+    def refresh(self):                                                                                  # Free space of the device (one statvfs call)
+
+        path = os.path.abspath(self.path)                                                               # Root not created yet: its nearest existing parent
+        while not os.path.isdir(path) and os.path.dirname(path) != path: path = os.path.dirname(path)
+        try:
+            usage = shutil.disk_usage(path)
+            self.free, self.total = usage.free, usage.total
+        except OSError: self.free, self.total = 0, 0                                                    # Device not mounted or removed
+        self.last_check = time.time()
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Storage manager class:
+# disk-space-aware writer of the selected frames over one or more storage devices ('targets', in order of preference: eg, the USB stick first, then a second
+# mount or the SD card). 'prepare_run' creates the run folder (with all its sub-folders) on every target before the acquisition, and 'probe' measures the
+# write bandwidth of each target with a short synchronous write, so that the first frames are not delayed by the folder creation or by a cold device.
+# If no target has enough free space, the run folder is created on the target with the most free space (log files and background images are still
+# written there) and the selected frames are dropped and counted.
+# During the acquisition the object is the writer of the AcquisitionPipeline (called as writer(path, frame, metadata) by the writer threads): each frame is
+# handed over to the storage backend of the active target (opened on the target at its first frame through 'factory'), the return value of the backend is
+# checked, and the free space and write bandwidth of the target are tracked. The frames spill over to the next target when:
+#           - the free space is below 'min_free'
+#           - 'max_failures' consecutive writes failed (eg: USB stick removed or read-only)
+#           - the write bandwidth is below 'min_bandwidth' (only if the next target is faster; otherwise the writes are counted as slow and the pipeline
+#             buffer and drop policy throttle the capture loop)
+# If no target is left, the frames are dropped and counted instead of being written on a full device. Every spillover and the first dropped frame are
+# logged, and all the counters are reported when the pipeline is closed.
+#
+# Input:    - targets: list of root directories of the run folders, in order of preference
+#           - min_free: minimum free space of the active target [MB]
+#           - min_bandwidth: minimum write bandwidth of the active target [MB/s] (0 = not checked)
+#           - check_interval: time between two consecutive free space readings of the active target [s]
+#           - max_failures: number of consecutive write errors after which the active target is abandoned
+#           - probe_size: size of the bandwidth probe written on each target by 'probe' [MB] (0 = no probe)
+#           - log_file: (optional) output file (or RunLogger object)
+
+class StorageManager(object):
+
+    def __init__(self, targets, min_free=500, min_bandwidth=0, check_interval=2.0, max_failures=3, probe_size=8, log_file=None):
+
+        if len(targets) == 0: raise ValueError('At least one storage target is required')
+
+        self.targets = [StorageTarget(path) for path in targets]
+        self.min_free = float(min_free)*1e6
+        self.min_bandwidth = float(min_bandwidth)*1e6
+        self.check_interval = float(check_interval)
+        self.max_failures = max(int(max_failures), 1)
+        self.probe_size = max(int(probe_size), 0)
+        self.log_file = log_file
+
+        self.active = 0                                                                                 # Index of the target receiving the frames
+        self.factory = None
+        self.subfolder = 'data'
+        self.backends = {}                                                                              # Storage backend of each used target
+        self.lock = threading.Lock()
+        self.counters = {'spillovers': 0, 'dropped': 0, 'failed': 0, 'slow_writes': 0}
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def prepare_run(self, run_name, subfolders=('data', 'log_files', 'background')):                    # Returns the run folder on the first usable target
+
+        for target in self.targets: target.refresh()
+        usable = [i for i, target in enumerate(self.targets) if target.free >= self.min_free]
+        if len(usable) > 0: self.active = usable[0]
+        else:                                                                                           # Frames dropped (and counted) by '_select'
+            self.active = max(range(len(self.targets)), key=lambda i: self.targets[i].free)
+            self._log('Storage full:\t\t\t\t\tno storage target with at least '+str(int(self.min_free/1e6))+' MB free, frames dropped', 'storage_full')
+
+        for target in self.targets[self.active:]:                                                       # Run folder on every target, ready for a spillover
+            target.run_path = os.path.join(target.path, run_name)
+            try:
+                for subfolder in subfolders: os.makedirs(os.path.join(target.run_path, subfolder), exist_ok=True)
+            except OSError: target.consecutive_failures = self.max_failures                             # Read-only or removed device: never used
+
+        if self.targets[self.active].consecutive_failures >= self.max_failures:
+            raise IOError('Run folder could not be created on '+self.targets[self.active].path)
+
+        return self.targets[self.active].run_path
+
+
+    def probe(self, log_file=None):                                                                     # Measures the write bandwidth of each target
+
+        if log_file is not None: self.log_file = log_file
+
+        block = bytes(1 << 20)
+        for target in self.targets[self.active:]:
+            if target.run_path is None: continue
+            if self.probe_size > 0 and target.consecutive_failures < self.max_failures:
+                probe_path = os.path.join(target.run_path, '.write_probe')
+                try:
+                    t_start = time.perf_counter()
+                    with open(probe_path, 'wb') as probe_file:
+                        for i in range(self.probe_size): probe_file.write(block)
+                        probe_file.flush()
+                        os.fsync(probe_file.fileno())
+                    target.bandwidth = self.probe_size*len(block)/max(time.perf_counter() - t_start, 1e-6)
+                    os.remove(probe_path)
+                except OSError: target.consecutive_failures = self.max_failures
+            target.refresh()
+
+            summary = target.run_path+': '+'{:.1f}'.format(target.free/1e9)+' GB free'
+            if target.bandwidth is not None: summary += ', '+'{:.1f}'.format(target.bandwidth/1e6)+' MB/s'
+            if target.consecutive_failures >= self.max_failures: summary += ', not writable'
+            print(colored('Storage target:\t\t\t\t\t', 'green'), summary)
+            try: self.log_file.write('\nStorage target:\t\t\t\t\t\t\t\t'+summary)
+            except: pass
+
+
+    def open_writer(self, factory, subfolder='data'):                                                   # Returns the writer function of the AcquisitionPipeline
+
+        self.factory = factory                                                                          # factory(folder) returns the storage backend of a folder
+        self.subfolder = subfolder
+
+        return self
+
+
+    def active_folder(self, subfolder):                                                                 # Returns the run sub-folder on the active target
+
+        return os.path.join(self.targets[self.active].run_path, subfolder)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def __call__(self, path, frame, metadata=None):                                                     # Called by the writer threads: returns True if the frame has been written,
+                                                                                                        # None if it has been dropped (no storage target left)
+        target, backend = self._select(frame.nbytes)
+        if backend is None: return None
+
+        path = os.path.join(target.run_path, self.subfolder, os.path.basename(path))                    # Same frame name, in the run folder of the active target
+        t_start = time.perf_counter()
+        try: save_status = backend(path, frame, metadata)
+        except Exception: save_status = False
+        t_write = time.perf_counter() - t_start
+
+        with self.lock:
+            if save_status:
+                target.frames += 1
+                target.bytes += frame.nbytes
+                target.write_time += t_write
+                target.consecutive_failures = 0
+                if t_write > 0:
+                    rate = frame.nbytes/t_write
+                    target.bandwidth = rate if target.bandwidth is None else 0.9*target.bandwidth + 0.1*rate
+            else:
+                target.failed += 1
+                target.consecutive_failures += 1
+                self.counters['failed'] += 1
+
+        return bool(save_status)
+
+
+    def _select(self, nbytes):                                                                          # Returns the active target and its backend (None: frame dropped)
+
+        message = None
+        with self.lock:
+            target = self.targets[self.active]
+            if time.time() - target.last_check >= self.check_interval: target.refresh()
+            else: target.free -= nbytes                                                                 # Estimate between two readings
+
+            reason = None
+            if target.consecutive_failures >= self.max_failures: reason = 'write errors'
+            elif target.free < self.min_free: reason = 'free space '+'{:.0f}'.format(target.free/1e6)+' MB'
+            elif self.min_bandwidth > 0 and target.bandwidth is not None and target.bandwidth < self.min_bandwidth:
+                reason = 'bandwidth '+'{:.1f}'.format(target.bandwidth/1e6)+' MB/s'
+
+            if reason is not None:
+                index = self._next_target(bandwidth=target.bandwidth if reason.startswith('bandwidth') else None)
+                if index is not None:
+                    self.active = index
+                    self.counters['spillovers'] += 1
+                    message = 'Storage spillover:\t\t\t\t'+target.path+' ('+reason+') -> '+self.targets[index].path
+                elif reason.startswith('bandwidth'): self.counters['slow_writes'] += 1
+                else:
+                    self.counters['dropped'] += 1
+                    if self.counters['dropped'] == 1: message = 'Storage full:\t\t\t\t\tno storage target left ('+reason+'), frames dropped'
+                    target = None
+
+            backend = None
+            if target is not None:                                                                      # Target and backend read under the same lock
+                target = self.targets[self.active]
+                if self.active not in self.backends:
+                    self.backends[self.active] = self.factory(os.path.join(target.run_path, self.subfolder)+'/')
+                backend = self.backends[self.active]
+
+        if message is not None: self._log(message, 'storage_spillover' if target is not None else 'storage_full', target is not None)
+
+        return target, backend
+
+
+    def _next_target(self, bandwidth=None):                                                             # First following target with enough free space (and faster)
+
+        for index in range(self.active + 1, len(self.targets)):
+            target = self.targets[index]
+            if target.run_path is None or target.consecutive_failures >= self.max_failures: continue
+            target.refresh()
+            if target.free < self.min_free: continue
+            if bandwidth is not None and (target.bandwidth is None or target.bandwidth <= bandwidth): continue
+            return index
+
+        return None
+
+
+    def _log(self, message, event, warning=True):
+
+        if hasattr(self.log_file, 'log'):
+            self.log_file.log('warning' if warning else 'error', event, message, **dict(self.counters))
+            return
+        print(colored(message, 'yellow' if warning else 'red'))
+        try: self.log_file.write('\n'+message)
+        except: pass
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def stats(self):                                                                                    # Returns the counters and the state of each target
+
+        with self.lock:
+            stats = dict(self.counters)
+            stats['active'] = self.targets[self.active].path
+            stats['targets'] = [{'path': t.path, 'free': t.free, 'total': t.total, 'bandwidth': t.bandwidth or 0.0, 'frames': t.frames,
+                                 'bytes': t.bytes, 'failed': t.failed} for t in self.targets]
+
+        return stats
+
+
+    def close(self):                                                                                    # Close the storage backends of all the used targets
+
+        for backend in self.backends.values():
+            if hasattr(backend, 'close'): backend.close()
+
+
+    def report(self, log_file=None):
+
+        for backend in self.backends.values():
+            if hasattr(backend, 'report'): backend.report(log_file)
+
+        for target in self.targets:
+            if target.run_path is None: continue
+            target.refresh()
+            summary = (target.path+': '+str(target.frames)+' frames, '+'{:.1f}'.format(target.bytes/1e6)+' MB'+
+                       (', '+'{:.1f}'.format(target.bytes/target.write_time/1e6)+' MB/s' if target.write_time > 0 else '')+
+                       ', '+str(target.failed)+' failed, '+'{:.1f}'.format(target.free/1e9)+' GB free')
+            print(colored('Storage target:\t\t\t\t\t', 'green'), summary)
+            try: log_file.write('\nStorage target:\t\t\t\t\t\t\t\t'+summary)
+            except: pass
+
+        summary = ', '.join(key+' = '+str(value) for key, value in self.counters.items())
+        print(colored('Storage manager:\t\t\t\t', 'green'), summary)
+        try: log_file.write('\nStorage manager:\t\t\t\t\t\t\t'+summary)
+        except: pass
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
@@ -11,9 +11,10 @@ Created on Thu Sep 22, 2022
 
 from termcolor import colored                                                                           # Import required libraries
 import numpy as np, cv2, time, sys, os
-from PIL import Image
-from IDS_camera import IdsCamera
-import RPi.GPIO as GPIO
+from camera_backends import GPIO
+from frame_scheduler import FrameScheduler
+from frame_statistics import image_histogram, histogram_statistics
+from frame_stack import stack_statistics
 
 
 ######################################################################################################################################################################
@@ -47,14 +48,25 @@ def ProgressBar(percent, barLen = 100):
 #           - bkg_path: path to save background images
 #           - image_index_limit: number of images to acquire
 #           - log_file: output file
-#           - time_sleep: (optional) time between two consecutive images
+#           - time_sleep: (optional) time between two consecutive images (frame period, deadline-based)
 #           - sleep_option: boolean value to enable time sleep
+#           - background_model: (optional) BackgroundModel object updated with every acquired image
+#           - control: (optional) GpioController object providing the cached pin states
+#           - check_interval: number of images between two consecutive image checks
+#           - check_roi: (optional) region of interest of the image checks (default: the one of the camera FrameStatistics)
+#           - preview: (optional) PreviewSource object of the remote live preview (see remote_control)
+#           - max_timeouts: maximum number of grab timeouts before stopping (timeouts do not use up background images)
 #
 # Return:   - None
 
-def background_acquisition(camera, bkg_path, image_index_limit, log_file, time_sleep, sleep_option, pin_EXIT):
+def background_acquisition(camera, bkg_path, image_index_limit, log_file, time_sleep, sleep_option, pin_EXIT, background_model=None, control=None, check_interval=25,
+                           check_roi=None, preview=None, max_timeouts=100):
 
     image_index = 1                                                                                     # Incremental image number
+    n_failed = 0                                                                                        # Background images not written
+    n_timeouts = 0                                                                                      # Grabs without a new image (timeout or failed capture)
+    scheduler = FrameScheduler(time_sleep if sleep_option==True else 0.0)                               # Deadline-based frame pacing
+    gpio_input = control.input if control is not None else GPIO.input                                   # Cached pin states (no GPIO access) if a controller is available
 
     print(colored('\n- - - - - - - - - BACKGROUND ACQUISITION START - - - - - - - - - \n', 'green'))
     log_file.write('\n\n- - - - - - - - - BACKGROUND ACQUISITION START - - - - - - - - - \n')
@@ -69,14 +81,26 @@ def background_acquisition(camera, bkg_path, image_index_limit, log_file, time_s
         print(colored('Time sleep between two consecutive images:\t', 'green'), str(sleep_option), colored(', T = ', 'green'), str(time_sleep*1000), colored('ms', 'green'))
         log_file.write('\nTime sleep between two consecutive images:\t'+str(sleep_option)+', T = '+str(time_sleep*1000)+' ms')
 
-    if GPIO.input(pin_EXIT)==1: 
+    if gpio_input(pin_EXIT)==1: 
         log_file.close()                                                                                # Close log file
         camera.disconnect()                                                                             # Disconnect Ueye camera
         sys.exit()
 
-    for i in range(image_index, image_index_limit+1):                                                   # Continuous image display
+    while image_index <= image_index_limit:                                                             # Continuous image display
 
-        frame, _, _ = camera.grab_image()                                                               # Retrieve the image from IDS Ueye camera, its variance and the stadard deviation
+        grabbed = camera.grab_image()                                                                   # Retrieve the image from IDS Ueye camera, its variance and the stadard deviation
+        if grabbed is None:                                                                             # Timeout or failed capture: no image this time, grab again
+            n_timeouts += 1
+            if n_timeouts >= max_timeouts: break                                                        # No image from the camera for too long
+            if gpio_input(pin_EXIT)==1: 
+                log_file.close()                                                                        # Close log file
+                camera.disconnect()                                                                     # Disconnect Ueye camera
+                sys.exit()
+            continue
+        frame, frame_var, _ = grabbed
+
+        if background_model is not None: background_model.update(frame, frame_var)                      # Streaming background statistics
+        if preview is not None: preview.offer(frame)                                                    # Live preview through the remote control service
 
         if image_index in range(0, 10): frame_name = f'image_00000{image_index}.tif'                    # Settting image incremental index
         elif image_index in range(10, 100): frame_name = f'image_0000{image_index}.tif'
@@ -86,23 +110,32 @@ def background_acquisition(camera, bkg_path, image_index_limit, log_file, time_s
         elif image_index >= 100000: frame_name = f'image_{image_index}.tif'
         image_index += 1
 
-        if GPIO.input(pin_EXIT)==1: 
+        if gpio_input(pin_EXIT)==1: 
             log_file.close()                                                                            # Close log file
             camera.disconnect()                                                                         # Disconnect Ueye camera
             sys.exit()
         
-        if image_index%25 == 0:    
-            print(colored('\nImage check', 'yellow'), '\t- Image number:\t\t\t', image_index)
-            log_file.write('\nImage check - Image number:\t\t\t\t\t'+str(image_index)+'\n')
-            image_check(frame, log_file)
+        if image_index%check_interval == 0:                                                             # Image statistics (by the logger thread)
+            hist = camera.frame_stats.hist if check_roi is None and camera.frame_stats.stride == 1 else None
+            image_check(frame, log_file, check_roi if check_roi is not None else camera.frame_stats.roi, image_index, hist)
 
-        cv2.imwrite(bkg_path+frame_name, np.array(frame))                                               # Save data in the specified folder
+        if not cv2.imwrite(bkg_path+frame_name, frame): n_failed += 1                                   # Save data in the specified folder
 
-        if sleep_option==True: time.sleep(time_sleep)                                                   # Time gap between two consecutive images
+        scheduler.wait()                                                                                # Wait for the next frame deadline
 
         if cv2.waitKey(1) & 0xFF == ord('q'): break                                                     # Press q if you want to end the loop
 
     cv2.destroyAllWindows() 
+    scheduler.report(log_file)
+    if n_failed > 0:                                                                                    # Storage device full or removed
+        print(colored('Background images not saved:\t\t\t', 'red'), str(n_failed))
+        log_file.write('\nBackground images not saved:\t\t\t\t'+str(n_failed))
+    if n_timeouts > 0:                                                                                  # No image from the camera (eg: missing hardware trigger)
+        print(colored('Grab timeouts:\t\t\t\t\t', 'red'), str(n_timeouts))
+        log_file.write('\nGrab timeouts:\t\t\t\t\t\t\t\t'+str(n_timeouts))
+    if image_index <= image_index_limit:                                                                # Stopped before the requested number of images
+        print(colored('Background images acquired:\t\t\t', 'red'), str(image_index-1), colored('of', 'red'), str(image_index_limit))
+        log_file.write('\nBackground images acquired:\t\t\t\t'+str(image_index-1)+' of '+str(image_index_limit))
 
     print(colored('\n- - - - - - - - - BACKGROUND ACQUISITION END - - - - - - - - - -\n', 'green'))
     log_file.write('\n\n- - - - - - - - - BACKGROUND ACQUISITION END - - - - - - - - - -\n')
@@ -110,33 +143,24 @@ def background_acquisition(camera, bkg_path, image_index_limit, log_file, time_s
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
 # Background analysis method:
-# analyze the previously acuired background images and compute image variance and standard deviation
+# analyze the previously acuired background images and compute image variance and standard deviation; the images are loaded 'chunk_size' at a time in a
+# single frame stack and their variances are computed in vectorized batches (see frame_stack). Only the 'image_*' files actually written are analyzed (the
+# numbering has gaps where an image could not be saved), except the first one.
 #
 # Input:    - bkg_path: path where background images are stored
 #           - image_extension: image format (.tif or .tiff)
+#           - chunk_size: number of images loaded at a time
 #
 # Return:   - var: background images mean variance
 #           - dev: backgound images mean standard deviation
 
-def background(bkg_path, image_extension):
+def background(bkg_path, image_extension, chunk_size=256):
 
-    background_image_number = len(os.listdir(bkg_path))                                                 # Getting the # of images in the directory
-    var_list = []
+    names = sorted(name for name in os.listdir(bkg_path)                                                # Background images in the directory, in acquisition order
+                   if name.startswith('image_') and name.lower().endswith('.'+image_extension.lower()))
+    paths = [bkg_path+name for name in names[1:]]
 
-    for i in range(2, background_image_number+1):                                                       # Background images upload
-        
-        if i in range(0, 10): index = '00000'+str(i)                                                    # Set the appropiate suffix for image selection 
-        elif i in range(10, 100): index = '0000'+str(i)
-        elif i in range(100, 1000): index = '000'+str(i)
-        elif i in range(1000, 10000): index = '00'+str(i)
-        elif i in range(10000, 100000): index = '0'+str(i)
-        elif i >= 100000: index = str(i)
-
-        bkg_image = Image.open(bkg_path+'image_'+index+'.'+image_extension)
-        bkg_image = np.array(bkg_image)
-        var_list.append(np.var(bkg_image))
-
-    var = float(np.mean(var_list))                                                                      # Variance
+    var = float(np.mean(stack_statistics(paths, chunk_size)['frame_var']))                              # Variance
     dev = np.sqrt(var)                                                                                  # Standard deviation
 
     return var, dev 
@@ -154,17 +178,28 @@ def background(bkg_path, image_extension):
 #           - frame_name: image name
 #           - frame: the acquired image
 #           - label: boolean value to perform the variance selection or not
+#           - pipeline: (optional) AcquisitionPipeline object; if provided, the image is queued to the writer pool instead of being written in place
+#           - metadata: (optional) dictionary of per-frame metadata (index, timestamp, variance, exposure) passed to the storage backend
+#           - detector: (optional) detector stage (see object_detector) replacing the global variance comparison; the detection score and bounding box
+#                       are added to 'metadata' ('score', 'bbox')
+#           - ring: (optional) PreTriggerRing object (see pretrigger_ring); if provided, every image is handed over to the ring, which queues the selected
+#                   images together with the images just before and after them
 #
-# Return:   - save_status: boolean value (TRUE if the image has been saved, FALSE otherwise)
+# Return:   - save_status: boolean value (TRUE if the image has been saved or queued, FALSE otherwise)
+
+def variance_selection(bkg_var, img_var, var_treshold, save_path, frame_name, frame, label, pipeline=None, metadata=None, detector=None, ring=None):
 
-def variance_selection(bkg_var, img_var, var_treshold, save_path, frame_name, frame, label):
+    hit = True
+    if label==True and detector is not None:                                                            # Pluggable detector stage
+        hit, bbox, score = detector(frame, img_var)
+        if metadata is not None: metadata['score'], metadata['bbox'] = score, bbox
+    elif label==True and ((abs(img_var - bkg_var)/img_var)*100) < var_treshold: hit = False
 
-    if label==True:
-        if ((abs(img_var - bkg_var)/img_var)*100) >= var_treshold: save_status = cv2.imwrite(save_path+frame_name, np.array(frame)) 
-        else: save_status = False
+    if ring is not None: return ring.push(save_path+frame_name, frame, metadata, hit)                   # Event context kept by the pre-trigger ring
+    if not hit: return False
 
-    elif label==False:
-        save_status = cv2.imwrite(save_path+frame_name, np.array(frame))
+    if pipeline is not None: save_status = pipeline.submit(save_path+frame_name, frame, metadata)       # Asynchronous write through the acquisition pipeline
+    else: save_status = cv2.imwrite(save_path+frame_name, frame)
 
     return save_status
     
@@ -173,31 +208,58 @@ def variance_selection(bkg_var, img_var, var_treshold, save_path, frame_name, fr
 # Image control method:
 # performs some statistics on the acquired image, before saving it; the minimum and maximum value, the average one and the standard deviation are computed, as well as
 # the number of pixels with value exactly equal to 0 and the number of saturated pixels; these results are reported in the command line while the scipt is running
+# (by the logger thread, as an 'image_check' event, if 'log_file' is a RunLogger). All the statistics are derived from a single histogram of the pixel values
+# (one np.bincount pass, see frame_statistics), which is also returned for the exposure tuning: if the histogram of the frame is already available (eg: the
+# one computed by FrameStatistics for the frame variance), it is reused and the check costs no additional pass on the image.
 #
 # Input:    - img: image to be analyzed
-#           - log_file: output file
+#           - log_file: output file (or RunLogger object)
+#           - roi: (optional) region of interest (y_start, y_stop, x_start, x_stop), eg: the one of the camera FrameStatistics; if None, the whole image
+#           - index: (optional) image number, reported in the header of the check
+#           - hist: (optional) histogram of the pixel values of the region of interest, computed beforehand
+#           - stride: subsampling step along both image axes of the histogram (1 = every pixel)
+#           - level: level of the 'image_check' event of a RunLogger ('debug': written in the log files, not printed on the terminal)
 #
-# Return:   - None
+# Return:   - stats: dictionary with the image statistics and the histogram of the pixel values ('histogram')
 
-def image_check(img, log_file):
+def image_check(img, log_file, roi=None, index=None, hist=None, stride=1, level='info'):
+
+    if hist is None: hist = image_histogram(img, roi, stride)                                           # Single pass on the pixels
+    stats = histogram_statistics(hist)
+    m, M, avg, dev_std, n_null, n_sat = stats['min'], stats['max'], stats['mean'], stats['std'], stats['null_pixels'], stats['saturated_pixels']
+    stats['index'] = index
+
+    if hasattr(log_file, 'log'):                                                                        # Structured event, printed and written by the logger thread
+        message = ('Image check - Image number:\t\t\t'+str(index)+'\n' if index is not None else '')
+        message += ('\t\t- Minimum image value:\t\t'+str(m)+'\n\t\t- Maximum image value:\t\t'+str(M)+'\n\t\t- Average image value:\t\t'+
+                    '{:.3f}'.format(avg)+'\n\t\t- Image Std deviation:\t\t'+'{:.3f}'.format(dev_std)+'\n\t\t- Number of NULL pixels:\t'+
+                    str(n_null)+'\n\t\t- Number of saturated pixels:\t'+str(n_sat)+'\n')
+        log_file.log(level, 'image_check', message, **stats)
+        stats['histogram'] = hist
+        return stats
+
+    stats['histogram'] = hist
+    if level == 'debug': return stats
+
+    if index is not None:
+        print(colored('\nImage check', 'yellow'), '\t- Image number:\t\t\t', index)
+        log_file.write('\nImage check - Image number:\t\t\t\t\t'+str(index)+'\n')
 
-    M, m, avg, dev_std = int(img[100:850, 300:1050].max()), int(img[100:850, 300:1050].min()), np.mean(img[100:850, 300:1050]), img[100:850, 300:1050].std()
-    idx_null = np.where(img[100:850, 300:1050]==0.0)[0]
-    idx_sat = np.where(img[100:850, 300:1050]==255.0)[0]
-    
     print('\t\t- Minimum image value:\t\t', m)
     print('\t\t- Maximum image value:\t\t', M)
     print('\t\t- Average image value:\t\t', '{:.3f}'.format(avg))
     print('\t\t- Image Std deviation:\t\t', '{:.3f}'.format(dev_std))
-    print('\t\t- Number of NULL pixels:\t', len(idx_null))
-    print('\t\t- Number of saturated pixels:\t', len(idx_sat), '\n')
+    print('\t\t- Number of NULL pixels:\t', n_null)
+    print('\t\t- Number of saturated pixels:\t', n_sat, '\n')
 
     log_file.write('\t\t\t- Minimum image value:\t\t\t'+str(m)+'\n')
     log_file.write('\t\t\t- Maximum image value:\t\t\t'+str(M)+'\n')
     log_file.write('\t\t\t- Average image value:\t\t\t'+'{:.3f}'.format(avg)+'\n')
     log_file.write('\t\t\t- Image Std deviation:\t\t\t'+'{:.3f}'.format(dev_std)+'\n')
-    log_file.write('\t\t\t- Number of NULL pixels:\t\t'+str(len(idx_null))+'\n')
-    log_file.write('\t\t\t- Number of saturated pixels:\t'+str(len(idx_sat))+'\n\n')
+    log_file.write('\t\t\t- Number of NULL pixels:\t\t'+str(n_null)+'\n')
+    log_file.write('\t\t\t- Number of saturated pixels:\t'+str(n_sat)+'\n\n')
+
+    return stats
 
 
 ######################################################################################################################################################################
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, threading, time, unittest                                                               # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+import numpy as np
+from acquisition_pipeline import AcquisitionPipeline
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Acquisition pipeline tests:
+# drop policies with a full ring buffer (one writer held on the first frame, two slots) and counters of the writer save status.
+#
+#       python3 -m unittest discover tests
+
+
+class SlowWriter(object):                                                                               # Writer held on each frame until 'release' is called
+
+    def __init__(self):
+
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.written = []
+
+
+    def __call__(self, path, frame, metadata):
+
+        self.started.set()
+        self.released.wait()
+        self.written.append(path)
+
+        return True
+
+
+class AcquisitionPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.frame = np.zeros((8, 8, 1), dtype=np.uint8)
+        self.writer = SlowWriter()
+
+
+    def fill(self, drop_policy):                                                                        # First frame held by the writer, second frame queued: ring full
+
+        pipeline = AcquisitionPipeline(queue_depth=2, n_writers=1, drop_policy=drop_policy, writer=self.writer)
+        self.assertTrue(pipeline.submit('frame_1', self.frame))
+        self.assertTrue(self.writer.started.wait(5))
+        self.assertTrue(pipeline.submit('frame_2', self.frame))
+
+        return pipeline
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def test_unknown_policy(self):
+
+        self.assertRaises(ValueError, AcquisitionPipeline, drop_policy='drop_all')
+
+
+    def test_block(self):                                                                               # The capture thread waits for a free slot, no frame is lost
+
+        pipeline = self.fill('block')
+        capture = threading.Thread(target=pipeline.submit, args=('frame_3', self.frame), daemon=True)
+        capture.start()
+        time.sleep(0.1)
+        self.assertTrue(capture.is_alive())
+
+        self.writer.released.set()
+        capture.join(5)
+        self.assertFalse(capture.is_alive())
+        pipeline.close()
+        self.assertEqual(self.writer.written, ['frame_1', 'frame_2', 'frame_3'])
+        self.assertEqual(pipeline.stats()['dropped'], 0)
+
+
+    def test_drop_newest(self):                                                                         # The incoming frame is discarded
+
+        pipeline = self.fill('drop_newest')
+        self.assertFalse(pipeline.submit('frame_3', self.frame))
+
+        self.writer.released.set()
+        pipeline.close()
+        self.assertEqual(self.writer.written, ['frame_1', 'frame_2'])
+        stats = pipeline.stats()
+        self.assertEqual((stats['submitted'], stats['queued'], stats['written'], stats['dropped']), (3, 2, 2, 1))
+
+
+    def test_drop_oldest(self):                                                                         # The oldest queued frame is discarded and its slot reused
+
+        pipeline = self.fill('drop_oldest')
+        self.assertTrue(pipeline.submit('frame_3', self.frame))
+
+        self.writer.released.set()
+        pipeline.close()
+        self.assertEqual(self.writer.written, ['frame_1', 'frame_3'])
+        stats = pipeline.stats()
+        self.assertEqual((stats['submitted'], stats['queued'], stats['written'], stats['dropped']), (3, 3, 2, 1))
+
+
+    def test_save_status(self):                                                                         # True: written, None: discarded on purpose, False or error: failed
+
+        def writer(path, frame, metadata):
+            if path == 'error': raise IOError(path)
+            return {'written': True, 'discarded': None, 'failed': False}[path]
+
+        pipeline = AcquisitionPipeline(queue_depth=4, n_writers=1, writer=writer)
+        for path in ('written', 'discarded', 'failed', 'error'): self.assertTrue(pipeline.submit(path, self.frame))
+        pipeline.close()
+        stats = pipeline.stats()
+        self.assertEqual((stats['written'], stats['discarded'], stats['failed'], stats['dropped']), (1, 1, 2, 0))
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    unittest.main()
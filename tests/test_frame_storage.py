@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, json, shutil, tempfile, unittest                                                        # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+import numpy as np
+from frame_storage import RawFrameLog, open_raw_log, RAW_INDEX_DTYPE
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Raw frame log tests:
+# frames read back by 'open_raw_log' from a closed log and from a log that was not closed (frame count from the header, from the complete index records
+# and from the size of the raw file).
+#
+#       python3 -m unittest discover tests
+
+
+SHAPE = (4, 6, 1)
+
+
+def make_frame(i):                                                                                      # Frame filled with its own index
+
+    return np.full(SHAPE, i, dtype=np.uint8)
+
+
+class RawFrameLogTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.log = RawFrameLog(self.folder, frame_shape=SHAPE, capacity=8)
+
+
+    def tearDown(self):
+
+        self.log.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+    def write(self, n_frames, flush=True):
+
+        for i in range(n_frames): self.assertTrue(self.log(os.path.join(self.folder, 'image_%06d.tif' % (i + 1)), make_frame(i + 1), {'index': i + 1}))
+        if flush:                                                                                       # Index and frames on disk, as after the periodic flush
+            self.log.index_file.flush()
+            self.log.frames.flush()
+
+
+    def check(self, n_frames):
+
+        frames, index = open_raw_log(self.folder)
+        self.assertEqual(frames.shape, (n_frames,)+SHAPE)
+        self.assertEqual(len(index), n_frames)
+        for i in range(n_frames):
+            self.assertTrue(np.all(frames[i] == i + 1))
+            self.assertEqual(index['index'][i], i + 1)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def test_closed_log(self):
+
+        self.write(3)
+        self.log.close()
+        raw_size = os.path.getsize(os.path.join(self.folder, 'frames.raw'))
+        self.assertEqual(raw_size, 3*int(np.prod(SHAPE)))                                               # Preallocated frames dropped
+        self.check(3)
+
+
+    def test_not_closed(self):                                                                          # No frame count in the header: frames with a complete record
+
+        self.write(3)
+        with open(os.path.join(self.folder, 'frames.json')) as header: self.assertIsNone(json.load(header)['count'])
+        self.check(3)
+
+
+    def test_truncated_record(self):                                                                    # Last index record only partially written
+
+        self.write(3)
+        index_path = os.path.join(self.folder, 'frames.idx')
+        with open(index_path, 'r+b') as index_file: index_file.truncate(3*RAW_INDEX_DTYPE.itemsize - 5)
+        self.check(2)
+
+
+    def test_stale_header_count(self):                                                                  # Header count larger than the index records
+
+        self.write(3)
+        self.log.close()
+        header_path = os.path.join(self.folder, 'frames.json')
+        with open(header_path) as header: header_data = json.load(header)
+        header_data['count'] = 5
+        with open(header_path, 'w') as header: json.dump(header_data, header)
+        self.check(3)
+
+
+    def test_short_raw_file(self):                                                                      # Raw file shorter than the index
+
+        self.write(3)
+        self.log.close()
+        with open(os.path.join(self.folder, 'frames.raw'), 'r+b') as raw_file: raw_file.truncate(2*int(np.prod(SHAPE)) + 1)
+        self.check(2)
+
+
+    def test_empty_log(self):
+
+        self.log.close()
+        self.check(0)
+
+        empty_folder = os.path.join(self.folder, 'empty')                                               # Frame shape never known
+        RawFrameLog(empty_folder).close()
+        frames, index = open_raw_log(empty_folder)
+        self.assertEqual(len(frames), 0)
+        self.assertEqual(len(index), 0)
+
+        os.remove(os.path.join(empty_folder, 'frames.json'))                                            # No header: nothing was ever written
+        self.assertRaises(IOError, open_raw_log, empty_folder)
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    unittest.main()
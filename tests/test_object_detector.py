@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, unittest                                                                                # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+import numpy as np
+from object_detector import TileDetector
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Tile detector tests:
+# small object on a noisy background (hit and bounding box), background noise only (miss), frame size change and missing background.
+#
+#       python3 -m unittest discover tests
+
+
+SHAPE = (128, 128, 1)
+NOISE = 2.0                                                                                             # Background standard deviation
+
+
+class TileDetectorTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.random = np.random.RandomState(0)
+        self.mean = np.full(SHAPE, 100.0, dtype=np.float32)
+        self.var = np.full(SHAPE, NOISE**2, dtype=np.float32)
+
+
+    def frame(self, box=None):                                                                          # Noisy background frame, with a bright square in 'box' (x0, y0, x1, y1)
+
+        frame = self.mean + self.random.normal(0.0, NOISE, SHAPE)
+        if box is not None: frame[box[1]:box[3], box[0]:box[2]] += 50
+        return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def test_hit(self):
+
+        for var in (self.var, None):                                                                    # Tile noise from the background variance or from the frame
+            detector = TileDetector(tile=8, threshold=4.0, stride=2)
+            detector.set_background(self.mean, var)
+            hit, bbox, score = detector(self.frame((64, 32, 84, 52)))
+            self.assertTrue(hit)
+            self.assertEqual(bbox, (64, 32, 96, 64))                                                    # Whole tiles of 16 pixels
+            self.assertGreater(score, 4.0)
+
+
+    def test_miss(self):
+
+        detector = TileDetector(tile=8, threshold=4.0, stride=2)
+        detector.set_background(self.mean, self.var)
+        for i in range(5):
+            hit, bbox, score = detector(self.frame())
+            self.assertFalse(hit)
+            self.assertIsNone(bbox)
+
+        detector = TileDetector(tile=8, threshold=4.0, min_tiles=8, stride=2)                           # Object smaller than 'min_tiles'
+        detector.set_background(self.mean, self.var)
+        self.assertFalse(detector(self.frame((64, 32, 84, 52)))[0])
+
+
+    def test_frame_size_change(self):                                                                   # Frames of a different readout are kept
+
+        detector = TileDetector(tile=8, stride=2)
+        detector.set_background(self.mean, self.var)
+        hit, bbox, score = detector(np.zeros((64, 64, 1), dtype=np.uint8))
+        self.assertTrue(hit)
+        self.assertIsNone(bbox)
+        self.assertTrue(np.isnan(score))
+
+
+    def test_background(self):
+
+        detector = TileDetector(tile=8, stride=2)
+        self.assertRaises(RuntimeError, detector, self.frame())
+        self.assertRaises(ValueError, detector.set_background, np.zeros((8, 8, 1), dtype=np.float32))
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, unittest                                                                                # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+import numpy as np
+from pretrigger_ring import PreTriggerRing
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Pre-trigger ring tests:
+# context frames queued around each event (pre-event frames oldest first, hit frame, post-event frames), counters of the queued and not queued frames and
+# 'post_event' flag of the last pushed frame.
+#
+#       python3 -m unittest discover tests
+
+
+class Pipeline(object):                                                                                 # Records the submitted frames; 'queued' is the submit result
+
+    def __init__(self, queued=True):
+
+        self.queued = queued
+        self.submitted = []
+
+
+    def submit(self, path, frame, metadata=None):
+
+        self.submitted.append((path, int(frame[0, 0, 0]), metadata['role']))
+
+        return self.queued
+
+
+class PreTriggerRingTest(unittest.TestCase):
+
+    def push(self, ring, i, hit=False):                                                                 # Frame filled with its own index
+
+        return ring.push('frame_'+str(i), np.full((4, 4, 1), i, dtype=np.uint8), {'index': i}, hit)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def test_event_context(self):
+
+        pipeline = Pipeline()
+        ring = PreTriggerRing(pipeline, pre_frames=2, post_frames=2)
+        for i in (1, 2, 3): self.assertFalse(self.push(ring, i))                                        # Frame 1 overwritten by frame 3
+        self.assertTrue(self.push(ring, 4, hit=True))
+        self.assertFalse(ring.post_event)
+        for i in (5, 6):
+            self.assertFalse(self.push(ring, i))
+            self.assertTrue(ring.post_event)
+        self.assertFalse(self.push(ring, 7))                                                            # Back in the ring
+        self.assertFalse(ring.post_event)
+
+        self.assertEqual(pipeline.submitted, [('frame_2', 2, 'pre'), ('frame_3', 3, 'pre'), ('frame_4', 4, 'hit'), ('frame_5', 5, 'post'), ('frame_6', 6, 'post')])
+        counters = ring.counters
+        self.assertEqual((counters['events'], counters['hits'], counters['pre_saved'], counters['post_saved']), (1, 1, 2, 2))
+        self.assertEqual((counters['discarded'], counters['not_queued']), (1, 0))
+
+
+    def test_consecutive_hits(self):                                                                    # A hit during the post-event frames continues the same event
+
+        pipeline = Pipeline()
+        ring = PreTriggerRing(pipeline, pre_frames=2, post_frames=2)
+        self.push(ring, 1, hit=True)
+        self.push(ring, 2)
+        self.push(ring, 3, hit=True)
+
+        self.assertEqual(ring.counters['events'], 1)
+        self.assertEqual(ring.counters['hits'], 2)
+        self.assertEqual([role for path, value, role in pipeline.submitted], ['hit', 'post', 'hit'])
+
+
+    def test_not_queued(self):                                                                          # Frames dropped by the pipeline are not counted as saved
+
+        pipeline = Pipeline(queued=False)
+        ring = PreTriggerRing(pipeline, pre_frames=2, post_frames=1)
+        self.push(ring, 1)
+        self.assertFalse(self.push(ring, 2, hit=True))
+        self.push(ring, 3)
+        self.assertFalse(ring.post_event)
+
+        counters = ring.counters
+        self.assertEqual((counters['pre_saved'], counters['post_saved'], counters['not_queued']), (0, 0, 2))
+
+
+    def test_ram_budget(self):                                                                          # Ring smaller than 'pre_frames' if the budget is exceeded
+
+        pipeline = Pipeline()
+        ring = PreTriggerRing(pipeline, pre_frames=5, post_frames=0, ram_budget=32e-6)                  # 32 bytes: two 4x4 frames
+        for i in (1, 2, 3): self.push(ring, i)
+        self.push(ring, 4, hit=True)
+
+        self.assertEqual(ring.capacity, 2)
+        self.assertEqual([path for path, value, role in pipeline.submitted], ['frame_2', 'frame_3', 'frame_4'])
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    unittest.main()
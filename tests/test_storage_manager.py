@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Sep 22, 2022
+
+@author: Luca Teruzzi
+"""
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+import sys, os, shutil, tempfile, unittest                                                              # Import required libraries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'methods'))
+from storage_manager import StorageManager
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+# Storage manager tests:
+# run folder on a storage root that does not exist yet (eg: the default storage_root or the README example) and on targets without enough free space.
+#
+#       python3 -m unittest discover tests
+
+
+class Frame(object):                                                                                    # Minimal frame: only its size is used by the manager
+
+    nbytes = 1024
+
+
+class StorageManagerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+
+
+    def test_fresh_root(self):
+
+        root = os.path.join(self.folder, 'rvrun', 'out')+'/'
+        storage = StorageManager([root], min_free=1)
+        storage.targets[0].refresh()
+        self.assertGreater(storage.targets[0].free, 0)
+
+        run_path = storage.prepare_run('run')
+        for subfolder in ('data', 'log_files', 'background'): self.assertTrue(os.path.isdir(os.path.join(run_path, subfolder)))
+
+        written = []
+        storage.open_writer(lambda folder: lambda path, frame, metadata: written.append(path) or True)
+        self.assertTrue(storage(os.path.join(run_path, 'data', 'image_000001.tiff'), Frame()))
+        self.assertEqual(storage.counters['dropped'], 0)
+        self.assertEqual(len(written), 1)
+
+
+    def test_no_free_space(self):
+
+        storage = StorageManager([os.path.join(self.folder, 'full')+'/'], min_free=1e12)
+        run_path = storage.prepare_run('run')
+        self.assertTrue(os.path.isdir(os.path.join(run_path, 'log_files')))
+
+        storage.open_writer(lambda folder: lambda path, frame, metadata: True)
+        self.assertIsNone(storage(os.path.join(run_path, 'data', 'image_000001.tiff'), Frame()))
+        self.assertEqual(storage.counters['dropped'], 1)
+        self.assertEqual(storage.counters['failed'], 0)
+
+
+######################################################################################################################################################################
+######################################################################################################################################################################
+
+
+if __name__ == '__main__':
+
+    unittest.main()